@@ -17,6 +17,9 @@ from analyzer.notifier import *
 from config import config
 from analyzer.git_commit_linker import *
 from sqlalchemy import Date, cast 
+import json
+
+LINK_BATCH_SIZE = 5000 # number of bug introducing commits updated per statement
 
 def analyze(repo_id):
 	"""
@@ -56,22 +59,17 @@ def analyzeRepo(repository_to_analyze, session):
 
 	logging.info('Worker analyzing repository id ' + repo_id)
 
-	# all commits in descending order
-	all_commits = (session.query(Commit)
-				.filter( Commit.repository_id == repo_id)
-				.order_by( Commit.author_date_unix_timestamp.desc())
-				.all()
-				)
-
 	# corrective commits in ascending order 
 	# if updating, only get the corrective commits that have not been linked yet.
 	# No need to re-link corrective commits that have already been linked with the bug-inducing commit.
-	corrective_commits = (session.query(Commit)
-				.filter( 
-					( Commit.fix == "True" ) &
-					( Commit.repository_id == repo_id ) &
-					( Commit.linked == False )
-				)
+	# Only the columns the linker needs are loaded, not whole commits.
+	not_linked = (
+		( Commit.fix == "True" ) &
+		( Commit.repository_id == repo_id ) &
+		( Commit.linked == False )
+	)
+	corrective_commits = (session.query(Commit.commit_hash, Commit.fileschanged)
+				.filter(not_linked)
 				.order_by( Commit.author_date_unix_timestamp.asc() )
 				.all()
 				)
@@ -80,9 +78,25 @@ def analyzeRepo(repository_to_analyze, session):
 
 	try:
 		git_commit_linker = GitCommitLinker(repo_id)
-		git_commit_linker.linkCorrectiveCommits(corrective_commits, all_commits)
+		linked_commits = git_commit_linker.linkCorrectiveCommits(corrective_commits)
+
+		saveBugLinks(session, repo_id, linked_commits)
+
+		# mark that we have linked these corrective commits. Only the ones linked here: fixes
+		# ingested or relinked since they were read are left for the next analysis.
+		corrective_hashes = [commit.commit_hash for commit in corrective_commits]
+		for start in range(0, len(corrective_hashes), LINK_BATCH_SIZE):
+			(session.query(Commit)
+				.filter(
+					( Commit.repository_id == repo_id ) &
+					( Commit.commit_hash.in_(corrective_hashes[start:start + LINK_BATCH_SIZE]) )
+				)
+				.update({Commit.linked: True}, synchronize_session=False))
+		session.commit()
+
 	except Exception as e:
 		logging.exception("Got an exception linking bug fixing changes to bug inducing changes for repo " + repo_id)
+		session.rollback()
 		repository_to_analyze.status = "Error"
 		session.commit() # update repo status
 		raise
@@ -91,3 +105,41 @@ def analyzeRepo(repository_to_analyze, session):
 	if repository_to_analyze.status != "Error":
 		repository_to_analyze.status = "In Queue to Build Model"
 		session.commit() # update repo status
+
+def saveBugLinks(session, repo_id, linked_commits):
+	"""
+	Marks the bug introducing commits found by the linker as containing a bug, adding the
+	corrective commits that fix them to the ones already in their fixes. Each batch of commits
+	is read and updated with one statement each, so only the linked commits are loaded.
+	@param session			SQLAlchemy session
+	@param repo_id			The repository the commits belong to
+	@param linked_commits	dict of buggy commit hash -> [corrective commit hashes]
+	@private
+	"""
+	buggy_hashes = list(linked_commits.keys())
+	connection = session.connection()
+	num_marked = 0
+
+	for start in range(0, len(buggy_hashes), LINK_BATCH_SIZE):
+		batch = buggy_hashes[start:start + LINK_BATCH_SIZE]
+
+		# blame may name commits that are not in this repo's table, e.g. a root commit as ^hash
+		existing = (session.query(Commit.commit_hash, Commit.fixes)
+					.filter(
+						( Commit.repository_id == repo_id ) &
+						( Commit.commit_hash.in_(batch) )
+					)
+					.all())
+
+		rows = []
+		for commit_hash, fixes in existing:
+			all_fixes = json.loads(fixes) if fixes else []
+			for fix_hash in linked_commits[commit_hash]:
+				if fix_hash not in all_fixes:
+					all_fixes.append(fix_hash)
+
+			rows.append({'commit_hash': commit_hash, 'contains_bug': True, 'fixes': json.dumps(all_fixes)})
+
+		num_marked += bulkUpdate(connection, Commit.__table__, 'commit_hash', rows)
+
+	logging.info("Marked " + str(num_marked) + " bug introducing commits for repo " + repo_id)
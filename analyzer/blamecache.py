@@ -0,0 +1,171 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from config import config
+
+class BlameCache:
+  """
+  caches the result of blaming a range of lines of a file at a revision, i.e.
+  the commit each line originates from. a revision is immutable, so a cached
+  answer never goes stale.
+
+  there are two tiers: an in-memory lru shared by every repository analyzed in
+  this process, and an sqlite file per repository that survives restarts so
+  that repeated and retried analyses of a repository skip the blames they
+  already did. both are bounded; the least recently used entries are evicted
+  first. call close() when done with the cache to write the recency of the
+  entries used and release the file.
+  """
+
+  CACHE_DIR = "ingester/CASRepos/blame/" # location where the on-disk caches are stored
+  MEMORY_SIZE = 100000 # default number of ranges kept in memory, for all repositories
+  DISK_SIZE = 1000000 # default number of ranges kept on disk, per repository
+
+  _memory = OrderedDict() # (repo id, revision, path, start, end) -> tuple of commit hashes
+  _memory_lock = threading.Lock()
+
+  def __init__(self, repoId):
+    """
+    constructor
+    opens (or creates) the on-disk cache of the repository.
+    """
+    self.repo_id = repoId
+    self.memory_size = int(config['system'].get('blame_cache_size', self.MEMORY_SIZE))
+    self.disk_size = int(config['system'].get('blame_cache_disk_size', self.DISK_SIZE))
+
+    self.hits = 0 # answered from memory
+    self.disk_hits = 0 # answered from disk
+    self.misses = 0 # had to run git blame
+
+    cache_dir = os.path.join(os.path.dirname(__file__), '..', self.CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(os.path.join(cache_dir, repoId + ".sqlite"), check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL") # commits don't wait for the disk; a crash only loses the latest entries
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.execute("CREATE TABLE IF NOT EXISTS blame (key TEXT PRIMARY KEY, origins TEXT, accessed INTEGER NOT NULL DEFAULT 0)")
+
+    # caches written before entries had a recency
+    if "accessed" not in [column[1] for column in self.db.execute("PRAGMA table_info(blame)")]:
+      self.db.execute("ALTER TABLE blame ADD COLUMN accessed INTEGER NOT NULL DEFAULT 0")
+    self.db.execute("CREATE INDEX IF NOT EXISTS blame_accessed ON blame (accessed)")
+    self.db.commit()
+
+    self.disk_count = self.db.execute("SELECT COUNT(*) FROM blame").fetchone()[0]
+    self.clock = self.db.execute("SELECT COALESCE(MAX(accessed), 0) FROM blame").fetchone()[0] # last recency given out
+    self.touched = {} # on-disk key -> recency of the entries used since the last write
+
+  def get(self, revision, path, start, end):
+    """
+    returns the commit hashes lines start to end of path were last changed in
+    as of revision, one per line, or None if that range was never blamed.
+    """
+    key = (self.repo_id, revision, path, start, end)
+
+    with self._memory_lock:
+      origins = self._memory.get(key)
+      if origins is not None:
+        self._memory.move_to_end(key)
+
+    if origins is not None:
+      with self.lock:
+        self.hits += 1
+        self._touch(key)
+      return list(origins)
+
+    with self.lock:
+      row = self.db.execute("SELECT origins FROM blame WHERE key = ?", (self._diskKey(key),)).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      self.disk_hits += 1
+      self._touch(key)
+
+    origins = json.loads(row[0])
+    self._remember(key, origins)
+    return origins
+
+  def put(self, revision, path, start, end, origins):
+    """
+    stores the commit hashes lines start to end of path originate from as of
+    revision.
+    """
+    key = (self.repo_id, revision, path, start, end)
+    self._remember(key, origins)
+
+    with self.lock:
+      # a revision never changes, so an entry that is already there (e.g. put by another
+      # thread blaming the same range) holds the same origins and is only used again
+      self.clock += 1
+      inserted = self.db.execute("INSERT OR IGNORE INTO blame (key, origins, accessed) VALUES (?, ?, ?)",
+        (self._diskKey(key), json.dumps(origins), self.clock)).rowcount
+      if inserted == 1:
+        self.disk_count += 1
+      else:
+        self._touch(key)
+      self._writeTouched()
+
+      # evict the least recently used tenth once the cache is full, rather than a row per insert
+      if self.disk_count > self.disk_size:
+        self.db.execute("DELETE FROM blame WHERE key IN (SELECT key FROM blame ORDER BY accessed LIMIT ?)",
+          (self.disk_count - self.disk_size + self.disk_size // 10,))
+        self.disk_count = self.db.execute("SELECT COUNT(*) FROM blame").fetchone()[0]
+
+      self.db.commit()
+
+  def close(self):
+    """
+    writes the recency of the entries used since the last put and closes the on-disk cache.
+    """
+    with self.lock:
+      if self.db is None:
+        return
+      self._writeTouched()
+      self.db.commit()
+      self.db.close()
+      self.db = None
+
+  def stats(self):
+    """
+    returns a one line summary of the hit/miss counters, for logging.
+    """
+    with self.lock:
+      return (str(self.hits + self.disk_hits) + " hits (" + str(self.disk_hits) + " from disk), " +
+        str(self.misses) + " misses")
+
+  def _touch(self, key):
+    """
+    marks an entry as just used. the recency is written to disk with the next put, or on
+    close, rather than with a write per hit. must be called with the lock held.
+    """
+    self.clock += 1
+    self.touched[self._diskKey(key)] = self.clock
+
+  def _writeTouched(self):
+    """
+    writes the recency of the entries used since the last write. must be called with the
+    lock held.
+    """
+    if len(self.touched) > 0:
+      self.db.executemany("UPDATE blame SET accessed = ? WHERE key = ?",
+        [(accessed, disk_key) for disk_key, accessed in self.touched.items()])
+      self.touched = {}
+
+  def _remember(self, key, origins):
+    """
+    adds an entry to the in-memory lru, evicting the least recently used one if full.
+    """
+    with self._memory_lock:
+      self._memory[key] = tuple(origins)
+      self._memory.move_to_end(key)
+      while len(self._memory) > self.memory_size:
+        self._memory.popitem(last=False)
+
+  def _diskKey(self, key):
+    """
+    returns the on-disk key of an entry; the file is already per repository.
+    """
+    return "\0".join(str(part) for part in key[1:])
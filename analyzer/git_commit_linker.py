@@ -3,8 +3,13 @@ import os
 import subprocess
 from orm.commit import *
 from caslogging import logging
-import json
+from analyzer.blamecache import *
+from analyzer.pathfilter import *
 import re
+import collections
+import concurrent.futures
+import threading
+from config import config
 
 class GitCommitLinker:
   """
@@ -21,6 +26,7 @@ class GitCommitLinker:
   """
 
   REPO_DIR = "ingester/CASRepos/git/" # locations where repo directories are stored
+  COMMIT_LINE = re.compile(b"^([0-9a-f]{40,64})((?: [0-9a-f]{40,64})*)\n$") # a commit hash and its parents, as printed by git diff-tree --stdin
 
   def __init__(self, repoId):
     """
@@ -29,152 +35,228 @@ class GitCommitLinker:
     """
     self.repo_path = os.path.join(os.path.dirname(__file__), '..', self.REPO_DIR + repoId)
     self.repo_id = repoId
+    self.blame_cache = BlameCache(repoId)
+    self.path_filter = PathFilter(self.repo_path)
 
-  def linkCorrectiveCommits(self, corrective_commits, all_commits):
+    # git runs in its own processes, so threads are enough to keep several of them busy
+    self.workers = int(config['system'].get('link_workers', 1))
+
+  def linkCorrectiveCommits(self, corrective_commits):
     """
     links all corrective changes/commits to the change that introduced the problem
     note: a bug introducing change may have introduced more than one bug.
+
+    returns a dict of buggy commit hash -> [hashes of the corrective commits that fix it]. it is
+    up to the caller to store it and to mark the corrective commits as linked.
+
+    @corrective_commits - the corrective commits to link, with their commit_hash and fileschanged
     """
 
     linked_commits = {} # dict of buggy commit hash -> [corrective commits]
 
-    # find all bug introducing commits
-    for corrective_commit in corrective_commits:
-      buggy_commits = self._linkCorrectiveCommit(corrective_commit)
+    # commits that only touch files we don't link (docs, vendored code, etc.) can't be linked to
+    # anything, so don't even diff them
+    commits_to_link = [commit for commit in corrective_commits if self.path_filter.acceptsAny(commit.fileschanged)]
+    logging.info("Skipping " + str(len(corrective_commits) - len(commits_to_link)) +
+      " corrective commits without source code changes for repo " + self.repo_id)
 
-      for buggy_commit in buggy_commits:
-        
-        if buggy_commit in linked_commits:
-          linked_commits[buggy_commit].append(corrective_commit.commit_hash)
-        else:
-          linked_commits[buggy_commit] = [corrective_commit.commit_hash]
+    try:
+      # find all bug introducing commits
+      for corrective_commit, buggy_commits in self._linkAll(commits_to_link):
 
-      corrective_commit.linked = True # mark that we have linked this corrective commit.
+        for buggy_commit in buggy_commits:
+          
+          if buggy_commit in linked_commits:
+            linked_commits[buggy_commit].append(corrective_commit.commit_hash)
+          else:
+            linked_commits[buggy_commit] = [corrective_commit.commit_hash]
 
-    for commit in all_commits:
+    finally:
+      logging.info("Blame cache for repo " + self.repo_id + ": " + self.blame_cache.stats())
+      self.blame_cache.close()
 
-      if commit.commit_hash in linked_commits:
-        commit.contains_bug = True
-        commit.fixes = json.dumps(linked_commits[commit.commit_hash])
+    return linked_commits
 
+  def _linkAll(self, corrective_commits):
+    """
+    yields each corrective commit with its bug introducing changes, in the order given.
+    the modified regions of all of them are read from a single git process.
 
-  def _linkCorrectiveCommit(self, commit):
+    with more than one worker, up to twice as many commits as there are workers are linked
+    concurrently by a thread pool, but the results are still yielded in order, so the
+    linking is the same as when done one commit after another.
+    """
+    all_regions = self.getAllModifiedRegions(corrective_commits)
+
+    if self.workers <= 1:
+      for corrective_commit, parent, region_chunks in all_regions:
+        yield corrective_commit, self._linkCorrectiveCommit(corrective_commit, parent, region_chunks)
+      return
+
+    executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+    pending = collections.deque()
+
+    try:
+      for corrective_commit, parent, region_chunks in all_regions:
+        pending.append((corrective_commit, executor.submit(self._linkCorrectiveCommit, corrective_commit, parent, region_chunks)))
+
+        if len(pending) >= self.workers * 2:
+          oldest_commit, oldest = pending.popleft()
+          yield oldest_commit, oldest.result()
+
+      while pending:
+        oldest_commit, oldest = pending.popleft()
+        yield oldest_commit, oldest.result()
+
+    finally:
+      # don't start on the rest if linking failed
+      for corrective_commit, future in pending:
+        future.cancel()
+      executor.shutdown()
+      all_regions.close()
+
+  def _linkCorrectiveCommit(self, commit, parent, region_chunks):
     """
     links the corrective change/commit to the change/commit which was the
     cause. this is the purpose of this object
 
     @commit - the corrective change to link w/ the changes that introduces the
     problems/issues it fixes.
+    @parent - the hash of the commit's (first) parent
+    @region_chunks - the regions the commit modified, as returned by getModifiedRegions
     """
-    region_chunks = self.getModifiedRegions(commit)
-
     logging.info("Linkage for commit " + commit.commit_hash)
     for k,v in region_chunks.items():
       logging.info("-- file: " + k)
       logging.info("---- loc modified: " + str(v))
 
-    bug_introducing_changes = self.gitAnnotate(region_chunks, commit)
+    bug_introducing_changes = self.gitAnnotate(region_chunks, commit, parent)
     return bug_introducing_changes
 
-  def _getModifiedRegionsOnly(self, diff, files_modified):
+  def _getModifiedRegionsOnly(self, file_diffs):
     """
     returns a dict of file -> list of line numbers modified. helper function for getModifiedRegions
-    git diff doesn't provide a clean way of simply getting the specific lines that were modified, so we are doing so here 
-    manually. A possible refactor in the future may be to use an external diff tool, so that this implementation 
-    wouldn't be scm (git) specific.
 
     if a file was merely deleted, then there was no chunk or region changed but we do capture the file.
     however, we do not assume this is a location of a bug.
 
     modified means modified or deleted -- not added! We assume are lines of code modified is the location of a bug.
+
+    @file_diffs - (path, line numbers deleted) of each file of the diff, as yielded by _parseDiff
     """
     region_diff = {}
 
-    # only link code source files as any type of README, etc typically have HUGE changes and reduces 
-    # the performance to unacceptable levels. it's very hard to blacklist everything; much easier just to whitelist
-    # code source files endings.
-    list_ext_dir = os.path.join(os.path.dirname(__file__), "code_file_extentions.txt")
-    file_exts_to_include = open(list_ext_dir).read().splitlines()
+    for file, deleted_lines in file_diffs:
 
-    for file in files_modified:
+      # only link code source files as any type of README, etc typically have HUGE changes and reduces
+      # the performance to unacceptable levels. it's very hard to blacklist everything; much easier just to whitelist
+      # code source files endings.
+      if self.path_filter.accepts(file):
+        region_diff[file] = deleted_lines
 
-      # weed out bad files/binary files/etc
-      if file != "'" and file != "":
-        file_info = file.split(".")
-
-        # get extentions
-        if len(file_info) > 1:
-          file_ext = (file_info[1]).lower()
-
-          # ensure these source code file endings
-          if file_ext.upper() in file_exts_to_include:
-            region_diff[file] = []
-
-    # split all the different regions 
-    regions = diff.split("diff --git")[1:] # remove the clutter
-
-    # Next, we study each region to get file that was modified & the lines modified so we can annotate them later
-    for region in regions:
-
-      # We begin by splitting on the beginning of double at characters, which gives us an array looking like this:
-      # [file info, line info {double at characters} modified code]
-      chunks_initial = region.split(":CAS_DELIMITER_START:@@")
+    return region_diff
 
-      # if a binary file it doesn't display the lines modified (a.k.a the 'line info {double at characters} modified code' part)
-      if len(chunks_initial) == 1:
-        continue
+  def _parseDiff(self, diff_lines):
+    """
+    parses the lines (bytes) of a git diff --unified=0 as they are read and yields a tuple of
+    (path in the parent, list of line numbers deleted or modified in the parent) per file.
+    files added by the diff, binary files and files whose mode or name only changed have no lines.
 
-      file_info = chunks_initial[0] # file info is the first 'chunk', followed by the line_info {double at characters} modified code
-      file_info_split = file_info.split(" ")
-      file_name = file_info_split[1][2:] # remove the 'a/ character'
+    paths are taken from the '---' header when there is one, as the 'diff --git' line is
+    ambiguous for paths with spaces, and are unquoted when git quoted them.
+    """
+    path = None # path of the current file in the parent
+    deleted_lines = None # lines deleted from the current file, None between files
+    in_hunk = False
 
-      # it is possible there is a binary file being tracked or something we shouldn't care about  
-      if file_name == None or file_name not in region_diff:
-        continue
+    for diff_line in diff_lines:
 
-      # Next, we must know the lines modified so that we can annotate. To do this, we must further split the chunks_initial.
-      # Specifically, we must seperate the line info from the code info. The second part of the initial chunk looks like
-      # -101,30, +202,33 {double at characters} code modified info. We can be pretty certain that the line info doesnt contain
-      # any at characters, so we can safely split the first set of doule at characters seen to divide this info up.
+      if diff_line.startswith(b"diff --git "):
+        if deleted_lines is not None:
+          yield path, deleted_lines
+        path = self._headerPath(diff_line[len(b"diff --git "):].rstrip(b"\n"))
+        deleted_lines = []
+        in_hunk = False
 
-      # Iterate through - as in one file we can multiple sections modified.  
-      for chunk in range(1, len(chunks_initial), 1):
+      elif deleted_lines is None:
+        continue # nothing of interest before the first file
 
-        code_info_chunk = chunks_initial[chunk].split("@@",1) # split only on the first occurance of the double at characters
+      elif in_hunk and diff_line.startswith(b"-"):
+        # this line is deleted or modified in the parent
+        deleted_lines.append(current_line)
+        current_line += 1
 
-        line_info = code_info_chunk[0] # This now contains the -101,30 +102,30 part (info about the lines modified)
-        code_info = code_info_chunk[1] # This now contains the modified lines of code seperated by the delimiter we set
+      elif diff_line.startswith(b"@@ "):
+        # the hunk header looks like @@ -101,30 +202,33 @@; we only care about where the
+        # modification started in the parent
+        old_range = diff_line.split(b" ")[1]
+        current_line = int(old_range[1:].split(b",")[0])
+        in_hunk = True
 
-        # As we only care about modified lines of code, we must ignore the +/additions as they do exist in previous versions
-        # and thus, we cannot even annotate them (they were added in this commit). So, we only care about the start where it was 
-        # modified and we will have to study which lines where modified and keep track of them.
+      elif in_hunk:
+        continue # added lines and "\ No newline at end of file" don't exist in the parent
 
-        mod_line_info = line_info.split(" ")[1] # remove clutter -> we only care about what line the modificatin started, first index is just empty
-        mod_code_info = code_info.replace("\\n","").split(":CAS_DELIMITER:")[1:-1] # remove clutter -> first line contains info on the class and last line irrelevant
+      elif diff_line.startswith(b"--- "):
+        old_path = diff_line[4:].rstrip(b"\n")
 
-        # make sure this is legitimate. expect modified line info to start with '-'
-        if mod_line_info[0] != '-':
-          continue
+        # git ends names with spaces in them with a tab
+        if old_path.endswith(b"\t"):
+          old_path = old_path[:-1]
 
-        # remove comma from mod_line_info as we only care about the start of the modification
-        if mod_line_info.find(",") != -1:
-          mod_line_info = mod_line_info[0:mod_line_info.find(",")]
+        # an added file keeps its name from the 'diff --git' line
+        if old_path != b"/dev/null":
+          path = self._unquotePath(old_path)[2:] # remove the 'a/'
 
-        current_line = abs(int(mod_line_info)) # remove the '-' in front of the line number by abs
+      elif diff_line.startswith(b"rename from "):
+        path = self._unquotePath(diff_line[len(b"rename from "):].rstrip(b"\n"))
 
-        # now only use the code line changes that MODIFIES (not adds) in the diff
-        for section in mod_code_info:
+    if deleted_lines is not None:
+      yield path, deleted_lines
 
-          # this lines modifies or deletes a line of code
-          if section.startswith(":CAS_DELIMITER_START:-"):
-            region_diff[file_name].append(str(current_line))
+  def _headerPath(self, paths):
+    """
+    returns the path in the parent from the 'a/... b/...' part of a 'diff --git' line. it is
+    only used when there is no '---' line, i.e. for binary files and mode changes, which are
+    not renamed, so both paths are the same.
+    """
+    if paths.startswith(b'"'):
+      end = 1
+      while paths[end:end + 1] != b'"':
+        end += 2 if paths[end:end + 1] == b"\\" else 1
+      return self._unquotePath(paths[:end + 1])[2:]
 
-            # we only increment modified lines of code because we those lines did NOT exist
-            # in the previous commit!
-            current_line += 1 
+    return os.fsdecode(paths[2:(len(paths) - 5) // 2 + 2])
 
-    return region_diff
+  def _unquotePath(self, path):
+    """
+    returns a path as a string, undoing the c-style quoting git uses for paths with special
+    characters, such as "a/n\\303\\251.c".
+    """
+    if not path.startswith(b'"'):
+      return os.fsdecode(path)
+
+    escapes = {b"a": 7, b"b": 8, b"t": 9, b"n": 10, b"v": 11, b"f": 12, b"r": 13}
+    unquoted = bytearray()
+    index = 1
+
+    while index < len(path) - 1:
+      char = path[index:index + 1]
+      if char == b"\\":
+        char = path[index + 1:index + 2]
+        if char in escapes:
+          unquoted.append(escapes[char])
+          index += 2
+        elif char.isdigit():
+          unquoted.append(int(path[index + 1:index + 4], 8))
+          index += 4
+        else:
+          unquoted += char # \" or \\
+          index += 2
+      else:
+        unquoted += char
+        index += 1
 
+    return os.fsdecode(bytes(unquoted))
 
   def getModifiedRegions(self, commit):
     """
@@ -184,31 +266,120 @@ class GitCommitLinker:
     @commit - change to get the list of regions
     """
 
-    # diff cmd w/ no lines of context between current vs parent. 
-    # pipe it into bash and echo back with our own delimiter instead of new lines to seperate each line 
-    # of the git output to make parsing this a reality!
-    diff_cmd = "git diff " + commit.commit_hash + "^ "+ commit.commit_hash + " --unified=0 " \
-      + ' | while read; do echo ":CAS_DELIMITER_START:$REPLY:CAS_DELIMITER:"; done'
+    # diff cmd w/ no lines of context between current vs parent, parsed as git writes it
+    diff_cmd = ["git", "diff", "--src-prefix=a/", "--dst-prefix=b/", commit.commit_hash + "^", commit.commit_hash, "--unified=0"]
+    process = subprocess.Popen(diff_cmd, cwd= self.repo_path, stdout=subprocess.PIPE)
+
+    # now, let's get the file and the line number changed in the commit
+    regions = self._getModifiedRegionsOnly(self._parseDiff(process.stdout))
+    process.stdout.close()
+
+    if process.wait() != 0:
+      # The code change did not have a parent change!
+      return {}
+
+    return regions
 
-    # It is possible that a commit doesn't have a parent! i.e., merged from a clean branch.
+  def getParent(self, commit):
+    """
+    returns the hash of the (first) parent of a commit, or None for a root commit
+    """
     try:
-      diff = str(subprocess.check_output(diff_cmd, shell=True, cwd= self.repo_path, executable="/bin/bash" ))
+      parent = subprocess.check_output(["git", "rev-parse", "--verify", "-q", commit.commit_hash + "^"],
+        cwd= self.repo_path, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+      return None
+    return parent.strip().decode("ascii")
 
-      # files changed, this is used by the getLineNumbersChanged function
-      diff_cmd_lines_changed = "git diff " + commit.commit_hash + "^ "+ commit.commit_hash + " --name-only"
+  def getAllModifiedRegions(self, commits):
+    """
+    yields each commit with the hash of its (first) parent and its modified regions (as
+    returned by getModifiedRegions), in the order given, reading the diffs of all commits from
+    a single git diff-tree process instead of running git diff for each of them.
 
-      # get the files modified -> use this to validate if we have arrived at a new file
-      # when grepping for the specific lines changed.
-      files_modified = str( subprocess.check_output( diff_cmd_lines_changed, shell=True, cwd= self.repo_path )).replace("b'", "").split("\\n")
+    diff-tree prints each commit hash it reads and the hashes of its parents, followed by its
+    diff against its parent. root commits and merges have no diff, so, like before, they have
+    no regions.
 
-      # now, let's get the file and the line number changed in the commit
-      return self._getModifiedRegionsOnly(diff, files_modified)
+    @commits - the changes to get the regions of
+    """
+    diff_cmd = ["git", "diff-tree", "--stdin", "--always", "-r", "-p", "-M", "--unified=0",
+      "--src-prefix=a/", "--dst-prefix=b/", "--format=%H %P"]
+    process = subprocess.Popen(diff_cmd, cwd= self.repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    # feed the hashes from another thread so that neither pipe can fill up and block git
+    def writeHashes():
+      try:
+        for commit in commits:
+          process.stdin.write((commit.commit_hash + "\n").encode())
+      except BrokenPipeError:
+        pass # git failed or we stopped reading
+      finally:
+        try:
+          process.stdin.close()
+        except BrokenPipeError:
+          pass
+
+    writer = threading.Thread(target=writeHashes, daemon=True)
+    writer.start()
+
+    remaining = iter(commits)
+    current = None # commit whose diff is being read
+    parent = None # its first parent
+    diff_lines = []
+    done = 0 # number of commits yielded
+    finished = False
 
-    except:
-      # The code change did not have a parent change!
-      return {}
+    try:
+      for diff_line in process.stdout:
+
+        # a line with just a hash and its parents starts the diff of the next commit
+        commit_line = self.COMMIT_LINE.match(diff_line)
+        if commit_line is None:
+          diff_lines.append(diff_line)
+          continue
 
-  def gitAnnotate(self, regions, commit):
+        if current is not None:
+          yield current, parent, self._getModifiedRegionsOnly(self._parseDiff(diff_lines))
+          done += 1
+
+        commit_hash = commit_line.group(1).decode("ascii")
+        parents = commit_line.group(2).split()
+        current = next(remaining)
+        parent = parents[0].decode("ascii") if len(parents) > 0 else None
+
+        # commits git printed nothing for have no regions
+        while current.commit_hash != commit_hash:
+          yield current, None, {}
+          done += 1
+          current = next(remaining)
+
+        diff_lines = []
+
+      if current is not None:
+        yield current, parent, self._getModifiedRegionsOnly(self._parseDiff(diff_lines))
+        done += 1
+      finished = True
+
+    finally:
+      # stop git if we stopped reading early
+      if not finished:
+        process.kill()
+      process.stdout.close()
+      process.wait()
+      writer.join()
+
+    if process.returncode != 0:
+      # e.g. an unknown commit, fall back to diffing the rest one at a time
+      logging.warning("git diff-tree failed for repo " + self.repo_id + ", diffing the remaining commits one at a time")
+      for commit in list(commits)[done:]:
+        regions = self.getModifiedRegions(commit)
+        yield commit, self.getParent(commit) if len(regions) > 0 else None, regions
+    else:
+      for commit in remaining:
+        yield commit, None, {}
+
+  def gitAnnotate(self, regions, commit, parent=None):
     """
     tracks down the origin of the deleted/modified loc in the regions dict using
     the git annotate (now called git blame) feature of git and a list of commit
@@ -220,21 +391,111 @@ class GitCommitLinker:
 
     @regions - a dict of {file} -> {list of line numbers that were modified}
     @commit - commit that belongs to the passed in chucks/regions.
+    @parent - the hash of the commit's (first) parent, looked up if not given
     """
     bug_introducing_changes = []
 
+    # blame as of the parent's hash rather than commit^, so fixes that share a parent share
+    # their cached blames
+    if parent is None and len(regions) > 0:
+      parent = self.getParent(commit)
+      if parent is None:
+        return bug_introducing_changes # a root commit has nothing to blame
+
     for file, lines in regions.items():
-      for line in lines:
 
-        # assume if region starts at beginning its a deletion or rename and ignore
-        if line != 0 and line != "0" :
+      # assume if region starts at beginning its a deletion or rename and ignore
+      line_numbers = sorted(set(int(line) for line in lines if line != 0 and line != "0"))
+      if len(line_numbers) == 0:
+        continue
+
+      # blame all modified lines of the file at once, skipping the runs of lines already blamed before.
+      # start looking at the commit's ancestor
+      revision = parent
+      line_ranges = self._lineRanges(line_numbers)
+      origins = {}
+      missing = []
+
+      for line_range in line_ranges:
+        cached = self.blame_cache.get(revision, file, line_range[0], line_range[1])
+        if cached is None:
+          missing.append(line_range)
+        else:
+          origins[line_range] = cached
 
-          # we need to git blame with the --follow option so that it follows renames in the file, and the '-l'
-          # option gives us the complete commit hash. additionally, start looking at the commit's ancestor 
-          buggy_change = str( subprocess.check_output( "git blame -L" + line + ",+1 " + commit.commit_hash + "^ -l -- '" \
-                            + file + "'", shell=True, cwd= self.repo_path )).split(" ")[0][2:]
+      if len(missing) > 0:
+        blamed = self._blameRanges(revision, file, missing)
+        for line_range in missing:
+          origins[line_range] = blamed[line_range]
+          self.blame_cache.put(revision, file, line_range[0], line_range[1], blamed[line_range])
 
+      for line_range in line_ranges:
+        for buggy_change in origins[line_range]:
           if buggy_change not in bug_introducing_changes:
             bug_introducing_changes.append(buggy_change)
 
     return bug_introducing_changes
+
+  def _lineRanges(self, line_numbers):
+    """
+    returns the (first, last) line of each run of consecutive lines in the
+    given sorted line numbers.
+    """
+    line_ranges = []
+    start = end = line_numbers[0]
+
+    for line in line_numbers[1:]:
+      if line != end + 1:
+        line_ranges.append((start, end))
+        start = line
+      end = line
+
+    line_ranges.append((start, end))
+    return line_ranges
+
+  def _blameRanges(self, revision, file, line_ranges):
+    """
+    runs a single git blame of the given (first, last) line ranges of a file as of
+    revision and returns a dict of range -> the commit hash each line originates from.
+
+    the porcelain output has a header per line with its final line number and the full commit
+    hash. like 'git blame -l', a boundary (root) commit is shown as '^' and the first 39
+    characters of its hash.
+    """
+    blame_cmd = ["git", "blame", "--porcelain"]
+    for start, end in line_ranges:
+      blame_cmd.append("-L" + str(start) + "," + str(end))
+    blame_cmd += [revision, "--", file]
+
+    blame = subprocess.check_output(blame_cmd, cwd= self.repo_path)
+
+    origins = dict((line_range, []) for line_range in line_ranges)
+    boundaries = set() # commit info, including the boundary flag, is only shown the first time
+    current_range = 0
+    expect_header = True
+    line_hash = None
+
+    for blame_line in blame.split(b"\n"):
+      if expect_header:
+        if blame_line == b"":
+          continue
+        fields = blame_line.split(b" ")
+        line_hash = fields[0].decode("ascii")
+        final_line = int(fields[2])
+        expect_header = False
+
+      elif blame_line.startswith(b"\t"):
+        # the content of the line ends its header
+        while final_line > line_ranges[current_range][1]:
+          current_range += 1
+
+        if line_hash in boundaries:
+          origins[line_ranges[current_range]].append("^" + line_hash[:39])
+        else:
+          origins[line_ranges[current_range]].append(line_hash)
+        expect_header = True
+
+      elif blame_line == b"boundary":
+        boundaries.add(line_hash)
+
+    return origins
@@ -0,0 +1,293 @@
+import math
+import time
+import numpy
+from caslogging import logging
+from analyzer.repositorymetrics import METRIC_NAMES # columns of a data set
+
+class GlmFit:
+  """
+  a fitted binomial GLM: is_buggy ~ intercept + the given metrics.
+
+  coefficients holds the estimate of every term, NaN for terms that are aliased (linearly
+  dependent on the terms before them), like R's coef(fit). summary holds a row of
+  (name, estimate, std. error, z value, p-value) per term that isn't aliased, like the
+  coefficients matrix of R's summary(fit).
+  """
+
+  INTERCEPT = "(Intercept)"
+
+  def __init__(self, metrics, coefficients, summary):
+    self.metrics = metrics
+    self.coefficients = coefficients # term name -> estimate
+    self.summary = summary # [(name, estimate, std. error, z value, p-value)]
+
+  def pValue(self, row):
+    """
+    returns the p-value in a row of the summary, counting from 0 (the intercept). raises an
+    IndexError if there is no such row, e.g. because a term is aliased.
+    """
+    return self.summary[row][4]
+
+class RGlmBackend:
+  """
+  fits GLMs with R's stats::glm through rpy2, on a data.frame built from the columns of
+  the data set. R can't be used concurrently, so models are built one at a time.
+  """
+
+  concurrent = False
+
+  def __init__(self, columns, is_buggy):
+    """
+    constructor
+    @columns - dict of metric name -> array of values, one per commit
+    @is_buggy - array of whether each commit is buggy
+    """
+    import rpy2.robjects as robjects # R integration
+    from rpy2.robjects.packages import importr # import the importr package from R
+    from rpy2.rlike.container import OrdDict
+
+    self.stats = importr('stats', robject_translations={'format_perc': '_format_perc'})
+    self.base = importr('base')
+
+    # hand the vectors to R directly rather than through a file
+    vectors = [(name, robjects.FloatVector(numpy.asarray(values, dtype=float).tolist()))
+      for name, values in columns.items()]
+    vectors.append(("is_buggy", robjects.IntVector(numpy.asarray(is_buggy, dtype=int).tolist())))
+    self.data = robjects.DataFrame(OrdDict(vectors))
+
+  def fit(self, metrics):
+    """
+    fits is_buggy~metrics and returns the GlmFit
+    """
+    formula = "is_buggy~" + "+".join(metrics)
+    fit = self.stats.glm(formula, data=self.data, family="binomial")
+    summary = self.base.summary(fit)
+
+    coefficients = {}
+    for name in [GlmFit.INTERCEPT] + metrics:
+      coefficients[name] = fit.rx2('coefficients').rx2(name)[0]
+
+    # the summary matrix is stored by column and has a row per term that isn't aliased
+    matrix = summary.rx2('coefficients')
+    num_rows = matrix.dim[0]
+    names = list(matrix.dimnames[0])
+    rows = []
+    for row in range(num_rows):
+      rows.append((names[row],) + tuple(matrix[row + column * num_rows] for column in range(4)))
+
+    return GlmFit(metrics, coefficients, rows)
+
+class NumpyGlmBackend:
+  """
+  fits logistic regression GLMs in process with NumPy, using iteratively reweighted least
+  squares the same way R's glm.fit does (same start values, convergence test, detection of
+  aliased terms and thresholds for the logit link), so the coefficients, standard errors
+  and Wald p-values agree with R's summary(glm(..., family="binomial")).
+
+  nothing is shared between fits, so models of different repositories can be built
+  concurrently.
+  """
+
+  concurrent = True
+
+  EPSILON = 1e-8 # convergence tolerance on the relative change of the deviance, glm.control()
+  MAX_ITERATIONS = 25 # glm.control()
+  TOLERANCE = 1e-11 # tolerance to detect aliased terms, min(1e-07, epsilon / 1000)
+  THRESHOLD = 30 # beyond which the logit link is treated as saturated, like R's C code
+  DOUBLE_EPSILON = 2.220446049250313e-16
+
+  def __init__(self, columns, is_buggy):
+    """
+    constructor
+    @columns - dict of metric name -> array of values, one per commit
+    @is_buggy - array of whether each commit is buggy
+    """
+    self.numpy = numpy
+    self.columns = dict((name, numpy.asarray(values, dtype=float)) for name, values in columns.items())
+    self.y = numpy.asarray(is_buggy, dtype=float)
+
+  def fit(self, metrics):
+    """
+    fits is_buggy~metrics and returns the GlmFit
+    """
+    np = self.numpy
+    y = self.y
+    x = np.column_stack([np.ones(len(y))] + [self.columns[metric] for metric in metrics])
+
+    # like na.omit, commits missing a value of the formula are left out
+    complete = np.all(np.isfinite(x), axis=1)
+    if not complete.all():
+      x, y = x[complete], y[complete]
+    names = [GlmFit.INTERCEPT] + list(metrics)
+
+    # start from mu = (y + 0.5) / 2, as binomial()$initialize does
+    eta = self._logit((y + 0.5) / 2)
+    mu = self._linkInverse(eta)
+    deviance_old = self._deviance(y, mu)
+    beta = None
+
+    for iteration in range(self.MAX_ITERATIONS):
+      mu_eta = self._muEta(eta)
+      z = eta + (y - mu) / mu_eta
+      w = np.sqrt(mu_eta ** 2 / (mu * (1 - mu)))
+
+      kept, beta_kept, r = self._weightedLeastSquares(x, z, w)
+      beta_new = np.full(x.shape[1], np.nan)
+      beta_new[kept] = beta_kept
+
+      eta_new = x[:, kept].dot(beta_kept)
+      mu_new = self._linkInverse(eta_new)
+      deviance = self._deviance(y, mu_new)
+
+      # halve the step while the deviance isn't finite
+      halvings = 0
+      while not math.isfinite(deviance) and beta is not None and halvings < self.MAX_ITERATIONS:
+        beta_new[kept] = (beta_new[kept] + beta[kept]) / 2
+        eta_new = x[:, kept].dot(beta_new[kept])
+        mu_new = self._linkInverse(eta_new)
+        deviance = self._deviance(y, mu_new)
+        halvings += 1
+
+      beta, eta, mu = beta_new, eta_new, mu_new
+
+      if abs(deviance - deviance_old) / (abs(deviance) + 0.1) < self.EPSILON:
+        break
+      deviance_old = deviance
+    else:
+      logging.warning("glm did not converge for " + "+".join(metrics))
+
+    # the covariance of the estimates comes from the last weighted QR decomposition; the
+    # dispersion of the binomial family is 1
+    r_inverse = np.linalg.inv(r)
+    std_errors = np.sqrt(np.sum(r_inverse ** 2, axis=1))
+
+    coefficients = {}
+    summary = []
+    for index, name in enumerate(names):
+      coefficients[name] = float(beta[index])
+
+    for position, index in enumerate(kept):
+      estimate = float(beta[index])
+      std_error = float(std_errors[position])
+      z_value = estimate / std_error
+      p_value = math.erfc(abs(z_value) / math.sqrt(2)) # 2 * pnorm(-|z|)
+      summary.append((names[index], estimate, std_error, z_value, p_value))
+
+    return GlmFit(metrics, coefficients, summary)
+
+  def _weightedLeastSquares(self, x, z, w):
+    """
+    solves the weighted least squares problem of an iteration. returns the indexes of the
+    columns that aren't aliased, their coefficients and the R factor of their weighted QR
+    decomposition.
+
+    like R's dqrdc2, a column is aliased if its norm falls below TOLERANCE times its original
+    norm once the columns before it are projected out; aliased columns get no coefficient.
+    """
+    np = self.numpy
+    xw = x * w[:, None]
+    zw = z * w
+
+    kept = []
+    basis = np.zeros((xw.shape[0], 0))
+    for column in range(xw.shape[1]):
+      values = xw[:, column]
+      norm = np.linalg.norm(values)
+      residual = values - basis.dot(basis.T.dot(values))
+      residual = residual - basis.dot(basis.T.dot(residual)) # twice is enough for orthogonality
+      residual_norm = np.linalg.norm(residual)
+
+      if norm == 0 or residual_norm < self.TOLERANCE * norm:
+        continue
+
+      kept.append(column)
+      basis = np.column_stack([basis, residual / residual_norm])
+
+    q, r = np.linalg.qr(xw[:, kept])
+    beta = np.linalg.solve(r, q.T.dot(zw))
+    return kept, beta, r
+
+  def _logit(self, mu):
+    return self.numpy.log(mu / (1 - mu))
+
+  def _linkInverse(self, eta):
+    """
+    the inverse of the logit link, saturated beyond THRESHOLD like R's logit_linkinv
+    """
+    np = self.numpy
+    tmp = np.where(eta < -self.THRESHOLD, self.DOUBLE_EPSILON,
+      np.where(eta > self.THRESHOLD, 1 / self.DOUBLE_EPSILON, np.exp(np.clip(eta, -self.THRESHOLD, self.THRESHOLD))))
+    return tmp / (1 + tmp)
+
+  def _muEta(self, eta):
+    """
+    the derivative of the inverse link, like R's logit_mu_eta
+    """
+    np = self.numpy
+    clipped = np.exp(np.clip(eta, -self.THRESHOLD, self.THRESHOLD))
+    return np.where(np.abs(eta) > self.THRESHOLD, self.DOUBLE_EPSILON, clipped / (1 + clipped) ** 2)
+
+  def _deviance(self, y, mu):
+    """
+    the binomial deviance of the fitted probabilities
+    """
+    np = self.numpy
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return float(-2 * np.sum(np.where(y > 0, np.log(mu), np.log(1 - mu))))
+
+class ModelCache:
+  """
+  memoizes the fits of a GLM backend by formula for the duration of a model build, so the
+  stepwise selection, the stored coefficients and the scoring of commits share one fit of
+  each formula. counts the fits and the time spent in the backend.
+  """
+
+  def __init__(self, backend):
+    """
+    constructor
+    @backend - the GLM backend to fit models with
+    """
+    self.backend = backend
+    self.fits = {} # tuple of metrics -> GlmFit
+    self.num_fits = 0 # models fitted by the backend
+    self.num_reused = 0 # fits answered from the cache
+    self.fit_time = 0.0 # seconds spent fitting
+
+  def fit(self, metrics):
+    """
+    returns the GlmFit of is_buggy~metrics, fitting it only the first time it is asked for
+    """
+    formula = tuple(metrics)
+    fit = self.fits.get(formula)
+    if fit is not None:
+      self.num_reused += 1
+      return fit
+
+    start = time.perf_counter()
+    fit = self.backend.fit(list(metrics))
+    self.fit_time += time.perf_counter() - start
+    self.num_fits += 1
+
+    self.fits[formula] = fit
+    return fit
+
+  def stats(self):
+    """
+    returns a one line summary of the fit counters, for logging.
+    """
+    return (str(self.num_fits) + " fits (" + str(self.num_reused) + " reused) in " +
+      str(round(self.fit_time, 2)) + "s")
+
+BACKENDS = {"r": RGlmBackend, "numpy": NumpyGlmBackend} # name in the config -> backend class
+
+def getBackendClass(name):
+  """
+  returns the class of the GLM backend with the given name ('r' or 'numpy'), R by default
+  """
+  return BACKENDS.get(name, RGlmBackend)
+
+def getBackend(name, columns, is_buggy):
+  """
+  returns the GLM backend with the given name ('r' or 'numpy') for the data set in columns
+  """
+  return getBackendClass(name)(columns, is_buggy)
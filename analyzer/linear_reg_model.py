@@ -1,11 +1,11 @@
 import csv
 import os
-import rpy2.robjects as robjects # R integration
-from rpy2.robjects.packages import importr # import the importr package from R
+from analyzer.glm import * # GLM backends (R or NumPy)
 from orm.glmcoefficients import * # to store the glm coefficients
 from db import *	# postgresql db information
 import math
 from caslogging import logging
+from config import config
 
 class LinearRegressionModel:
   """
@@ -22,11 +22,10 @@ class LinearRegressionModel:
     """
     self.metrics = metrics
     self.repo_id = repo_id
-    self.stats = importr('stats', robject_translations={'format_perc': '_format_perc'})
-    self.base = importr('base')
-    self.readcsv = robjects.r['read.csv']
     self.sig_threshold = 0.05
-    self.data = None 
+    self.columns = None # the training data set, metric name -> values
+    self.is_buggy = None # whether each commit of the training data set is buggy
+    self.glm = None # the ModelCache of the GLM backend, fitting models on the training data set
     self.commits = testingCommits
 
   def buildModel(self):
@@ -39,78 +38,62 @@ class LinearRegressionModel:
 
   def _buildDataSet(self):
     """
-    builds the data set to be used for getting the linear regression model.
-    saves datasets in the datasets folder as csv files to easily be imported
-    or used by R.
+    builds the data set to be used for getting the linear regression model: the columns of
+    the metrics object, a column of values per metric, and whether each commit is buggy.
+    the data set is only saved to the datasets folder as a csv file if
+    glm_modeling.export_dataset is set in the config, to inspect it.
     """
+    self.columns = dict((metric, self.metrics.column(metric)) for metric in METRIC_NAMES)
+    self.is_buggy = self.metrics.labels()
 
-    # to write dataset file in this directory (git ignored!)
+    if str(config['glm_modeling'].get('export_dataset', False)).lower() == "true":
+      self._exportDataSet()
+
+  def _exportDataSet(self):
+    """
+    saves the data set in the datasets folder (git ignored!) as a csv file, e.g. to import it in R
+    """
     current_dir = os.path.dirname(__file__)
     dir_of_datasets = current_dir + "/datasets/"
-    num_buggy = getattr(self.metrics, "num_buggy")
-    num_nonbuggy = getattr(self.metrics, "num_nonbuggy")
 
     with open(dir_of_datasets + self.repo_id + ".csv", "w") as file:
       csv_writer = csv.writer(file, dialect="excel")
 
-      # write the columns
-      csv_writer.writerow(["ns","nd","nf","entrophy","la","ld","lt","ndev","age","nuc","exp","rexp","sexp","is_buggy"])
-
-      # write the relevant data - start w/ the buggy data first
-      for buggy_index in range(0,num_buggy):
-        ns = self.metrics.ns_buggy[buggy_index]
-        nd = self.metrics.nd_buggy[buggy_index]
-        nf = self.metrics.nf_buggy[buggy_index]
-        entrophy = self.metrics.entrophy_buggy[buggy_index]
-        la = self.metrics.la_buggy[buggy_index]
-        ld = self.metrics.ld_buggy[buggy_index]
-        lt = self.metrics.lt_buggy[buggy_index]
-        ndev = self.metrics.ndev_buggy[buggy_index]
-        age = self.metrics.age_buggy[buggy_index]
-        nuc = self.metrics.nuc_buggy[buggy_index]
-        exp = self.metrics.exp_buggy[buggy_index]
-        rexp = self.metrics.rexp_buggy[buggy_index]
-        sexp = self.metrics.sexp_buggy[buggy_index]
-        csv_writer.writerow([ns,nd,nf,entrophy,la,ld,lt,ndev,age,nuc,exp,rexp,sexp,True])
-      # end buggy data
-
-      # write the non buggy data
-      for nonbuggy_index in range(0,num_nonbuggy):
-        ns = self.metrics.ns_nonbuggy[nonbuggy_index]
-        nd = self.metrics.nd_nonbuggy[nonbuggy_index]
-        nf = self.metrics.nf_nonbuggy[nonbuggy_index]
-        entrophy = self.metrics.entrophy_nonbuggy[nonbuggy_index]
-        la = self.metrics.la_nonbuggy[nonbuggy_index]
-        ld = self.metrics.ld_nonbuggy[nonbuggy_index]
-        lt = self.metrics.lt_nonbuggy[nonbuggy_index]
-        ndev = self.metrics.ndev_nonbuggy[nonbuggy_index]
-        age = self.metrics.age_nonbuggy[nonbuggy_index]
-        nuc = self.metrics.nuc_nonbuggy[nonbuggy_index]
-        exp = self.metrics.exp_nonbuggy[nonbuggy_index]
-        rexp = self.metrics.rexp_nonbuggy[nonbuggy_index]
-        sexp = self.metrics.sexp_nonbuggy[nonbuggy_index]
-        csv_writer.writerow([ns,nd,nf,entrophy,la,ld,lt,ndev,age,nuc,exp,rexp,sexp,False])
-      # end non buggy data
-    # end file
+      # write the columns, then a row per commit; missing values are left empty for R's read.csv
+      csv_writer.writerow(METRIC_NAMES + ["is_buggy"])
+      for values, is_buggy in zip(self.metrics.matrix().tolist(), self.is_buggy.tolist()):
+        csv_writer.writerow(["" if value != value else value for value in values] + [is_buggy])
+
+  def _getGlmBackend(self):
+    """
+    returns the GLM backend set by glm_modeling.backend in the config: 'r' (the default) fits
+    models with R through rpy2, 'numpy' fits them in process.
+    """
+    return getBackend(config['glm_modeling'].get('backend', 'r'), self.columns, self.is_buggy)
+
+  def fitStats(self):
+    """
+    returns a one line summary of the number of GLM fits of the last build and the time they took
+    """
+    if self.glm is None:
+      return "no fits"
+    return self.glm.stats()
 
   def _isMetricSignificant(self, formula_metrics, metric):
     """
     Checks if adding a metric to the already significant metrics in formula_metrics in a GLM model is significant. If significant,
     and doesn't cause any previous metric in formula_metrics to become non significant, we return true. Otherwise, false.
 
-    Note: The p-value is always given in the 4th column of the summary matrix!
+    Note: The summary has a row per term that could be fitted, starting with the intercept!
     """
-    sig_column = 4
 
     # Case 1: no existing metrics in the formula
     if len(formula_metrics) == 0:
-      formula = "is_buggy~" + metric
-      fit = self.stats.glm(formula, data=self.data, family="binomial")
-      summary = self.base.summary(fit)
+      fit = self.glm.fit([metric])
       # Note - first row is the intercept information so we start at second row!
 
       try:
-        metric_sig = summary.rx2('coefficients').rx(2,sig_column)[0] # Second row, 4th column of the summary matrix.
+        metric_sig = fit.pValue(1) # Second row of the summary matrix.
         if metric_sig <= self.sig_threshold:
           return True
         else:
@@ -125,15 +108,13 @@ class LinearRegressionModel:
     # Case 2: existing metrics in the formula    
     else:
       num_metrics = len(formula_metrics)+2 # plus one for the new metric we are adding and one for intercept
-      formula = "is_buggy~" + "+".join(formula_metrics) + "+" + metric
-      fit = self.stats.glm(formula, data=self.data, family="binomial")
-      summary = self.base.summary(fit)
+      fit = self.glm.fit(formula_metrics + [metric])
 
       # If any metric is now not significant, than we should not have added this metric to the formula
       # There are (intercept) + num_metrics rows in the matrix to check - starts at second row skipping intercept
       try: 
-        for row in range(2,num_metrics+1):
-          metric_sig = summary.rx2('coefficients').rx(row,sig_column)[0]
+        for row in range(1,num_metrics):
+          metric_sig = fit.pValue(row)
           if metric_sig > self.sig_threshold:
             return False
         return True # old metrics added to model ARE significant still as well as the new one being tested
@@ -153,9 +134,10 @@ class LinearRegressionModel:
 
     metrics_list = ["la","ld","lt","ns","nd","nf","ndev","age","nuc","exp","rexp","sexp","entrophy"]
     formula_metrics = []
-    current_dir = os.path.dirname(__file__)
-    dir_of_datasets = current_dir + "/datasets/"
-    self.data = self.readcsv(dir_of_datasets + self.repo_id + ".csv", header=True, sep = ",")
+
+    # each formula is fitted once per build; the final model is reused for its coefficients,
+    # intercept and the scoring of commits
+    self.glm = ModelCache(self._getGlmBackend())
 
     for metric in metrics_list:
       if self._isMetricSignificant(formula_metrics, metric):
@@ -167,6 +149,8 @@ class LinearRegressionModel:
     # Calculate all probability for each commit to introduce a bug
     self.calculateCommitRiskyness(self.commits, formula_metrics)
 
+    logging.info("GLM model of repo " + self.repo_id + " built with " + self.fitStats())
+
 
   def _getCoefficients(self, formula_coefs):
     """
@@ -174,11 +158,10 @@ class LinearRegressionModel:
     coefficient with its value.
     """
     coef_dict = {} # a dict containing glm coefficients {name -> value}
-    formula = "is_buggy~" + "+".join(formula_coefs)
-    fit = self.stats.glm(formula, data=self.data, family="binomial")
+    fit = self.glm.fit(formula_coefs)
 
     for coef in formula_coefs:
-      coef_dict[coef] = fit.rx2('coefficients').rx2(coef)[0]
+      coef_dict[coef] = fit.coefficients[coef]
 
     return coef_dict
 
@@ -187,10 +170,8 @@ class LinearRegressionModel:
     Return the Intercept value of a GLM model and the p-value
     Assumes that model can be built!
     """
-    formula = "is_buggy~" + "+".join(coefs)
-    fit = self.stats.glm(formula, data=self.data, family="binomial")
-    summary = self.base.summary(fit)
-    return summary.rx2('coefficients').rx(1)[0], summary.rx2('coefficients').rx(1,4)[0]
+    fit = self.glm.fit(coefs)
+    return fit.summary[0][1], fit.pValue(0)
 
   def _getCoefficientObject(self, coef_name, coef_value):
     """
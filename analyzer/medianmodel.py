@@ -1,9 +1,88 @@
-import rpy2.robjects as robjects # R integration to python
+import math
+import warnings
+import numpy
 from analyzer.repositorymetrics import * # metrics abstraction; holds all metric values for commits
 from db import *	# postgresql db information
 from orm.metrics import *	# orm metrics table
 from caslogging import logging
 
+def wilcoxonTest(x, y):
+  """
+  returns the p-value of a two-sided Wilcoxon rank sum (Mann-Whitney U) test of x and y, with
+  the defaults of R's wilcox.test: the exact distribution if both samples have fewer than 50
+  values and there are no ties, else the normal approximation with tie and continuity correction.
+  raises a ValueError if either sample is empty.
+  """
+  if len(x) == 0 or len(y) == 0:
+    raise ValueError("not enough observations")
+  return float(wilcoxonTests(numpy.reshape(x, (-1, 1)), numpy.reshape(y, (-1, 1)))[0])
+
+def wilcoxonTests(x, y):
+  """
+  returns the p-values of the wilcoxonTest of each column of the matrices x and y, leaving out
+  their NaN values. the p-value of a column is NaN where either sample is empty.
+  """
+  x = numpy.asarray(x, dtype=float)
+  y = numpy.asarray(y, dtype=float)
+  n_x = numpy.count_nonzero(~numpy.isnan(x), axis=0)
+  n_y = numpy.count_nonzero(~numpy.isnan(y), axis=0)
+  n = n_x + n_y
+
+  # sort the pooled values of every column, as a row of their own; NaNs go last, after the
+  # n values of their column
+  pooled = numpy.ascontiguousarray(numpy.concatenate((x, y)).T)
+  order = numpy.argsort(pooled, axis=1)
+  values = numpy.take_along_axis(pooled, order, axis=1)
+  positions = numpy.arange(pooled.shape[1])
+  valid = positions < n.reshape(-1, 1)
+
+  # a run of equal sorted values is a tie; each value gets the average rank of its run
+  starts = numpy.ones(values.shape, dtype=bool)
+  starts[:, 1:] = values[:, 1:] != values[:, :-1]
+  ends = numpy.ones(values.shape, dtype=bool)
+  ends[:, :-1] = starts[:, 1:]
+  first = numpy.maximum.accumulate(numpy.where(starts, positions, 0), axis=1)
+  last = numpy.minimum.accumulate(numpy.where(ends, positions, pooled.shape[1])[:, ::-1], axis=1)[:, ::-1]
+  ranks = (first + last) / 2.0 + 1
+  run_lengths = numpy.where(valid, last - first + 1, 1)
+
+  statistic = numpy.where(valid & (order < len(x)), ranks, 0).sum(axis=1) - n_x * (n_x + 1) / 2.0
+  ties = (run_lengths > 1).any(axis=1)
+  tie_sum = (run_lengths ** 2 - 1).sum(axis=1) # each value of a run of t adds t^2 - 1, t^3 - t per run
+
+  with numpy.errstate(divide="ignore", invalid="ignore"):
+    z = statistic - n_x * n_y / 2.0
+    sigma = numpy.sqrt((n_x * n_y / 12.0) * ((n + 1) - tie_sum / (n * (n - 1.0))))
+    z = (z - numpy.sign(z) * 0.5) / sigma
+  p_values = numpy.array([math.erfc(abs(value) / math.sqrt(2)) for value in z]) # 2 * min(pnorm(z), pnorm(-z))
+  p_values[(sigma == 0) | (n_x == 0) | (n_y == 0)] = float("nan")
+
+  for column in numpy.flatnonzero((n_x > 0) & (n_y > 0) & (n_x < 50) & (n_y < 50) & ~ties):
+    frequencies = _rankSumFrequencies(n_x[column], n_y[column])
+    if statistic[column] > n_x[column] * n_y[column] / 2.0:
+      p = frequencies[int(statistic[column]):].sum() / frequencies.sum()
+    else:
+      p = frequencies[:int(statistic[column]) + 1].sum() / frequencies.sum()
+    p_values[column] = min(2 * p, 1.0)
+
+  return p_values
+
+def _rankSumFrequencies(n_x, n_y):
+  """
+  returns the number of ways the statistic of the rank sum test takes each value from 0 to
+  n_x * n_y, from the recursion f(k; i, j) = f(k - j; i - 1, j) + f(k; i, j - 1)
+  """
+  previous = [numpy.ones(1) for j in range(n_y + 1)] # i = 0
+  for i in range(1, n_x + 1):
+    current = [numpy.ones(1)] # j = 0
+    for j in range(1, n_y + 1):
+      frequencies = numpy.zeros(i * j + 1)
+      frequencies[j:j + len(previous[j])] += previous[j]
+      frequencies[:len(current[j - 1])] += current[j - 1]
+      current.append(frequencies)
+    previous = current
+  return previous[n_y]
+
 class MedianModel:
   """
   Builds the median model, which saves to the metrics table the
@@ -11,6 +90,8 @@ class MedianModel:
   repository
   """
 
+  concurrent = True # computed in process, without R, so models of repos can be built concurrently
+
   def __init__(self, metrics, repo_id):
     """
     constructor
@@ -23,75 +104,51 @@ class MedianModel:
     # A p-value for wilcox test
     self.psig = 0.05
 
-    # R functions to be used
-    self.medianFn = robjects.r['median']
-    self.wilcoxFn = robjects.r['wilcox.test']
-
   def buildModel(self):
     """
     builds the model
     """
     self.calculateMedians()
 
-  def getMedian(self,metric):
-    """
-    Helper function for the method calculateMedians.
-    Takes in a metric and returns a string property of the results
-    @private
-    """
-    median_props = ""
-
-    try:
-      # R functions to be used
-      medianFn = robjects.r['median']
-      wilcoxFn = robjects.r['wilcox.test']
-
-      metric_buggy = getattr(self.metrics, metric + "_buggy")
-      metric_nonbuggy = getattr(self.metrics, metric + "_nonbuggy")
-
-      # First check p-values, if signficant then calculate median
-      pvalue = self.wilcoxFn(robjects.FloatVector(metric_buggy), robjects.FloatVector(metric_nonbuggy))[2][0]
-      buggy_median = self.medianFn(robjects.FloatVector(metric_buggy))
-      nonbuggy_median = self.medianFn(robjects.FloatVector(metric_nonbuggy))
-      median_props += '"' + metric + 'buggy":"' + str(buggy_median[0]) + '", '
-      median_props += '"' + metric + 'nonbuggy":"' + str(nonbuggy_median[0]) + '", '
-
-      if pvalue <= self.psig:
-        median_props += '"' + metric + '_sig":"1", '
-      else:
-        median_props += '"' + metric + '_sig":"0", '
-
-    except:
-      # catch the case where we haven't made any observations to do this metric
-      logging.info("Metric " + metric + " could not be used in the median model for repo " + self.repo_id)
-
-    return median_props
-
-
   def calculateMedians(self):
     """
-    Using R through the rpy2 module, generate the medians of each metrics
-    lists. If it passes the wilcox test (statistically sig), put it into
+    Using NumPy, generate the medians of each metrics lists. If it passes
+    the wilcox test (statistically sig), put it into
     the metrics table. Otherwise, inserts a -1.
+    All metrics are computed at once, a column per metric.
     @private
     """
 
+    # Missing values are left out, like wilcox.test does
+    buggy = self.metrics.buggy()
+    nonbuggy = self.metrics.nonbuggy()
+    buggy = numpy.where(numpy.isfinite(buggy), buggy, numpy.nan)
+    nonbuggy = numpy.where(numpy.isfinite(nonbuggy), nonbuggy, numpy.nan)
+    observed = ~numpy.isnan(buggy).all(axis=0) & ~numpy.isnan(nonbuggy).all(axis=0)
+
+    # First check p-values, if signficant then calculate median
+    pvalues = wilcoxonTests(buggy, nonbuggy)
+    with warnings.catch_warnings():
+      warnings.simplefilter("ignore", RuntimeWarning) # metrics without observations
+      buggy_medians = numpy.nanmedian(buggy, axis=0)
+      nonbuggy_medians = numpy.nanmedian(nonbuggy, axis=0)
+
     # Metric objects represents the metrics as a dictionary
     metricObject = '"repo":"' + self.repo_id + '", '
 
-    metricObject += self.getMedian("ns")
-    metricObject += self.getMedian("nd")
-    metricObject += self.getMedian("nf")
-    metricObject += self.getMedian("entrophy")
-    metricObject += self.getMedian("la")
-    metricObject += self.getMedian("ld")
-    metricObject += self.getMedian("lt")
-    metricObject += self.getMedian("ndev")
-    metricObject += self.getMedian("age")
-    metricObject += self.getMedian("nuc")
-    metricObject += self.getMedian("exp")
-    metricObject += self.getMedian("rexp")
-    metricObject += self.getMedian("sexp")
+    for index, metric in enumerate(METRIC_NAMES):
+      if not observed[index]:
+        # the case where we haven't made any observations to do this metric
+        logging.info("Metric " + metric + " could not be used in the median model for repo " + self.repo_id)
+        continue
+
+      metricObject += '"' + metric + 'buggy":"' + str(float(buggy_medians[index])) + '", '
+      metricObject += '"' + metric + 'nonbuggy":"' + str(float(nonbuggy_medians[index])) + '", '
+
+      if pvalues[index] <= self.psig:
+        metricObject += '"' + metric + '_sig":"1", '
+      else:
+        metricObject += '"' + metric + '_sig":"0", '
 
     # Remove trailing comma
     metricObject = metricObject[:-2]
@@ -12,6 +12,8 @@ from analyzer.linear_reg_model import *
 from orm.commit import *
 import json
 
+METRICS_BATCH_SIZE = 50000 # number of training commits loaded at a time
+
 class MetricsGenerator:
 	"""
 	MetricsGenerator()
@@ -22,7 +24,7 @@ class MetricsGenerator:
 		"""
 		Constructor
 		@repo_id : repository id
-		@training data : all commits that we are training the models on 
+		@training data : query of all commits that we are training the models on 
 		@testing data : all commits that we are testing the models on (i.e. glm model)
 		"""
 		self.repo_id = repo_id
@@ -76,46 +78,29 @@ class MetricsGenerator:
 	def fetchAllMetrics(self):
 		"""
 		fetchAllMetrics()
-		Iterate through each commit storing each individual's metrics into the metrics object,
-		to hold all metrics information necessary to build models.
+		Load the metrics and label of each training commit into the metrics object, to hold all
+		metrics information necessary to build models. Only those columns are selected, in
+		batches, so no commit objects are built.
 		@private
 		"""
-		for commit in self.trainingData:
-
-			# Exclude merge commits where no lines of code where changed
-			if commit.classification == "Merge" and commit.la == 0 and commit.ld == 0:
-				continue
-
-			else:
-
-				if commit.contains_bug == True:
-					self.metrics.ns_buggy.append(commit.ns)
-					self.metrics.nd_buggy.append(commit.nd)
-					self.metrics.nf_buggy.append(commit.nf)
-					self.metrics.entrophy_buggy.append(commit.entrophy)
-					self.metrics.la_buggy.append(commit.la)
-					self.metrics.ld_buggy.append(commit.ld)
-					self.metrics.lt_buggy.append(commit.lt)
-					self.metrics.ndev_buggy.append(commit.ndev)
-					self.metrics.age_buggy.append(commit.age)
-					self.metrics.nuc_buggy.append(commit.nuc)
-					self.metrics.exp_buggy.append(commit.exp)
-					self.metrics.rexp_buggy.append(commit.rexp)
-					self.metrics.sexp_buggy.append(commit.sexp)
-					self.metrics.num_buggy += 1
-
-				else:
-					self.metrics.ns_nonbuggy.append(commit.ns)
-					self.metrics.nd_nonbuggy.append(commit.nd)
-					self.metrics.nf_nonbuggy.append(commit.nf)
-					self.metrics.entrophy_nonbuggy.append(commit.entrophy)
-					self.metrics.la_nonbuggy.append(commit.la)
-					self.metrics.ld_nonbuggy.append(commit.ld)
-					self.metrics.lt_nonbuggy.append(commit.lt)
-					self.metrics.ndev_nonbuggy.append(commit.ndev)
-					self.metrics.age_nonbuggy.append(commit.age)
-					self.metrics.nuc_nonbuggy.append(commit.nuc)
-					self.metrics.exp_nonbuggy.append(commit.exp)
-					self.metrics.rexp_nonbuggy.append(commit.rexp)
-					self.metrics.sexp_nonbuggy.append(commit.sexp)
-					self.metrics.num_nonbuggy += 1
+		columns = [getattr(Commit, metric) for metric in METRIC_NAMES] + [Commit.contains_bug]
+
+		# Exclude merge commits where no lines of code where changed
+		rows = (self.trainingData
+			.with_entities(*columns)
+			.filter(
+				( Commit.classification == None ) | ( Commit.classification != "Merge" ) |
+				( Commit.la == None ) | ( Commit.la != 0 ) |
+				( Commit.ld == None ) | ( Commit.ld != 0 )
+			)
+			.order_by(None)
+			.execution_options(stream_results=True)
+			.yield_per(METRICS_BATCH_SIZE))
+
+		batch = []
+		for row in rows:
+			batch.append(row)
+			if len(batch) == METRICS_BATCH_SIZE:
+				self.metrics.addRows(batch)
+				batch = []
+		self.metrics.addRows(batch)
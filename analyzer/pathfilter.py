@@ -0,0 +1,148 @@
+import os
+import re
+import subprocess
+from config import config
+
+def _loadExtensions():
+  """
+  reads the (upper case) file endings of source code files to link, once per process.
+  """
+  list_ext_dir = os.path.join(os.path.dirname(__file__), "code_file_extentions.txt")
+  with open(list_ext_dir) as ext_file:
+    return frozenset(ext.strip().upper() for ext in ext_file.read().splitlines() if ext.strip() != "")
+
+SOURCE_EXTENSIONS = _loadExtensions()
+
+def globToRegex(pattern):
+  """
+  returns the regular expression source of a gitignore/gitattributes style glob. a pattern
+  without a slash matches the file name at any depth, others are relative to the root of
+  the repository. '*' doesn't match a slash, '**' does.
+  """
+  if pattern.startswith("/"):
+    pattern = pattern[1:]
+    prefix = ""
+  elif "/" in pattern:
+    prefix = ""
+  else:
+    prefix = "(?:.*/)?"
+
+  regex = ""
+  index = 0
+  while index < len(pattern):
+    if pattern.startswith("**/", index):
+      regex += "(?:.*/)?"
+      index += 3
+    elif pattern.startswith("**", index):
+      regex += ".*"
+      index += 2
+    elif pattern[index] == "*":
+      regex += "[^/]*"
+      index += 1
+    elif pattern[index] == "?":
+      regex += "[^/]"
+      index += 1
+    elif pattern[index] == "[" and pattern.find("]", index + 2) != -1:
+      end = pattern.find("]", index + 2)
+      char_class = pattern[index + 1:end]
+      if char_class.startswith("!"):
+        char_class = "^" + char_class[1:]
+      regex += "[" + char_class.replace("\\", "\\\\") + "]"
+      index = end + 1
+    else:
+      regex += re.escape(pattern[index])
+      index += 1
+
+  return prefix + regex + "\\Z"
+
+class PathFilter:
+  """
+  decides which changed files of a repository are worth linking: source code files (by their
+  real file ending) that aren't matched by one of the configured ignore globs and aren't marked
+  as linguist-generated or linguist-vendored in the repository's .gitattributes.
+
+  everything is compiled once per repository, so filtering a path doesn't touch the disk or
+  spawn a process.
+  """
+
+  IGNORED_ATTRIBUTES = ("linguist-generated", "linguist-vendored")
+
+  def __init__(self, repo_path):
+    """
+    constructor
+    compiles the ignore globs and reads the .gitattributes of the repository.
+    """
+    ignore = config['system'].get('link_ignore', [])
+    if isinstance(ignore, str):
+      ignore = [glob.strip() for glob in ignore.split(",") if glob.strip() != ""]
+
+    # a trailing slash ignores everything in a directory
+    ignore = [glob + "**" if glob.endswith("/") else glob for glob in ignore]
+    self.ignore = re.compile("|".join(globToRegex(glob) for glob in ignore)) if ignore else None
+
+    self.attributes = self._readAttributes(repo_path)
+
+  def accepts(self, path):
+    """
+    returns whether a changed file should be linked
+    """
+    extension = os.path.splitext(path)[1][1:].upper()
+    if extension not in SOURCE_EXTENSIONS:
+      return False
+
+    if self.ignore is not None and self.ignore.match(path):
+      return False
+
+    # like git, the last line of .gitattributes that sets an attribute wins
+    attributes = {}
+    for regex, name, attribute_set in self.attributes:
+      if regex.match(path):
+        attributes[name] = attribute_set
+
+    return not any(attributes.values())
+
+  def acceptsAny(self, fileschanged):
+    """
+    returns whether any of the files in the fileschanged column of a commit should be linked.
+    commits without stored file names are always accepted, as we can't tell.
+    """
+    if fileschanged is None or fileschanged == "" or fileschanged == "NULL":
+      return True
+
+    # commits ingested by older versions end with a stray ',CAS_DELIMITER'
+    if fileschanged.endswith(",CAS_DELIMITER"):
+      fileschanged = fileschanged[:-len(",CAS_DELIMITER")]
+
+    return any(self.accepts(path) for path in fileschanged.split(",CAS_DELIMITER,"))
+
+  def _readAttributes(self, repo_path):
+    """
+    returns a list of (compiled pattern, attribute name, whether it is set) for the lines of the
+    .gitattributes at the root of HEAD that set or unset one of those attributes.
+    the file is read from the object database, so bare mirrors work too.
+    """
+    try:
+      gitattributes = subprocess.check_output(["git", "cat-file", "-p", "HEAD:.gitattributes"],
+        cwd= repo_path, stderr=subprocess.DEVNULL).decode("utf-8", "replace")
+    except (subprocess.CalledProcessError, OSError):
+      return [] # no .gitattributes
+
+    attributes = []
+    for line in gitattributes.splitlines():
+      fields = line.split()
+      if len(fields) < 2 or fields[0].startswith("#"):
+        continue
+
+      # patterns for directories don't apply to the files in them
+      if fields[0].endswith("/"):
+        continue
+
+      for field in fields[1:]:
+        name, _, value = field.lstrip("-!").partition("=")
+        if name not in self.IGNORED_ATTRIBUTES:
+          continue
+
+        attribute_set = not field.startswith(("-", "!")) and value not in ("false", "0")
+        attributes.append((re.compile(globToRegex(fields[0])), name, attribute_set))
+
+    return attributes
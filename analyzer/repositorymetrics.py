@@ -1,36 +1,81 @@
+from itertools import chain
+import numpy
+
+METRIC_NAMES = ["ns","nd","nf","entrophy","la","ld","lt","ndev","age","nuc","exp","rexp","sexp"] # metrics of a commit
 
 class RepositoryMetrics:
   """
-  Holds all the metrics values for a repository
+  Holds all the metrics values for a repository in NumPy arrays: a matrix of floats with
+  a row per commit and a column per metric (in the order of METRIC_NAMES), and a label
+  vector telling whether each commit is buggy. Missing values are stored as NaN.
   """
 
   def __init__(self):
 
-    self.ns_buggy = []
-    self.ns_nonbuggy = []
-    self.nd_buggy = []
-    self.nd_nonbuggy = []
-    self.nf_buggy = []
-    self.nf_nonbuggy = []
-    self.entrophy_buggy = []
-    self.entrophy_nonbuggy = []
-    self.la_buggy = []
-    self.la_nonbuggy = []
-    self.ld_buggy = []
-    self.ld_nonbuggy = []
-    self.lt_buggy = []
-    self.lt_nonbuggy = []
-    self.ndev_buggy = []
-    self.ndev_nonbuggy = []
-    self.age_buggy = []
-    self.age_nonbuggy = []
-    self.nuc_buggy = []
-    self.nuc_nonbuggy = []
-    self.exp_buggy = []
-    self.exp_nonbuggy = []
-    self.rexp_nonbuggy = []
-    self.rexp_buggy = []
-    self.sexp_buggy = []
-    self.sexp_nonbuggy = []
+    self.values = numpy.empty((0, len(METRIC_NAMES))) # commit x metric
+    self.is_buggy = numpy.empty(0, dtype=bool) # True if the commit is buggy
     self.num_buggy = 0
     self.num_nonbuggy = 0
+    self._batches = [] # (values, is_buggy) added since the arrays were last joined
+
+  def addRows(self, rows):
+    """
+    adds a batch of commits, each row holding the metrics in the order of METRIC_NAMES
+    followed by whether the commit is buggy
+    """
+    if len(rows) == 0:
+      return
+
+    # read the rows straight into a matrix; NULL values become NaN
+    width = len(METRIC_NAMES) + 1
+    batch = (numpy.fromiter(chain.from_iterable(rows), dtype=object, count=len(rows) * width)
+      .reshape(len(rows), width)
+      .astype(float))
+
+    labels = batch[:, -1] == 1
+    self._batches.append((batch[:, :-1], labels))
+
+    num_buggy = int(numpy.count_nonzero(labels))
+    self.num_buggy += num_buggy
+    self.num_nonbuggy += len(labels) - num_buggy
+
+  def matrix(self):
+    """
+    returns the values of all metrics for all commits, a row per commit
+    """
+    self._join()
+    return self.values
+
+  def labels(self):
+    """
+    returns whether each commit is buggy
+    """
+    self._join()
+    return self.is_buggy
+
+  def column(self, metric):
+    """
+    returns the values of a metric for all commits
+    """
+    return self.matrix()[:, METRIC_NAMES.index(metric)]
+
+  def buggy(self):
+    """
+    returns the values of all metrics for the buggy commits, a row per commit
+    """
+    return self.matrix()[self.is_buggy]
+
+  def nonbuggy(self):
+    """
+    returns the values of all metrics for the non buggy commits, a row per commit
+    """
+    return self.matrix()[~self.is_buggy]
+
+  def _join(self):
+    """
+    appends the batches added since the last call to the arrays, with one copy for all of them
+    """
+    if len(self._batches) > 0:
+      self.values = numpy.concatenate([self.values] + [values for values, labels in self._batches])
+      self.is_buggy = numpy.concatenate([self.is_buggy] + [labels for values, labels in self._batches])
+      self._batches = []
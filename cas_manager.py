@@ -8,12 +8,15 @@ description: This module contains the CAS_manager class, which is a thread that
 """
 from analyzer.analyzer import *
 from ingester.ingester import *
+from ingester.reclassifier import *
 from orm.repository import *
 import calendar # to convert datetime to unix time
 from caslogging import logging
 from queue import *
 import threading
 import time
+import multiprocessing
+import concurrent.futures
 from monthdelta import MonthDelta
 
 class CAS_Manager(threading.Thread):
@@ -26,9 +29,34 @@ class CAS_Manager(threading.Thread):
 		"""Constructor"""
 		threading.Thread.__init__(self)
 		numOfWorkers = int(config['system']['workers'])
-		self.workQueue = ThreadPool(numOfWorkers)
+
+		# ingesting is CPU bound python, so worker processes scale past the GIL
+		if config['system'].get('worker_type') == 'process':
+			self.workQueue = ProcessPool(numOfWorkers)
+		else:
+			self.workQueue = ThreadPool(numOfWorkers)
 		self.modelQueue = Queue()
 
+	def resetInterruptedWork(self):
+		"""
+		Requeue repos whose ingestion was interrupted (i.e., the manager was
+		stopped or crashed). Ingestion resumes from the last checkpoint.
+		"""
+
+		session = Session()
+		repos_to_reset = (session.query(Repository)
+							.filter(
+								(Repository.status == "Ingesting") |
+								(Repository.status == "In Queue to be Ingested"))
+							.all())
+
+		for repo in repos_to_reset:
+			logging.info("Resuming interrupted ingestion of repo " + repo.id)
+			repo.status = "Waiting to be Ingested"
+
+		session.commit()
+		session.close()
+
 	def checkIngestion(self):
 		"""Check if any repo needs to be ingested"""
 
@@ -52,6 +80,14 @@ class CAS_Manager(threading.Thread):
 
 		session.close()
 
+	def checkReclassification(self):
+		"""Requeue idle repos whose fixes changed since they were analyzed"""
+
+		try:
+			applyPendingReclassifications()
+		except Exception as e:
+			logging.exception("Got an exception requeueing reclassified repos")
+
 	def checkAnalyzation(self):
 		"""Checks if any repo needs to be analyzed"""
 
@@ -82,10 +118,16 @@ class CAS_Manager(threading.Thread):
 							.all())
 
 		for repo in repos_to_get:
-			logging.info("Adding repo " + repo.id + " to model queue to finish analyzing")
 			repo.status = "Building Model"
 			session.commit() # update status of repo
-			self.modelQueue.put(repo.id)
+
+			# only builds that don't touch R at all can run concurrently
+			if modelBuildIsConcurrent():
+				logging.info("Adding repo " + repo.id + " to work queue to build its model")
+				self.workQueue.add_task(buildModel, repo.id)
+			else:
+				logging.info("Adding repo " + repo.id + " to model queue to finish analyzing")
+				self.modelQueue.put(repo.id)
 
 		session.close()
 
@@ -93,104 +135,125 @@ class CAS_Manager(threading.Thread):
 		""" Checks if any repo is awaiting to build model. 
 			We are using a queue because we can't concurrently access R """
 
-		session = Session()
-
 		if self.modelQueue.empty() != True:
 			repo_id = self.modelQueue.get()
-			repo = (session.query(Repository).filter(Repository.id == repo_id).first())
-
-			# use data only up to X months prior we won't have sufficent data to build models
-			# as there may be bugs introduced in those months that haven't been fixed, skewing
-			# our model.
-			glm_model_time =  int(config['glm_modeling']['months']) 
-			data_months_datetime = datetime.utcnow() - MonthDelta(glm_model_time)
-			data_months_unixtime = calendar.timegm(data_months_datetime.utctimetuple())
-		
-			# all commits for repo prior to current time - glm model time
-			training_commits = (session.query(Commit)
-						.filter( 
-							( Commit.repository_id == repo_id ) &
-							( Commit.author_date_unix_timestamp < str(data_months_unixtime))
-						)
-						.order_by( Commit.author_date_unix_timestamp.desc() )
-						.all())
-
-			# all commits for repo after or on current time - glm model time
-			testing_commits = (session.query(Commit)
-						.filter(
-							( Commit.repository_id == repo_id ) &
-							( Commit.author_date_unix_timestamp >= str(data_months_unixtime)))
-						.all())
-	
-			try: 
-				metrics_generator = MetricsGenerator(repo_id, training_commits, testing_commits)
-				metrics_generator.buildAllModels()
-
-				# montly data dump - or rather, every 30 days.
-				dump_refresh_date = str(datetime.utcnow() - timedelta(days=30))
-				if repo.last_data_dump == None or repo.last_data_dump < dump_refresh_date:
-					logging.info("Generating a monthly data dump for repository: " + repo_id)
-
-					# Get all commits for the repository
-					all_commits = (session.query(Commit)
-						.filter( 
-							( Commit.repository_id == repo_id )
-						)
-						.order_by( Commit.author_date_unix_timestamp.desc() )
-						.all())
-
-					metrics_generator.dumpData(all_commits)
-					repo.last_data_dump = str(datetime.now().replace(microsecond=0))
-					
-				# Notify user if repo has never been analyzed previously
-				if repo.analysis_date is None:
-					self.notify(repo)
-	
-				logging.info("Repo " + repo_id + " finished analyzing.")
-				repo.analysis_date = str(datetime.now().replace(microsecond=0))
-				repo.status = "Analyzed"
-				session.commit() # update status of repo
-				session.close()
-
-			# uh-oh
-			except Exception as e:
-				logging.exception("Got an exception building model for repository " + repo_id)
-
-				repo.status = "Error"
-				session.commit() # update repo status
-				session.close()
+			buildModel(repo_id)
 
 	def notify(self, repo):
 		""" Send e-mail notifications if applicable to a repo 
 			used by checkBuildModel """
 
-		notify = False
-		notifier = None
-		logging.info("Notifying subscribed users for repository " + repo.id)
-
-		# Create the Notifier
-		gmail_user = config['gmail']['user']
-		gmail_pass = config['gmail']['pass']
-		notifier = Notifier(gmail_user, gmail_pass, repo.name)
-
-		# Add subscribers if applicable
-		if repo.email is not None:
-			notifier.addSubscribers([repo.email, gmail_user])
-		else:
-			notifier.addSubscribers([gmail_user])
-
-		notifier.notify()
+		notify(repo)
 
 	def run(self):
 
+		self.resetInterruptedWork()
+
 		while(True):
 			### --- Check repository table if there is any work to be done ---  ###
 			self.checkIngestion()
+			self.checkReclassification()
 			self.checkAnalyzation()
 			self.checkModel()
 			self.checkBuildModel()
 			time.sleep(10)
 
+def modelBuildIsConcurrent():
+	""" Whether neither the median model nor the configured GLM backend uses R, which
+		can't be used concurrently, so models can be built by the workers """
+
+	glm_backend = getBackendClass(config['glm_modeling'].get('backend', 'r'))
+	return glm_backend.concurrent and MedianModel.concurrent
+
+def buildModel(repo_id):
+	""" Builds the models of a repo that finished analyzing. Runs in the manager thread
+		if the GLM backend is R, which can't be used concurrently, else in a worker """
+
+	session = Session()
+
+	repo = (session.query(Repository).filter(Repository.id == repo_id).first())
+
+	# use data only up to X months prior we won't have sufficent data to build models
+	# as there may be bugs introduced in those months that haven't been fixed, skewing
+	# our model.
+	glm_model_time =  int(config['glm_modeling']['months']) 
+	data_months_datetime = datetime.utcnow() - MonthDelta(glm_model_time)
+	data_months_unixtime = calendar.timegm(data_months_datetime.utctimetuple())
+
+	# all commits for repo prior to current time - glm model time; only their metrics are
+	# loaded, by the metrics generator
+	training_commits = (session.query(Commit)
+				.filter( 
+					( Commit.repository_id == repo_id ) &
+					( Commit.author_date_unix_timestamp < str(data_months_unixtime))
+				))
+
+	# all commits for repo after or on current time - glm model time
+	testing_commits = (session.query(Commit)
+				.filter(
+					( Commit.repository_id == repo_id ) &
+					( Commit.author_date_unix_timestamp >= str(data_months_unixtime)))
+				.all())
+
+	try: 
+		metrics_generator = MetricsGenerator(repo_id, training_commits, testing_commits)
+		metrics_generator.buildAllModels()
+
+		# montly data dump - or rather, every 30 days.
+		dump_refresh_date = str(datetime.utcnow() - timedelta(days=30))
+		if repo.last_data_dump == None or repo.last_data_dump < dump_refresh_date:
+			logging.info("Generating a monthly data dump for repository: " + repo_id)
+
+			# Get all commits for the repository
+			all_commits = (session.query(Commit)
+				.filter( 
+					( Commit.repository_id == repo_id )
+				)
+				.order_by( Commit.author_date_unix_timestamp.desc() )
+				.all())
+
+			metrics_generator.dumpData(all_commits)
+			repo.last_data_dump = str(datetime.now().replace(microsecond=0))
+			
+		# Notify user if repo has never been analyzed previously
+		if repo.analysis_date is None:
+			notify(repo)
+
+		logging.info("Repo " + repo_id + " finished analyzing.")
+		repo.analysis_date = str(datetime.now().replace(microsecond=0))
+		repo.status = "Analyzed"
+		session.commit() # update status of repo
+		session.close()
+
+	# uh-oh
+	except Exception as e:
+		logging.exception("Got an exception building model for repository " + repo_id)
+
+		repo.status = "Error"
+		session.commit() # update repo status
+		session.close()
+
+def notify(repo):
+	""" Send e-mail notifications if applicable to a repo 
+		used by checkBuildModel """
+
+	notify = False
+	notifier = None
+	logging.info("Notifying subscribed users for repository " + repo.id)
+
+	# Create the Notifier
+	gmail_user = config['gmail']['user']
+	gmail_pass = config['gmail']['pass']
+	notifier = Notifier(gmail_user, gmail_pass, repo.name)
+
+	# Add subscribers if applicable
+	if repo.email is not None:
+		notifier.addSubscribers([repo.email, gmail_user])
+	else:
+		notifier.addSubscribers([gmail_user])
+
+	notifier.notify()
+
 class Worker(threading.Thread):
 	"""Thread executing tasks from a given tasks queue"""
 	def __init__(self, tasks):
@@ -224,3 +287,52 @@ class ThreadPool:
 	def wait_completion(self):
 		"""Wait for completion of all the tasks in the queue"""
 		self.tasks.join()
+
+def initWorkerProcess():
+	"""
+	Runs once in every worker process. The forked process inherited the
+	manager's pooled database connections, whose sockets are still used by
+	the manager. The process drops its references to them without closing
+	them, which would terminate the manager's sessions, and opens its own.
+	"""
+	engine.dispose(close=False)
+
+def runTask(func, args, kargs):
+	"""Runs a task in a worker process and returns how long it took"""
+	start = time.time()
+	func(*args, **kargs)
+	return time.time() - start
+
+class ProcessPool:
+	"""Pool of processes consuming tasks, with the same interface as ThreadPool"""
+	def __init__(self, num_processes):
+		# fork: script.py would start another CAS_Manager if workers re-imported it
+		self.executor = concurrent.futures.ProcessPoolExecutor(num_processes,
+			mp_context=multiprocessing.get_context('fork'), initializer=initWorkerProcess)
+		self.futures = set()
+		self.lock = threading.Lock()
+
+	def add_task(self, func, *args, **kargs):
+		"""Add a task to the pool"""
+		future = self.executor.submit(runTask, func, args, kargs)
+		name = func.__name__ + str(args)
+
+		with self.lock:
+			self.futures.add(future)
+		future.add_done_callback(lambda done: self._task_done(done, name))
+
+	def _task_done(self, future, name):
+		"""Reports the outcome of a task back in the manager process"""
+		with self.lock:
+			self.futures.discard(future)
+
+		try:
+			logging.info("Worker process finished " + name + " in " + str(round(future.result(), 2)) + "s")
+		except Exception as e:
+			logging.error("Worker process failed " + name, exc_info=e)
+
+	def wait_completion(self):
+		"""Wait for completion of all the tasks in the pool"""
+		with self.lock:
+			futures = list(self.futures)
+		concurrent.futures.wait(futures)
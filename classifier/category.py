@@ -1,4 +1,5 @@
 import csv # csv module for reading in comma-seperated files
+import re
 
 class Category():
 	""" 
@@ -28,22 +29,32 @@ class Category():
 				for word in row:
 					self.associatedWords.append(word)
 
+	def pattern(self):
+		"""
+		returns a regular expression source that matches a lowercased commit
+		message wherever one of the associated words occurs, or None if no
+		message can belong to this category.
+		"""
+		# a message belongs if an associated word is part of one of its space
+		# separated words, i.e. occurs anywhere in it without crossing a space
+		words = [word for word in self.associatedWords if " " not in word]
+		if not words:
+			return None
+
+		return "|".join(re.escape(word) for word in words)
+
 	def belongs(self, commit_msg):
 		"""
 		checks if a commit belongs to this category by analyzing
 		its commit message.
 		@return boolean
 		"""
-		commit_msg = commit_msg.lower().split(" ") # to array
+		pattern = self.pattern()
+		if pattern is None:
+			return False
 
 		# need to go beyond list contains i.e. fixed = fix
-		for word in commit_msg:
-			for assoc_word in self.associatedWords:
-				if assoc_word in word:
-					return True
-
-		# No associated words found!
-		return False
+		return re.search(pattern, commit_msg.lower()) is not None
 
 	def getName(self):
 		""" 
@@ -1,13 +1,20 @@
 from classifier.category import *
+from functools import lru_cache
 import os 
+import re
+import threading
 
 class Classifier():
 	"""
 	Classifier classifies commit messages into their appropriate
 	category. ALso defines the categories to be used.
+
+	A classifier is not changed after it is created, so a single one can be
+	shared by all threads; use getClassifier() rather than creating one per
+	repository.
 	"""
 
-	categories = [] # array of possible commit categories
+	CACHE_SIZE = 65536 # number of distinct messages to remember the category of
 
 	def __init__(self):
 		"""
@@ -16,8 +23,10 @@ class Classifier():
 		"""
 
 		# Get directory of the csv files of associated words for categories
-		current_dir = os.path.dirname(__file__)
-		dir_of_cats = current_dir + '/Categories'
+		dir_of_cats = categoriesDirectory()
+
+		# the categories as they were when read, to notice when they are edited
+		self.version = categoriesVersion()
 
 		# Create the categories - takes in the location of the csv that defines associated words
 		#for the category & classification name
@@ -27,20 +36,115 @@ class Classifier():
 		perfective = Category(dir_of_cats + "/perfective.csv", "Perfective")
 		perventive = Category(dir_of_cats + "/preventative.csv", "Preventative")
 
-		# add to list of categories
-		self.categories.extend([corrective,feature_addition,non_functional,perfective,perventive])
+		# list of categories, in order of precedence
+		self.categories = (corrective,feature_addition,non_functional,perfective,perventive)
+
+		self.compile(self.categories)
+
+	def compile(self, categories):
+		"""
+		compiles the associated words of all categories into one regular
+		expression with a group per category, plus one expression per
+		category to settle precedence.
+		"""
+		self.compiled = [] # (category name, compiled expression) in order of precedence
+		alternatives = []
+
+		for category in categories:
+			pattern = category.pattern()
+			if pattern is None:
+				continue
+			self.compiled.append((category.getName(), re.compile(pattern)))
+			alternatives.append("(" + pattern + ")")
+
+		self.regex = re.compile("|".join(alternatives)) if alternatives else None
+
+		# boilerplate messages (e.g. "Merge branch ...") recur a lot
+		self.cachedCategorize = lru_cache(maxsize=self.CACHE_SIZE)(self.match)
+
+	def match(self, commit_msg):
+		"""
+		returns the category of a commit_msg, without the cache
+		"""
+		if self.regex is None:
+			return "None"
+
+		commit_msg = commit_msg.lower()
+
+		# One scan finds the earliest associated word of any category. Most
+		# messages either have none or belong to the first category it is in.
+		found = self.regex.search(commit_msg)
+		if found is None:
+			# doesn't classify to any of the categories
+			return "None"
+
+		# The first category with a matching word anywhere wins, so only the
+		# categories before the one found still have to be checked
+		for name, regex in self.compiled[:found.lastindex - 1]:
+			if regex.search(commit_msg) is not None:
+				return name
+
+		return self.compiled[found.lastindex - 1][0]
 
 	def categorize(self, commit_msg):
 		"""
 		returns the category of a commit_msg
 		"""
-		category_found = False
+		return self.cachedCategorize(commit_msg)
 
-		# See if commmit message belongs to any category
-		for category in self.categories:
-			if category.belongs(commit_msg):
-				return category.getName()
+	def categorizeMany(self, commit_msgs):
+		"""
+		returns the categories of a list of commit messages, in order
+		"""
+		categorize = self.cachedCategorize
+		return [categorize(commit_msg) for commit_msg in commit_msgs]
+
+def categoriesDirectory():
+	"""
+	returns the directory of the csv files of associated words for categories
+	"""
+	return os.path.dirname(__file__) + '/Categories'
+
+def categoriesVersion():
+	"""
+	returns the names and modification times of the category files, which
+	change when a category is edited
+	"""
+	dir_of_cats = categoriesDirectory()
+	return tuple((name, os.stat(os.path.join(dir_of_cats, name)).st_mtime_ns)
+		for name in sorted(os.listdir(dir_of_cats)))
+
+_shared = None # the classifier shared by the whole process
+_sharedLock = threading.Lock()
+
+def getClassifier():
+	"""
+	returns the classifier shared by the whole process, reading the
+	categories the first time it is needed and again whenever they were
+	edited since, so a running manager and its workers classify new commits
+	with the same rules as `script.py reclassify`
+	"""
+	global _shared
+
+	classifier = _shared
+	if classifier is None or classifier.version != categoriesVersion():
+		with _sharedLock:
+			if _shared is None or _shared.version != categoriesVersion():
+				_shared = Classifier()
+			classifier = _shared
+
+	return classifier
+
+def reloadClassifier():
+	"""
+	re-reads the category files, e.g. after Categories/*.csv was edited, and
+	returns the new shared classifier. Classifications already running keep
+	using the classifier they started with.
+	"""
+	global _shared
 
-		# doesn't classify to any of the above
-		return "None"
+	classifier = Classifier()
+	with _sharedLock:
+		_shared = classifier
 
+	return classifier
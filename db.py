@@ -19,4 +19,41 @@ engine = sqlalchemy.create_engine(config['db']['type'] + '+' +
                                   config['db']['port'] + '/' +
                                   config['db']['database'], pool_size=100, max_overflow=0) # the value of pool_size has to be less than the max_connections to postgres.
 Session.configure(bind=engine)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+def bulkUpdate(connection, table, key, rows):
+    """
+    bulkUpdate(connection, table, key, rows): Connection, Table, String, List -> Integer
+    description: Updates many rows of a table with a single
+        UPDATE ... FROM (VALUES ...) statement instead of one statement per
+        row. Every row is a dictionary with the key column and the same set
+        of columns to update.
+    returns: Integer - the number of rows updated
+    """
+    if len(rows) == 0:
+        return 0
+
+    columns = [key] + [name for name in rows[0] if name != key]
+    params = {}
+    values = []
+
+    for index, row in enumerate(rows):
+        placeholders = []
+        for position, name in enumerate(columns):
+            param = 'p' + str(index) + '_' + str(position)
+            params[param] = row[name]
+
+            # the first row types the VALUES list, in case it holds NULLs
+            if index == 0:
+                placeholders.append('CAST(:' + param + ' AS ' +
+                    table.c[name].type.compile(dialect=connection.dialect) + ')')
+            else:
+                placeholders.append(':' + param)
+        values.append('(' + ', '.join(placeholders) + ')')
+
+    statement = text('UPDATE ' + table.name + ' SET ' +
+                     ', '.join(name + ' = v.' + name for name in columns[1:]) +
+                     ' FROM (VALUES ' + ', '.join(values) + ') AS v(' + ', '.join(columns) + ')' +
+                     ' WHERE ' + table.name + '.' + key + ' = v.' + key)
+
+    return connection.execute(statement, params).rowcount
@@ -2,15 +2,79 @@
 Representing a single file in a commit
 @name				name of file
 @loc 				lines of code in file
-@authors		 all authors of the file
+@authors		 ids of all authors of the file
 @nuc				 number of unique changes made to the file
 """
+import sys
 
 class CommitFile:
 
+	# no per instance __dict__; there is one of these for every path ever changed
+	__slots__ = ('name', 'loc', 'authors', 'lastchanged', 'nuc')
+
 	def __init__(self, name, loc, authors, lastchanged):
 		self.name = name												# File name
 		self.loc = loc													# LOC in file
-		self.authors = authors									# Array of authors
+		self.authors = authors									# frozenset of author ids
 		self.lastchanged = lastchanged					# unix time stamp of when last changed
 		self.nuc = 1														# number of unique changes to the file
+
+class FileHistory:
+	"""
+	Holds the CommitFile of every path seen in a repository. Paths are interned
+	and authors are stored as integer ids, so that files changed in the same
+	commit can share a single immutable author set.
+	"""
+
+	__slots__ = ('files', 'authorIds')
+
+	def __init__(self):
+		self.files = {}													# file name -> CommitFile
+		self.authorIds = {}											# author name -> author id
+
+	def __contains__(self, name):
+		return name in self.files
+
+	def __getitem__(self, name):
+		return self.files[name]
+
+	def __len__(self):
+		return len(self.files)
+
+	def authorId(self, author):
+		"""
+		returns the integer id of an author, assigning a new one if needed
+		"""
+		authorId = self.authorIds.get(author)
+		if authorId is None:
+			authorId = len(self.authorIds)
+			self.authorIds[author] = authorId
+		return authorId
+
+	def add(self, name, loc, authors, lastchanged):
+		"""
+		starts tracking a new file and returns its CommitFile
+		"""
+		name = sys.intern(name)
+		commitFile = CommitFile(name, loc, authors, lastchanged)
+		self.files[name] = commitFile
+		return commitFile
+
+class DevExperience:
+	"""
+	Experience of a single developer: the number of files changed per
+	subsystem, plus the running total over all subsystems.
+	"""
+
+	__slots__ = ('total', 'subsystems')
+
+	def __init__(self):
+		self.total = 0													# files changed in all subsystems
+		self.subsystems = {}										# subsystem -> files changed
+
+	def add(self, subsystem):
+		"""
+		records a change to a file in the subsystem
+		"""
+		self.subsystems[subsystem] = self.subsystems.get(subsystem, 0) + 1
+		self.total += 1
@@ -1,10 +1,10 @@
 import os
 import subprocess
-import json
 import logging
 import math                               # Required for the math.log function
 from ingester.commitFile import *         # Represents a file
 from classifier.classifier import *       # Used for classifying each commit
+from config import config
 import time
 
 """
@@ -21,28 +21,35 @@ class Git():
                     self.path is set in a parent class
     description: a very basic abstraction for using git in python.
     """
-    # Two backslashes to allow one backslash to be passed in the command.
-    # This is given as a command line option to git for formatting output.
+    # The log is read as a stream of NUL terminated records (git log -z). Each
+    # commit starts with a marker record followed by one record per property
+    # in LOG_FIELDS, then one record per --numstat entry. Git does not allow
+    # NUL characters in commit messages, so no escaping is required.
 
     # A commit mesasge in git is done such that first line is treated as the subject,
     # and the rest is treated as the message. We combine them under field commit_message
 
     # We want the log in ascending order, so we call --reverse
     # Numstat is used to get statistics for each commit
-    LOG_FORMAT = '--pretty=format:\" CAS_READER_STARTPRETTY\
-    \\"parent_hashes\\"CAS_READER_PROP_DELIMITER: \\"%P\\",CAS_READER_PROP_DELIMITER2\
-    \\"commit_hash\\"CAS_READER_PROP_DELIMITER: \\"%H\\",CAS_READER_PROP_DELIMITER2\
-    \\"author_name\\"CAS_READER_PROP_DELIMITER: \\"%an\\",CAS_READER_PROP_DELIMITER2\
-    \\"author_email\\"CAS_READER_PROP_DELIMITER: \\"%ae\\",CAS_READER_PROP_DELIMITER2\
-    \\"author_date\\"CAS_READER_PROP_DELIMITER: \\"%ad\\",CAS_READER_PROP_DELIMITER2\
-    \\"author_date_unix_timestamp\\"CAS_READER_PROP_DELIMITER: \\"%at\\",CAS_READER_PROP_DELIMITER2\
-    \\"commit_message\\"CAS_READER_PROP_DELIMITER: \\"%s%b\\"\
-    CAS_READER_STOPPRETTY \" --numstat --reverse '
+    LOG_MARKER = '\x1eCAS_READER_COMMIT'
+    LOG_FIELDS = ['parent_hashes', 'commit_hash', 'author_name', 'author_email',
+                  'author_date', 'author_date_unix_timestamp', 'commit_message']
+    LOG_FORMAT = ('--pretty=format:"%x1eCAS_READER_COMMIT%x00%P%x00%H%x00%an%x00%ae%x00%ad%x00%at%x00%s%b%x00"'
+                  ' -z --numstat --reverse ')
+    LOG_READ_SIZE = 65536                 # bytes read from the git pipe at a time
 
     CLONE_CMD = 'git clone {!s} {!s}'     # git clone command w/o downloading src code
+    MIRROR_CLONE_CMD = 'git clone --mirror{!s} {!s} {!s}'   # bare mirror, optionally w/ a --filter
+    FETCH_CMD = 'git fetch --prune origin'  # updates every ref of a bare mirror
     PULL_CMD = 'git pull'      # git pull command
     RESET_CMD = 'git reset --hard FETCH_HEAD'
     CLEAN_CMD = 'git clean -df' # f for force clean, d for untracked directories
+    IS_ANCESTOR_CMD = 'git merge-base --is-ancestor {!s} HEAD'
+    PROMISOR_CMD = 'git config --get remote.origin.promisor'  # true for partial clones
+    MISSING_OBJECTS_CMD = 'git rev-list --objects --missing=print {!s}'
+    # fetches the objects named on stdin, the way git itself fetches a missing blob
+    FETCH_OBJECTS_CMD = ('git -c fetch.negotiationAlgorithm=noop fetch origin --no-tags'
+                         ' --no-write-fetch-head --recurse-submodules=no --filter=blob:none --stdin')
 
     REPO_DIRECTORY = "/CASRepos/git/"        # directory in which to store repositories
 
@@ -50,24 +57,26 @@ class Git():
         """
         getCommitStatsProperties
         Helper method for log. Caclulates statistics for each change/commit and
-        returns them as a comma seperated string. Log will add these to the commit object
+        returns them as a dictionary. Log will add these to the commit object
         properties
 
-        @param stats            These are the stats given by --numstat as an array
-        @param commitFiles      These are all tracked commit files
-        @param devExperience    These are all tracked developer experiences
+        @param stats            These are the stats given by --numstat as a list of
+                                (lines added, lines deleted, file name) tuples
+        @param commitFiles      These are all tracked commit files (a FileHistory)
+        @param devExperience    These are all tracked developer experiences (author -> DevExperience)
         @param author           The author of the commit
         @param unixTimeStamp    Time of the commit
         """
 
-        statProperties = ""
+        statProperties = {}
 
-        # Data structures to keep track of info needed for stats
-        subsystemsSeen = []                         # List of system names seen
-        directoriesSeen = []                        # List of directory names seen
-        locModifiedPerFile = []                     # List of modified loc in each file seen
-        authors = []                                # List of all unique authors seen for each file
-        fileAges = []                               # List of the ages for each file in a commit
+        # Data structures to keep track of info needed for stats. Sets keep every
+        # file of a commit O(1), so huge (e.g. vendoring) commits stay linear.
+        subsystemsSeen = set()                      # Set of system names seen
+        directoriesSeen = set()                     # Set of directory names seen
+        authors = set()                             # Ids of all unique authors seen for each file
+        filesTouched = []                           # CommitFile of each file in the commit
+        fileAges = set()                            # Set of the ages for each file in a commit
 
         # Stats variables
         la = 0                                      # lines added
@@ -83,96 +92,78 @@ class Git():
         rexp = 0                                    # experience weighted by age of files ( 1 / (n + 1))
         sexp = 0                                    # changes made previous by author in same subsystem
         totalLOCModified = 0                        # Total modified LOC across all files
+        locModifiedLog = 0                          # Sum of (modified LOC * log2(modified LOC)), for entrophy
         nuc = 0                                     # number of unique changes to the files
-        filesSeen = ""                              # files seen in change/commit
+        filesSeen = []                              # files seen in change/commit
 
-        for stat in stats:
+        experiences = devExperience.get(author)     # previous experience of the author
 
-            if( stat == ' ' or stat == '' ):
-                continue
+        for statLa, statLd, fileName in stats:
 
-            fileStat = stat.split("\\t")
-
-             # Check that we are only looking at file stat (i.e., remove extra newlines)
-            if( len(fileStat) < 2):
-                continue
-
-            # catch the git "-" line changes
+            # catch the git "-" line changes (i.e., binary files)
             try:
-                fileLa = int(fileStat[0])
-                fileLd = int(fileStat[1])
+                fileLa = int(statLa)
+                fileLd = int(statLd)
             except:
                 fileLa = 0
                 fileLd = 0
 
-            # Remove oddities in filename so we can process it
-            fileName = (fileStat[2].replace("'",'').replace('"','').replace("\\",""))
-
             totalModified = fileLa + fileLd
 
             # have we seen this file already?
             if(fileName in commitFiles):
                 prevFileChanged = commitFiles[fileName]
-                prevLOC = getattr(prevFileChanged, 'loc')
-                prevAuthors = getattr(prevFileChanged, 'authors')
-                prevChanged = getattr(prevFileChanged, 'lastchanged')
-                file_nuc = getattr(prevFileChanged, 'nuc')
+                prevLOC = prevFileChanged.loc
+                prevChanged = prevFileChanged.lastchanged
+                file_nuc = prevFileChanged.nuc
                 nuc += file_nuc
                 lt += prevLOC
 
-                for prevAuthor in prevAuthors:
-                    if prevAuthor not in authors:
-                        authors.append(prevAuthor)
+                authors.update(prevFileChanged.authors)
 
                 # Convert age to days instead of seconds
-                age += ( (int(unixTimeStamp) - int(prevChanged)) / 86400 )
-                fileAges.append(prevChanged)
+                age += ( (int(unixTimeStamp) - prevChanged) / 86400 )
+                fileAges.add(prevChanged)
 
                 # Update the file info
 
                 file_nuc += 1 # file was modified in this commit
-                setattr(prevFileChanged, 'loc', prevLOC + fileLa - fileLd)
-                setattr(prevFileChanged, 'authors', authors)
-                setattr(prevFileChanged, 'lastchanged', unixTimeStamp)
-                setattr(prevFileChanged, 'nuc', file_nuc)
+                prevFileChanged.loc = prevLOC + fileLa - fileLd
+                prevFileChanged.lastchanged = int(unixTimeStamp)
+                prevFileChanged.nuc = file_nuc
+                filesTouched.append(prevFileChanged)
 
             else:
 
                 # new file we haven't seen b4, add it to file commit files dict
-                if(author not in authors):
-                    authors.append(author)
+                authors.add(commitFiles.authorId(author))
+                fileAges.add(unixTimeStamp)
 
-                if(unixTimeStamp not in fileAges):
-                    fileAges.append(unixTimeStamp)
-
-                fileObject = CommitFile(fileName, fileLa - fileLd, authors, unixTimeStamp)
-                commitFiles[fileName] = fileObject
+                fileObject = commitFiles.add(fileName, fileLa - fileLd, None, int(unixTimeStamp))
+                filesTouched.append(fileObject)
 
             # end of stats loop
 
-            locModifiedPerFile.append(totalModified) # Required for entrophy
+            # Required for entrophy: -sum(p * log2(p)) over all files, with
+            # p = modified / total, is (total * log2(total) - sum(modified * log2(modified))) / total
+            if( totalModified != 0 ):
+                locModifiedLog += totalModified * math.log( totalModified, 2 )
             totalLOCModified += totalModified
-            fileDirs = fileName.split("/")
 
-            if( len(fileDirs) == 1 ):
+            directory, separator, fileBase = fileName.rpartition("/")
+            if( separator == "" ):
                 subsystem = "root"
                 directory = "root"
             else:
-                subsystem = fileDirs[0]
-                directory = "/".join(fileDirs[0:-1])
+                subsystem = fileName[0:fileName.index("/")]
 
-            if( subsystem not in subsystemsSeen ):
-                subsystemsSeen.append( subsystem )
+            subsystemsSeen.add( subsystem )
 
-            if( author in devExperience ):
-                experiences = devExperience[author]
-                exp += sum(experiences.values())
+            if( experiences is not None ):
+                exp += experiences.total
 
-                if( subsystem in experiences ):
-                    sexp = experiences[subsystem]
-                    experiences[subsystem] += 1
-                else:
-                    experiences[subsystem] = 1
+                if( subsystem in experiences.subsystems ):
+                    sexp = experiences.subsystems[subsystem]
 
                 try:
                     rexp += (1 / (age) + 1)
@@ -180,21 +171,29 @@ class Git():
                     rexp += 0
 
             else:
-                devExperience[author] = {subsystem: 1}
+                experiences = DevExperience()
+                devExperience[author] = experiences
+
+            experiences.add(subsystem)
 
-            if( directory not in directoriesSeen ):
-                directoriesSeen.append( directory )
+            directoriesSeen.add( directory )
 
             # Update file-level metrics
             la += fileLa
             ld += fileLd
             nf += 1
-            filesSeen += fileName + ",CAS_DELIMITER,"
+            filesSeen.append(fileName)
 
         # End stats loop
 
         if( nf < 1):
-            return ""
+            return statProperties
+
+        # Every file changed in this commit now has the same authors, so they
+        # all share one immutable set
+        authors = frozenset(authors)
+        for fileChanged in filesTouched:
+            fileChanged.authors = authors
 
         # Update commit-level metrics
         ns = len(subsystemsSeen)
@@ -206,143 +205,206 @@ class Git():
         rexp = rexp / nf
 
         # Update entrophy
-        for fileLocMod in locModifiedPerFile:
-            if (fileLocMod != 0 ):
-                avg = fileLocMod/totalLOCModified
-                entrophy -= ( avg * math.log( avg,2 ) )
+        if( totalLOCModified != 0 ):
+            entrophy = max(0, ( totalLOCModified * math.log( totalLOCModified, 2 ) - locModifiedLog ) / totalLOCModified)
 
         # Add stat properties to the commit object
-        statProperties += ',"la":"' + str( la ) + '\"'
-        statProperties += ',"ld":"' + str( ld ) + '\"'
-        statProperties += ',"fileschanged":"' + filesSeen[0:-1] + '\"'
-        statProperties += ',"nf":"' + str( nf ) + '\"'
-        statProperties += ',"ns":"' + str( ns ) + '\"'
-        statProperties += ',"nd":"' + str( nd ) + '\"'
-        statProperties += ',"entrophy":"' + str(  entrophy ) + '\"'
-        statProperties += ',"ndev":"' + str( ndev ) + '\"'
-        statProperties += ',"lt":"' + str( lt ) + '\"'
-        statProperties += ',"nuc":"' + str( nuc ) + '\"'
-        statProperties += ',"age":"' + str( age ) + '\"'
-        statProperties += ',"exp":"' + str( exp ) + '\"'
-        statProperties += ',"rexp":"' + str( rexp ) + '\"'
-        statProperties += ',"sexp":"' + str( sexp ) + '\"'
+        statProperties['la'] = str( la )
+        statProperties['ld'] = str( ld )
+        statProperties['fileschanged'] = ",CAS_DELIMITER,".join( filesSeen )
+        statProperties['nf'] = str( nf )
+        statProperties['ns'] = str( ns )
+        statProperties['nd'] = str( nd )
+        statProperties['entrophy'] = str( entrophy )
+        statProperties['ndev'] = str( ndev )
+        statProperties['lt'] = str( lt )
+        statProperties['nuc'] = str( nuc )
+        statProperties['age'] = str( age )
+        statProperties['exp'] = str( exp )
+        statProperties['rexp'] = str( rexp )
+        statProperties['sexp'] = str( sexp )
 
         return statProperties
     # End stats
 
-    def log(self, repo, firstSync):
+    def readLog(stream):
+        """
+        readLog(stream): File -> Generator
+        arguments: stream File: the binary stdout pipe of a `git log -z` process
+        description: Helper method for log. Reads the NUL delimited log
+            incrementally and yields a (commit properties dict, stats list) tuple
+            per commit. Only one commit is ever held in memory at a time.
         """
-        log(): Repository, Boolean -> Dictionary
+        commit = None
+        stats = []
+        fields = []
+        pendingStat = None          # (la, ld) of a rename waiting for its paths
+        pendingPaths = []
+        buffered = b''
+
+        for chunk in iter(lambda: stream.read(Git.LOG_READ_SIZE), b''):
+            records = (buffered + chunk).split(b'\0')
+            buffered = records.pop()      # last record may still be incomplete
+
+            for record in records:
+                record = record.decode('utf-8', 'replace')
+
+                if record.lstrip('\n') == Git.LOG_MARKER:
+                    if commit is not None:
+                        yield commit, stats
+                    commit = {}
+                    stats = []
+                    fields = list(Git.LOG_FIELDS)
+                    continue
+
+                if commit is None:
+                    continue
+
+                # Start with the commit info (i.e., commit hash, author, date, subject, etc)
+                if len(fields) > 0:
+                    commit[fields.pop(0)] = record
+                    continue
+
+                # A rename is given as "la\tld\t" followed by the old and new path
+                if pendingStat is not None:
+                    pendingPaths.append(record)
+                    if len(pendingPaths) == 2:
+                        stats.append(pendingStat + (pendingPaths[1],))
+                        pendingStat = None
+                        pendingPaths = []
+                    continue
+
+                fileStat = record.lstrip('\n').split('\t', 2)
+
+                # Check that we are only looking at file stat (i.e., remove separators)
+                if len(fileStat) < 3:
+                    continue
+
+                if fileStat[2] == '':
+                    pendingStat = (fileStat[0], fileStat[1])
+                else:
+                    stats.append((fileStat[0], fileStat[1], fileStat[2]))
+
+        if commit is not None:
+            yield commit, stats
+
+    def log(self, repo, firstSync, state):
+        """
+        log(): Repository, Boolean, IngestState -> Generator
         arguments: repo Repository: the repository to clone
-                   firstSync Boolean: whether to sync all commits or after the
-            ingestion date
-        description: a very basic abstraction for using git in python.
+                   firstSync Boolean: whether to sync all commits or only the
+            commits after the one recorded in the state
+                   state IngestState: the file/developer state to resume from.
+            It is updated as commits are yielded.
+        description: a very basic abstraction for using git in python. Yields
+            a dictionary per commit as it is read from the git process.
         """
-        repo_dir = os.chdir(os.path.dirname(__file__) + self.REPO_DIRECTORY + repo.id)
+        repo_dir = self.repoDirectory(repo.id)
         logging.info('Getting/parsing git commits: '+ str(repo) )
 
-        # Spawn a git process and convert the output to a string
-        if not firstSync and repo.ingestion_date is not None:
-            cmd = 'git log --after="' + repo.ingestion_date + '" '
+        # Only read the commits made since the last sync if we know the file and
+        # developer state up to that commit. Otherwise the whole history must be
+        # replayed for the metrics to be correct.
+        if not firstSync and state.commit_hash is not None and \
+                subprocess.call(self.IS_ANCESTOR_CMD.format(state.commit_hash), shell=True, cwd = repo_dir) == 0:
+            cmd = 'git log ' + state.commit_hash + '..HEAD '
         else:
+            if not firstSync:
+                logging.info('No usable ingestion state, replaying the full history of repo: ' + str(repo))
+            state.clear()
             cmd = 'git log '
 
-        log = str( subprocess.check_output(cmd + self.LOG_FORMAT, shell=True, cwd = repo_dir ) )
-        log = log[2:-1]   # Remove head/end clutter
-
-        # List of json objects
-        json_list = []
-
-        # Make sure there are commits to parse
-        if len(log) == 0:
-            return []
-
-        commitFiles = {}            # keep track of ALL file changes
-        devExperience = {}          # Keep track of ALL developer experience
-        classifier = Classifier()   # classifier for classifying commits (i.e., corrective, feature addition, etc)
-
-        commitList = log.split("CAS_READER_STARTPRETTY")
-
-        for commit in commitList:
-            author = ""                                 # author of commit
-            unixTimeStamp = 0                           # timestamp of commit
-            fix = False                                 # whether or not the change is a defect fix
-            classification = None                       # classification of the commit (i.e., corrective, feature addition, etc)
-            isMerge = False                             # whether or not the change is a merge
-
-            commit = commit.replace('\\x', '\\u00')   # Remove invalid json escape characters
-            splitCommitStat = commit.split("CAS_READER_STOPPRETTY")  # split the commit info and its stats
-
-            # The first split will contain an empty list
-            if(len(splitCommitStat) < 2):
-                continue
+        self.fetchMissingBlobs(repo_dir, cmd[len('git log '):] or 'HEAD')
 
-            prettyCommit = splitCommitStat[0]
-            statCommit = splitCommitStat[1]
-            commitObject = ""
+        cmd = cmd + self.LOG_FORMAT
+        process = subprocess.Popen(cmd, shell=True, cwd = repo_dir, stdout=subprocess.PIPE)
 
-            # Start with the commit info (i.e., commit hash, author, date, subject, etc)
-            prettyInfo = prettyCommit.split(',CAS_READER_PROP_DELIMITER2    "')
-            for propValue in prettyInfo:
-                props = propValue.split('"CAS_READER_PROP_DELIMITER: "')
-                propStr = ''
-                for prop in props:
-                    prop = prop.replace('\\','').replace("\\n", '')  # avoid escapes & newlines for JSON formatting
-                    propStr = propStr + '"' + prop.replace('"','') + '":'
+        try:
+            for commitObject in self.buildCommits(self.readLog(process.stdout), state):
+                yield commitObject
 
-                values = propStr[0:-1].split(":")
+        finally:
+            process.stdout.close()
+            returnCode = process.wait()
 
-                if(values[0] == '"    parent_hashes"'):
-                    # Check to see if this is a merge change. Fix for Issue #26. 
-                    # Detects merges by counting the # of parent commits
-                    
-                    parents = values[1].split(' ')
-                    if len(parents) == 2:
-                        isMerge = True
+        if returnCode != 0:
+            raise subprocess.CalledProcessError(returnCode, cmd)
 
-                if(values[0] == '"author_name"'):
-                    author = values[1].replace('"', '')
+        logging.info('Done getting/parsing git commits.')
 
-                if(values[0] == '"author_date_unix_timestamp"'):
-                    unixTimeStamp = values[1].replace('"','')
+    def fetchMissingBlobs(repo_dir, revisions):
+        """
+        fetchMissingBlobs(repo_dir, revisions): String, String -> Integer
+        description: In a partial clone (a mirror with a blob_filter), fetches
+            the blobs of the given revisions that are not downloaded yet, in a
+            single request. Otherwise --numstat would make git fetch them lazily,
+            one round trip per blob. Returns the number of blobs fetched.
+        """
+        promisor = subprocess.run(Git.PROMISOR_CMD, shell=True, cwd=repo_dir,
+                                  stdout=subprocess.PIPE, universal_newlines=True).stdout
+        if promisor.strip() != 'true':
+            return 0
+
+        # missing objects are listed as ?<hash>, without fetching them
+        objects = subprocess.check_output(Git.MISSING_OBJECTS_CMD.format(revisions), shell=True,
+                                          cwd=repo_dir, universal_newlines=True)
+        missing = [line[1:] for line in objects.splitlines() if line.startswith('?')]
+        if len(missing) == 0:
+            return 0
+
+        logging.info('Fetching ' + str(len(missing)) + ' missing blobs in ' + repo_dir)
+        subprocess.run(Git.FETCH_OBJECTS_CMD, shell=True, cwd=repo_dir, check=True,
+                       input='\n'.join(missing) + '\n', universal_newlines=True)
+        return len(missing)
+
+    def buildCommits(records, state):
+        """
+        buildCommits(records, state): Generator, IngestState -> Generator
+        arguments: records Generator: (commit properties dict, stats list) tuples
+            in ascending order, as yielded by readLog
+                   state IngestState: the file/developer state to update
+        description: Helper method for log. Classifies each commit, adds its
+            statistics and yields the finished commit dictionary.
+        """
+        commitFiles = state.commitFiles         # keep track of ALL file changes
+        devExperience = state.devExperience     # Keep track of ALL developer experience
+        classifier = getClassifier()   # classifier for classifying commits (i.e., corrective, feature addition, etc)
 
-                # Classify the commit
-                if(values[0] == '"commit_message"'):
+        for commitObject, stats in records:
+            fix = False                                 # whether or not the change is a defect fix
+            classification = None                       # classification of the commit (i.e., corrective, feature addition, etc)
 
-                    if (isMerge):
-                        classification = "Merge"
-                    else:
-                        classification = classifier.categorize(values[1].lower())
+            # Check to see if this is a merge change. Fix for Issue #26.
+            # Detects merges by counting the # of parent commits
+            isMerge = len(commitObject['parent_hashes'].split(' ')) == 2
 
-                    # If it is a corrective commit, we induce it fixes a bug somewhere in the system
-                    if classification == "Corrective":
-                        fix = True
+            # avoid newlines in the stored message
+            commitObject['commit_message'] = commitObject['commit_message'].replace('\n', '')
 
+            # Classify the commit
+            if (isMerge):
+                classification = "Merge"
+            else:
+                classification = classifier.categorize(commitObject['commit_message'].lower())
 
-                commitObject += "," + propStr[0:-1]
-                # End property loop
-            # End pretty info loop
+            # If it is a corrective commit, we induce it fixes a bug somewhere in the system
+            if classification == "Corrective":
+                fix = True
 
             # Get the stat properties
-            stats = statCommit.split("\\n")
-            commitObject += self.getCommitStatsProperties(stats, commitFiles, devExperience, author, unixTimeStamp)
+            commitObject.update(Git.getCommitStatsProperties(stats, commitFiles, devExperience,
+                commitObject['author_name'], commitObject['author_date_unix_timestamp']))
 
             # Update the classification of the commit
-            commitObject += ',"classification":"' + str( classification ) + '\"'
-
-             # Update whether commit was a fix or not
-            commitObject += ',"fix":"' + str( fix ) + '\"'
+            commitObject['classification'] = str( classification )
 
-            # Remove first comma and extra space
-            commitObject = commitObject[1:].replace('    ','')
+            # Update whether commit was a fix or not
+            commitObject['fix'] = str( fix )
 
-            # Add commit object to json_list
-            json_list.append(json.loads('{' + commitObject + '}'))
+            state.commit_hash = commitObject['commit_hash']
+            yield commitObject
         # End commit loop
 
-        logging.info('Done getting/parsing git commits.')
-        return json_list
-
     def clone(self, repo):
         """
         clone(repo): Repository -> String
@@ -351,20 +413,29 @@ class Git():
         arguments: repo Repository: the repository to clone
         pre-conditions: The repo has not been already created
         """
-        repo_dir = os.chdir(os.path.dirname(__file__) + self.REPO_DIRECTORY)
+        repo_dir = self.repoDirectory('')
+        os.makedirs(repo_dir, exist_ok=True)
 
         # Run the clone command and return the results
 
+        # Neither the ingester nor the analyzer reads the working tree, so
+        # repositories can be kept as bare mirrors. A partial clone filter
+        # (i.e., blob:none) defers downloading blobs until git needs them.
+        if config['system'].get('repo_storage') == 'mirror':
+            blobFilter = config['system'].get('blob_filter')
+            filterOption = ' --filter=' + blobFilter if blobFilter else ''
+            cmd = self.MIRROR_CLONE_CMD.format(filterOption, repo.url, './' + repo.id)
+        else:
+            cmd = self.CLONE_CMD.format(repo.url, './' + repo.id)
+
         logging.info('Git cloning repo: '+ str(repo) )
         cloneResult = str(subprocess.check_output(
-                  self.CLONE_CMD.format(repo.url, './' + repo.id),
+                  cmd,
                   shell= True,
                   cwd = repo_dir ) )
         logging.info('Done cloning.')
         #logging.debug("Git clone result:\n" + cloneResult)
 
-        # Reset path for next repo
-
         # TODO: only return true on success, else return false
         return True
 
@@ -376,7 +447,14 @@ class Git():
         pre-conditions: The repo has already been created
         """
 
-        repo_dir = os.path.dirname(__file__) + self.REPO_DIRECTORY + repo.id
+        repo_dir = self.repoDirectory(repo.id)
+
+        # A bare mirror has no checkout to reset, fetching updates everything
+        if self.isBare(repo_dir):
+            logging.info('Fetching latest changes from repo: '+ str(repo) )
+            fetchResult = str(subprocess.check_output(self.FETCH_CMD, shell=True, cwd= repo_dir))
+            logging.info('Done fetching.')
+            return True
 
         # Weird sceneario where something in repo gets modified - reset all changes before pulling
         subprocess.call(self.RESET_CMD, shell=True, cwd= repo_dir)
@@ -393,3 +471,20 @@ class Git():
 
         # TODO: only return true on success, else return false
         return True
+
+    def isBare(repo_dir):
+        """
+        isBare(repo_dir): String -> Boolean
+        description: Whether the repository was cloned as a bare mirror
+        """
+        return not os.path.exists(os.path.join(repo_dir, '.git'))
+
+    def repoDirectory(repo_id):
+        """
+        repoDirectory(repo_id): String -> String
+        description: The absolute path of the clone of a repository. Every git
+            command is run with this as its cwd; the process wide working
+            directory is never changed, so many repositories can be processed
+            by concurrent workers.
+        """
+        return os.path.abspath(os.path.join(os.path.dirname(__file__) + Git.REPO_DIRECTORY, repo_id))
@@ -0,0 +1,232 @@
+"""
+file: gitobjects.py
+description: Holds the experimental in-process git adapter, which reads the
+             history of a local clone straight from its object database
+"""
+import os
+import heapq
+import itertools
+import datetime
+import logging
+from ingester.git import *
+from ingester.objectstore import *
+from ingester.treediff import *
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+class GitObjects(Git):
+    """
+    GitObjects():
+    description: A git adapter that walks the history by reading loose objects
+        and memory-mapped packs directly, and computes the numstat of each
+        commit with an in-process tree and line diff. It yields the same
+        commit records as Git.log without spawning a git process. It is
+        experimental: the line diff is pure Python, so reading a history takes
+        several times as long as with Git. Cloning and pulling are still done
+        by the git binary.
+    """
+
+    def formatDate(timestamp, zone):
+        """
+        formatDate(timestamp, zone): Integer, Bytes -> String
+        description: Formats an author date like git's default date format,
+            i.e. "Thu Apr 7 15:13:13 2005 -0700", in the author's time zone
+        """
+        try:
+            zoneValue = int(zone)
+        except ValueError:
+            zoneValue = 0
+        sign = -1 if zoneValue < 0 else 1
+        offset = sign * ((abs(zoneValue) // 100) * 3600 + (abs(zoneValue) % 100) * 60)
+        local = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=timestamp + offset)
+        return '%s %s %d %02d:%02d:%02d %d %+05d' % (WEEKDAYS[local.weekday()], MONTHS[local.month - 1],
+            local.day, local.hour, local.minute, local.second, local.year, zoneValue)
+
+    def formatMessage(message):
+        """
+        formatMessage(message): String -> String
+        description: Returns the message as git's "%s%b" shows it: the subject
+            paragraph joined into one line, followed by the body
+        """
+        lines = message.split('\n')
+        index = 0
+
+        # skip leading blank lines
+        while index < len(lines) and lines[index].strip() == '':
+            index += 1
+
+        subject = []
+        while index < len(lines) and lines[index].strip() != '':
+            subject.append(lines[index].rstrip())
+            index += 1
+
+        while index < len(lines) and lines[index].strip() == '':
+            index += 1
+
+        return ' '.join(subject) + '\n'.join(lines[index:])
+
+    def walk(store, head, exclude):
+        """
+        walk(store, head, exclude): ObjectStore, Bytes, Bytes -> List
+        description: Returns the binary shas of the commits reachable from head
+            but not from exclude (if given), newest first, in the order a plain
+            `git log` shows them: by commit date, ties in the order found.
+        """
+        queue = []
+        counter = itertools.count()
+        seen = set()
+        uninteresting = set()
+        parentsOf = {}
+        order = []
+
+        def markUninteresting(sha):
+            stack = [sha]
+            while stack:
+                current = stack.pop()
+                if current in uninteresting:
+                    continue
+                uninteresting.add(current)
+                stack.extend(parentsOf.get(current, []))
+
+        def push(sha, excluded):
+            if sha in seen:
+                if excluded:
+                    markUninteresting(sha)
+                return
+            seen.add(sha)
+            if excluded:
+                uninteresting.add(sha)
+            commit = parseCommit(store.readType(sha, OBJ_COMMIT))
+            parentsOf[sha] = commit['parents']
+            heapq.heappush(queue, (-parseIdent(commit['committer'])[2], next(counter), sha))
+
+        push(head, False)
+        if exclude is not None:
+            push(exclude, True)
+
+        while queue:
+            # nothing new can be found once only excluded commits are left
+            if exclude is not None and all(entry[2] in uninteresting for entry in queue):
+                break
+
+            negDate, count, sha = heapq.heappop(queue)
+            excluded = sha in uninteresting
+            parents = parentsOf[sha] if exclude is not None else parentsOf.pop(sha)
+
+            if not excluded:
+                order.append(sha)
+            for parent in parents:
+                push(parent, excluded)
+
+        if exclude is None:
+            return order
+        return [sha for sha in order if sha not in uninteresting]
+
+    def isAncestor(store, ancestor, head):
+        """
+        isAncestor(store, ancestor, head): ObjectStore, Bytes, Bytes -> Boolean
+        description: Whether ancestor is reachable from head. The walk is in
+            date order, so it stops early for recent ancestors.
+        """
+        queue = [(0, 0, head)]
+        counter = itertools.count(1)
+        seen = set([head])
+
+        while queue:
+            negDate, count, sha = heapq.heappop(queue)
+            if sha == ancestor:
+                return True
+            for parent in parseCommit(store.readType(sha, OBJ_COMMIT))['parents']:
+                if parent not in seen:
+                    seen.add(parent)
+                    date = parseIdent(parseCommit(store.readType(parent, OBJ_COMMIT))['committer'])[2]
+                    heapq.heappush(queue, (-date, next(counter), parent))
+
+        return False
+
+    def readObjects(store, shas):
+        """
+        readObjects(store, shas): ObjectStore, List -> Generator
+        description: Yields the same (commit properties dict, stats list)
+            tuples as readLog, for the given commits in the given order
+        """
+        treeDiff = TreeDiff(store)
+
+        for sha in shas:
+            commit = parseCommit(store.readType(sha, OBJ_COMMIT))
+            encoding = commit['encoding'] or 'utf-8'
+            name, email, timestamp, zone = parseIdent(commit['author'])
+
+            try:
+                message = commit['message'].decode(encoding, 'replace')
+            except LookupError:
+                message = commit['message'].decode('utf-8', 'replace')
+
+            commitObject = {
+                'parent_hashes': ' '.join(parent.hex() for parent in commit['parents']),
+                'commit_hash': sha.hex(),
+                'author_name': name.decode('utf-8', 'replace'),
+                'author_email': email.decode('utf-8', 'replace'),
+                'author_date': GitObjects.formatDate(timestamp, zone),
+                'author_date_unix_timestamp': str(timestamp),
+                'commit_message': GitObjects.formatMessage(message)
+            }
+
+            # like git log, merges have no diff and root commits add every file
+            if len(commit['parents']) == 0:
+                stats = treeDiff.numstat(None, commit['tree'])
+            elif len(commit['parents']) == 1:
+                parent = parseCommit(store.readType(commit['parents'][0], OBJ_COMMIT))
+                stats = treeDiff.numstat(parent['tree'], commit['tree'])
+            else:
+                stats = []
+
+            yield commitObject, stats
+
+    def log(self, repo, firstSync, state):
+        """
+        log(): Repository, Boolean, IngestState -> Generator
+        arguments: repo Repository: the repository to read
+                   firstSync Boolean: whether to sync all commits or only the
+            commits after the one recorded in the state
+                   state IngestState: the file/developer state to resume from.
+            It is updated as commits are yielded.
+        description: Same as Git.log, but reads the object database directly.
+        """
+        repo_dir = self.repoDirectory(repo.id)
+        logging.info('Reading git objects: '+ str(repo) )
+
+        store = ObjectStore(repo_dir)
+        try:
+            head = store.resolveRef('HEAD')
+            exclude = None
+
+            # Only read the commits made since the last sync if we know the file and
+            # developer state up to that commit, as in Git.log
+            if not firstSync and state.commit_hash is not None and \
+                    self.isAncestor(store, bytes.fromhex(state.commit_hash), head):
+                exclude = bytes.fromhex(state.commit_hash)
+            else:
+                if not firstSync:
+                    logging.info('No usable ingestion state, replaying the full history of repo: ' + str(repo))
+                state.clear()
+
+            # In a partial clone, the blobs to diff must be fetched first; they are
+            # added as a new pack, which the store only finds when it is reopened
+            revisions = 'HEAD' if exclude is None else state.commit_hash + '..HEAD'
+            if self.fetchMissingBlobs(repo_dir, revisions) > 0:
+                store.close()
+                store = ObjectStore(repo_dir)
+
+            # We want the log in ascending order
+            shas = self.walk(store, head, exclude)
+            shas.reverse()
+
+            for commitObject in self.buildCommits(self.readObjects(store, shas), state):
+                yield commitObject
+
+        finally:
+            store.close()
+
+        logging.info('Done reading git objects.')
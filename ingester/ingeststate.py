@@ -0,0 +1,92 @@
+"""
+file: ingeststate.py
+description: Holds the per-repository file/developer state that is carried
+             from one ingestion to the next
+"""
+import os
+import pickle
+import logging
+from ingester.commitFile import *
+
+class IngestState():
+    """
+    IngestState():
+    description: Snapshot of everything Git.log tracks across commits (the
+        CommitFile of every path and the experience of every author) together
+        with the hash of the last commit it accounts for. Saving it at the end
+        of a sync lets the next sync resume from that commit instead of
+        re-reading the whole history.
+    """
+
+    STATE_DIRECTORY = "/CASRepos/state/"   # directory in which to store snapshots
+    STATE_VERSION = 3                       # bumped when the snapshot layout changes
+
+    def __init__(self, repo_id):
+        """
+        __init__(repo_id): String -> NoneType
+        description: Creates an empty state, as used for a first sync
+        """
+        self.repo_id = repo_id
+        self.commit_hash = None     # last commit accounted for in this state
+        self.commitFiles = FileHistory()    # file name -> CommitFile
+        self.devExperience = {}             # author -> DevExperience
+
+    def path(self):
+        """
+        path() -> String
+        description: Location of the snapshot file of this repository
+        """
+        return os.path.dirname(__file__) + self.STATE_DIRECTORY + self.repo_id + ".pickle"
+
+    @staticmethod
+    def load(repo_id):
+        """
+        load(repo_id): String -> IngestState
+        description: Returns the last saved state of the repository, or an
+            empty state if none was saved or it can not be read.
+        """
+        state = IngestState(repo_id)
+
+        if not os.path.isfile(state.path()):
+            return state
+
+        try:
+            with open(state.path(), 'rb') as snapshot:
+                saved = pickle.load(snapshot)
+
+            # Snapshots of an older layout can not be resumed from
+            if saved.get('version') == IngestState.STATE_VERSION:
+                del saved['version']
+                state.__dict__.update(saved)
+        except Exception:
+            logging.exception('Could not read the ingestion state of repo ' + repo_id)
+            state = IngestState(repo_id)
+
+        return state
+
+    def save(self):
+        """
+        save()
+        description: Writes the state to disk. The snapshot is written to a
+            temporary file first so a crash never leaves a partial snapshot.
+        """
+        os.makedirs(os.path.dirname(self.path()), exist_ok=True)
+        tmp_path = self.path() + ".tmp"
+
+        with open(tmp_path, 'wb') as snapshot:
+            pickle.dump({'version': self.STATE_VERSION,
+                         'commit_hash': self.commit_hash,
+                         'commitFiles': self.commitFiles,
+                         'devExperience': self.devExperience},
+                        snapshot, pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, self.path())
+
+    def clear(self):
+        """
+        clear()
+        description: Forgets all tracked files and developers
+        """
+        self.commit_hash = None
+        self.commitFiles = FileHistory()
+        self.devExperience = {}
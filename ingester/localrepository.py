@@ -5,10 +5,15 @@ date: October 2013
 description: Holds the repository abstraction class
 """
 from ingester.git import *
+from ingester.gitobjects import *
+from ingester.ingeststate import *
 from orm.commit import *
+from config import config
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import insert
 import os
 import logging
+import time
 
 class LocalRepository():
     """
@@ -18,6 +23,13 @@ class LocalRepository():
     repo = None
     adapter = None
     start_date = None
+
+    BULK_INSERT_SIZE = 5000     # number of commits written per transaction
+    CHECKPOINT_SIZE = 50000     # number of commits ingested between two state checkpoints
+
+    # Columns owned by the analyzer; re-ingesting a commit must not reset them
+    ANALYZER_COLUMNS = ['linked', 'contains_bug', 'fixes', 'glm_probability']
+
     def __init__(self, repo):
         """
         __init__(path): String -> NoneType
@@ -25,8 +37,13 @@ class LocalRepository():
         """
         self.repo = repo
 
-        # Temporary until other Repo types are added
-        self.adapter = Git
+        # The git binary is used unless the experimental in-process object reader
+        # is configured, which is slower
+        if config['system'].get('git_adapter') == 'objects':
+            logging.warning('The objects git_adapter is experimental and slower than the git adapter')
+            self.adapter = GitObjects
+        else:
+            self.adapter = Git
 
         self.commits = {}
 
@@ -53,7 +70,7 @@ class LocalRepository():
         # Cache the start date to set later
         self.start_date = str(datetime.now().replace(microsecond=0))
 
-        path = os.path.dirname(__file__) + self.adapter.REPO_DIRECTORY + self.repo.id
+        path = self.adapter.repoDirectory(self.repo.id)
         # See if repo has already been downloaded, if it is pull, if not clone
         if os.path.isdir(path):
             self.adapter.pull(self.adapter, self.repo)
@@ -67,17 +84,116 @@ class LocalRepository():
     def syncCommits(self, firstSync):
         """
         syncCommits():
-        description: Makes each commit dictonary into an object and then
-            inserts them into the database
+        description: Streams the commit dictonaries into the database in
+            batches of BULK_INSERT_SIZE. The file/developer state of the
+            repository is resumed from, and saved back to, its snapshot.
+            Every CHECKPOINT_SIZE commits the stored commits are checkpointed,
+            so an interrupted ingestion resumes from the last checkpoint.
         arguments: firstSync Boolean: whether to sync all commits or after the
-            ingestion date
+            last synced commit
         """
-        commits = self.adapter.log(self.adapter, self.repo, firstSync)
-        commitsSession = Session()
+        state = IngestState.load(self.repo.id)
+        commits = self.adapter.log(self.adapter, self.repo, firstSync, state)
         logging.info('Saving commits to the database...')
+
+        batch = []
+        numRead = 0
+        numSaved = 0
+        writeTime = 0
+        startTime = time.time()
+
         for commitDict in commits:
             commitDict['repository_id'] = self.repo.id
-            commitsSession.merge(Commit(commitDict))
-        commitsSession.commit()
-        commitsSession.close()
-        logging.info('Done saving commits to the database.')
+            batch.append(commitDict)
+            numRead += 1
+            checkpoint = numRead % self.CHECKPOINT_SIZE == 0
+
+            if len(batch) == self.BULK_INSERT_SIZE or checkpoint:
+                writeTime += self.writeCommits(batch)
+                numSaved += len(batch)
+                logging.info('Saved ' + str(numSaved) + ' commits (' +
+                             self._rate(numSaved, writeTime) + ' rows/sec written)')
+                batch = []
+
+            # The state now accounts for exactly the commits stored so far.
+            # Replaying commits stored after a checkpoint is harmless, as
+            # they are upserted.
+            if checkpoint:
+                state.save()
+                logging.info('Checkpointed ingestion of repo ' + self.repo.id +
+                             ' at commit ' + state.commit_hash)
+
+        if len(batch) > 0:
+            writeTime += self.writeCommits(batch)
+            numSaved += len(batch)
+
+        logging.info('Done saving ' + str(numSaved) + ' commits to the database in ' +
+                     str(round(time.time() - startTime, 2)) + 's (' +
+                     self._rate(numSaved, writeTime) + ' rows/sec written).')
+
+        # Only snapshot the state once the commits it accounts for are stored
+        state.save()
+
+    def writeCommits(self, commitDicts):
+        """
+        writeCommits(commitDicts): List -> Float
+        description: Writes a batch of commit dictonaries to the commits table
+            in one transaction, by executing a single prepared INSERT ...
+            ON CONFLICT DO UPDATE for all of the rows. Unlike a multi-row
+            VALUES list, the number of bind parameters of the statement does
+            not grow with the batch, so it stays far below PostgreSQL's limit
+            of 65535. Commits that already exist keep the columns set by the
+            analyzer.
+        returns: Float - the seconds spent writing
+        """
+        statement, rows = self.upsertStatement(commitDicts)
+
+        startTime = time.time()
+        commitsSession = Session()
+        try:
+            commitsSession.execute(statement, rows)
+            commitsSession.commit()
+        finally:
+            commitsSession.close()
+
+        return time.time() - startTime
+
+    def upsertStatement(self, commitDicts):
+        """
+        upsertStatement(commitDicts): List -> Tuple
+        description: Builds the upsert of the commits table and the row of
+            parameters of each commit dictonary to execute it with
+        returns: Tuple - the INSERT statement and the list of rows
+        """
+        table = Commit.__table__
+        columns = [c for c in table.columns if c.name not in self.ANALYZER_COLUMNS]
+
+        # All rows must have the same keys; commits without file stats
+        # (i.e., merges) get the column defaults.
+        rows = []
+        for commitDict in commitDicts:
+            row = {}
+            for column in columns:
+                if column.name in commitDict:
+                    row[column.name] = commitDict[column.name]
+                elif column.default is not None:
+                    row[column.name] = column.default.arg
+                else:
+                    row[column.name] = None
+            rows.append(row)
+
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.commit_hash],
+            set_=dict((c.name, statement.excluded[c.name]) for c in columns if not c.primary_key))
+
+        return statement, rows
+
+    def _rate(self, rows, seconds):
+        """
+        _rate(rows, seconds): Integer, Float -> String
+        description: Formats a rows/sec figure for logging
+        """
+        if seconds <= 0:
+            return "n/a"
+        return str(int(rows / seconds))
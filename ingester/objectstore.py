@@ -0,0 +1,450 @@
+"""
+file: objectstore.py
+description: Reads the objects of a local git repository directly from disk
+             (loose objects and memory-mapped pack files) without running git
+"""
+import os
+import mmap
+import zlib
+import struct
+import collections
+
+# Pack object types
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {OBJ_COMMIT: 'commit', OBJ_TREE: 'tree', OBJ_BLOB: 'blob', OBJ_TAG: 'tag'}
+
+class ObjectNotFound(Exception):
+    """
+    Raised when an object is not in any loose object directory or pack
+    """
+    pass
+
+def applyDelta(base, delta):
+    """
+    applyDelta(base, delta): Bytes, Bytes -> Bytes
+    description: Rebuilds an object from its base and a git delta
+    """
+    pos = 0
+
+    # source and target sizes, as little endian base 128 numbers
+    for sizeIndex in range(2):
+        size = 0
+        shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        if sizeIndex == 0 and size != len(base):
+            raise ValueError('Delta base size mismatch')
+        targetSize = size
+
+    result = bytearray()
+    deltaLen = len(delta)
+
+    while pos < deltaLen:
+        op = delta[pos]
+        pos += 1
+
+        # copy from the base: the low bits tell which offset/size bytes follow
+        if op & 0x80:
+            offset = 0
+            size = 0
+            for bit in range(4):
+                if op & (1 << bit):
+                    offset |= delta[pos] << (bit * 8)
+                    pos += 1
+            for bit in range(3):
+                if op & (0x10 << bit):
+                    size |= delta[pos] << (bit * 8)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            result += base[offset:offset + size]
+
+        # insert the next op bytes literally
+        elif op:
+            result += delta[pos:pos + op]
+            pos += op
+
+        else:
+            raise ValueError('Invalid delta opcode')
+
+    if len(result) != targetSize:
+        raise ValueError('Delta target size mismatch')
+
+    return bytes(result)
+
+class PackFile():
+    """
+    PackFile():
+    description: A memory-mapped pack file and its .idx (version 1 or 2)
+    """
+
+    def __init__(self, idxPath):
+        """
+        __init__(idxPath): String -> NoneType
+        """
+        self.idxPath = idxPath
+        self.packPath = idxPath[:-4] + '.pack'
+
+        with open(idxPath, 'rb') as idxFile:
+            self.idx = mmap.mmap(idxFile.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.packPath, 'rb') as packFile:
+            self.pack = mmap.mmap(packFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.idx[0:4] == b'\xfftOc':
+            if struct.unpack('>I', self.idx[4:8])[0] != 2:
+                raise ValueError('Unsupported pack index version: ' + idxPath)
+            self.version = 2
+            self.fanoutStart = 8
+        else:
+            self.version = 1
+            self.fanoutStart = 0
+
+        self.count = struct.unpack('>I', self.idx[self.fanoutStart + 255 * 4:self.fanoutStart + 256 * 4])[0]
+        self.tableStart = self.fanoutStart + 256 * 4
+
+    def _fanout(self, byte):
+        """
+        number of objects whose first hash byte is <= byte
+        """
+        if byte < 0:
+            return 0
+        start = self.fanoutStart + byte * 4
+        return struct.unpack('>I', self.idx[start:start + 4])[0]
+
+    def _sha(self, index):
+        if self.version == 2:
+            start = self.tableStart + index * 20
+        else:
+            start = self.tableStart + index * 24 + 4
+        return self.idx[start:start + 20]
+
+    def _offset(self, index):
+        if self.version == 1:
+            start = self.tableStart + index * 24
+            return struct.unpack('>I', self.idx[start:start + 4])[0]
+
+        start = self.tableStart + self.count * 24 + index * 4
+        offset = struct.unpack('>I', self.idx[start:start + 4])[0]
+
+        # large offsets are stored in a separate table of 8 byte offsets
+        if offset & 0x80000000:
+            start = self.tableStart + self.count * 28 + (offset & 0x7fffffff) * 8
+            offset = struct.unpack('>Q', self.idx[start:start + 8])[0]
+        return offset
+
+    def findOffset(self, sha):
+        """
+        findOffset(sha): Bytes -> Integer
+        description: Binary searches the index for a binary sha, returns the
+            offset of the object in the pack or None
+        """
+        low = self._fanout(sha[0] - 1)
+        high = self._fanout(sha[0])
+
+        while low < high:
+            middle = (low + high) // 2
+            current = self._sha(middle)
+            if current < sha:
+                low = middle + 1
+            elif current > sha:
+                high = middle
+            else:
+                return self._offset(middle)
+
+        return None
+
+    def _inflate(self, pos):
+        """
+        inflates the zlib stream starting at pos in the pack
+        """
+        decompressor = zlib.decompressobj()
+        chunks = []
+        chunkSize = 8192
+        while not decompressor.eof:
+            chunk = self.pack[pos:pos + chunkSize]
+            if not chunk:
+                raise ValueError('Truncated pack: ' + self.packPath)
+            chunks.append(decompressor.decompress(chunk))
+            pos += chunkSize
+            chunkSize = min(chunkSize * 2, 1 << 20)
+        return b''.join(chunks)
+
+    def readEntry(self, offset):
+        """
+        readEntry(offset): Integer -> (Integer, Bytes, Object)
+        description: Reads the pack entry at offset. Returns its type, its
+            inflated data and, for deltas, the base (an offset for offset
+            deltas, a binary sha for reference deltas).
+        """
+        pos = offset
+        byte = self.pack[pos]
+        pos += 1
+        objType = (byte >> 4) & 7
+        shift = 4
+        while byte & 0x80:
+            byte = self.pack[pos]
+            pos += 1
+            shift += 7
+
+        base = None
+        if objType == OBJ_OFS_DELTA:
+            byte = self.pack[pos]
+            pos += 1
+            baseDistance = byte & 0x7f
+            while byte & 0x80:
+                byte = self.pack[pos]
+                pos += 1
+                baseDistance = ((baseDistance + 1) << 7) | (byte & 0x7f)
+            base = offset - baseDistance
+        elif objType == OBJ_REF_DELTA:
+            base = self.pack[pos:pos + 20]
+            pos += 20
+
+        return objType, self._inflate(pos), base
+
+    def close(self):
+        self.idx.close()
+        self.pack.close()
+
+class ObjectStore():
+    """
+    ObjectStore():
+    description: Read only access to the object database and refs of a git
+        repository (a working tree clone or a bare repository)
+    """
+
+    CACHE_SIZE = 2048               # number of inflated objects kept in memory
+
+    def __init__(self, path):
+        """
+        __init__(path): String -> NoneType
+        arguments: path String: the repository (working tree or bare)
+        """
+        self.gitDir = self._findGitDir(path)
+        self.packs = []
+        self.objectDirs = []
+        self.cache = collections.OrderedDict()
+        self._addObjectDir(os.path.join(self.gitDir, 'objects'))
+
+    def _findGitDir(self, path):
+        dotGit = os.path.join(path, '.git')
+        if os.path.isdir(dotGit):
+            return dotGit
+
+        # a .git file points to the real directory (i.e., submodules, worktrees)
+        if os.path.isfile(dotGit):
+            with open(dotGit) as gitFile:
+                line = gitFile.read().strip()
+            if line.startswith('gitdir:'):
+                return os.path.normpath(os.path.join(path, line[len('gitdir:'):].strip()))
+
+        return path
+
+    def _addObjectDir(self, objectDir):
+        if objectDir in self.objectDirs or not os.path.isdir(objectDir):
+            return
+        self.objectDirs.append(objectDir)
+
+        packDir = os.path.join(objectDir, 'pack')
+        if os.path.isdir(packDir):
+            for name in sorted(os.listdir(packDir)):
+                if name.endswith('.idx') and os.path.isfile(os.path.join(packDir, name[:-4] + '.pack')):
+                    self.packs.append(PackFile(os.path.join(packDir, name)))
+
+        # objects borrowed from other repositories
+        alternates = os.path.join(objectDir, 'info', 'alternates')
+        if os.path.isfile(alternates):
+            with open(alternates) as alternatesFile:
+                for line in alternatesFile.read().splitlines():
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        self._addObjectDir(os.path.normpath(os.path.join(objectDir, line)))
+
+    def close(self):
+        for pack in self.packs:
+            pack.close()
+        self.packs = []
+        self.cache.clear()
+
+    def _cached(self, key, value=None):
+        """
+        LRU cache of inflated objects, keyed by binary sha or (pack, offset)
+        """
+        if value is None:
+            value = self.cache.get(key)
+            if value is not None:
+                self.cache.move_to_end(key)
+            return value
+
+        self.cache[key] = value
+        if len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return value
+
+    def _readPacked(self, pack, offset):
+        """
+        resolves the (possibly deltified) object at offset of the pack
+        """
+        key = (id(pack), offset)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        # walk down the delta chain iteratively; chains can be very deep
+        chain = []
+        while True:
+            objType, data, base = pack.readEntry(offset)
+            if objType == OBJ_OFS_DELTA:
+                chain.append(data)
+                offset = base
+            elif objType == OBJ_REF_DELTA:
+                chain.append(data)
+                objType, data = self.read(base)
+                break
+            else:
+                break
+
+            cachedBase = self._cached((id(pack), offset))
+            if cachedBase is not None:
+                objType, data = cachedBase
+                break
+
+        for delta in reversed(chain):
+            data = applyDelta(data, delta)
+
+        return self._cached(key, (objType, data))
+
+    def read(self, sha):
+        """
+        read(sha): Bytes -> (Integer, Bytes)
+        description: Returns the type and data of the object with the given
+            binary sha. Raises ObjectNotFound if it is missing.
+        """
+        cached = self._cached(sha)
+        if cached is not None:
+            return cached
+
+        for pack in self.packs:
+            offset = pack.findOffset(sha)
+            if offset is not None:
+                return self._cached(sha, self._readPacked(pack, offset))
+
+        hexSha = sha.hex()
+        for objectDir in self.objectDirs:
+            loosePath = os.path.join(objectDir, hexSha[:2], hexSha[2:])
+            if os.path.isfile(loosePath):
+                with open(loosePath, 'rb') as looseFile:
+                    raw = zlib.decompress(looseFile.read())
+                header, separator, data = raw.partition(b'\0')
+                typeName = header.split(b' ')[0].decode()
+                objType = [t for t, name in TYPE_NAMES.items() if name == typeName][0]
+                return self._cached(sha, (objType, data))
+
+        raise ObjectNotFound(hexSha)
+
+    def readType(self, sha, expectedType):
+        """
+        readType(sha, expectedType): Bytes, Integer -> Bytes
+        description: Returns the data of an object, peeling annotated tags
+        """
+        objType, data = self.read(sha)
+        while objType == OBJ_TAG and expectedType != OBJ_TAG:
+            sha = bytes.fromhex(data[7:47].decode())
+            objType, data = self.read(sha)
+        if objType != expectedType:
+            raise ValueError('Object ' + sha.hex() + ' is not a ' + TYPE_NAMES[expectedType])
+        return data
+
+    def resolveRef(self, ref='HEAD'):
+        """
+        resolveRef(ref): String -> Bytes
+        description: Follows symbolic refs and packed-refs to a binary sha
+        """
+        for depth in range(10):
+            refPath = os.path.join(self.gitDir, ref)
+            if os.path.isfile(refPath):
+                with open(refPath) as refFile:
+                    value = refFile.read().strip()
+                if value.startswith('ref:'):
+                    ref = value[4:].strip()
+                    continue
+                return bytes.fromhex(value)
+
+            packedRefs = os.path.join(self.gitDir, 'packed-refs')
+            if os.path.isfile(packedRefs):
+                with open(packedRefs) as packedFile:
+                    for line in packedFile:
+                        parts = line.split()
+                        if len(parts) == 2 and parts[1] == ref and not line.startswith('#'):
+                            return bytes.fromhex(parts[0])
+            break
+
+        raise ObjectNotFound(ref)
+
+def parseCommit(data):
+    """
+    parseCommit(data): Bytes -> Dictionary
+    description: Parses a raw commit object into its tree, parents, author and
+        committer lines and message
+    """
+    headers, separator, message = data.partition(b'\n\n')
+    commit = {'tree': None, 'parents': [], 'author': b'', 'committer': b'',
+              'encoding': None, 'message': message}
+
+    for line in headers.split(b'\n'):
+        # continuation lines (i.e., gpgsig) start with a space
+        if line.startswith(b' '):
+            continue
+        key, separator, value = line.partition(b' ')
+        if key == b'tree':
+            commit['tree'] = bytes.fromhex(value.decode())
+        elif key == b'parent':
+            commit['parents'].append(bytes.fromhex(value.decode()))
+        elif key == b'author':
+            commit['author'] = value
+        elif key == b'committer':
+            commit['committer'] = value
+        elif key == b'encoding':
+            commit['encoding'] = value.decode()
+
+    return commit
+
+def parseIdent(ident):
+    """
+    parseIdent(ident): Bytes -> (Bytes, Bytes, Integer, Bytes)
+    description: Splits "Name <email> timestamp +zone" into its parts
+    """
+    name, separator, rest = ident.partition(b'<')
+    email, separator, rest = rest.partition(b'>')
+    parts = rest.split()
+    timestamp = int(parts[0]) if len(parts) > 0 else 0
+    zone = parts[1] if len(parts) > 1 else b'+0000'
+    return name.strip(), email.strip(), timestamp, zone
+
+def parseTree(data):
+    """
+    parseTree(data): Bytes -> List
+    description: Parses a raw tree object into (mode, name, binary sha) entries,
+        in the order git stores them
+    """
+    entries = []
+    pos = 0
+    dataLen = len(data)
+    while pos < dataLen:
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        mode = int(data[pos:space], 8)
+        entries.append((mode, data[space + 1:nul], data[nul + 1:nul + 21]))
+        pos = nul + 21
+    return entries
@@ -0,0 +1,193 @@
+"""
+file: reclassifier.py
+description: Re-classifies the commits already stored in the commits table,
+             e.g. after the associated words in classifier/Categories changed
+"""
+from orm.commit import *
+from orm.repository import *
+from classifier.classifier import *
+from caslogging import logging
+import os
+import time
+import uuid
+
+BATCH_SIZE = 10000      # number of commits read and updated at a time
+PENDING_DIRECTORY = os.path.dirname(__file__) + "/CASRepos/reclassified/"  # repos still to requeue
+IDLE_STATUSES = ("Analyzed", "Waiting to be Analyzed")  # no worker is using the bug links
+
+def reclassify(repo_id=None):
+    """
+    reclassify(repo_id): String -> Integer
+    description: Streams the commits of one repository, or of all of them,
+        with a server-side cursor and updates the classification and fix
+        columns of the commits whose category changed in bulk, one batch at a
+        time, so memory use does not grow with the size of the table.
+        Repositories whose set of fixes changed are queued to be analyzed
+        again, as soon as no worker is busy with them; nothing else is
+        touched.
+    arguments: repo_id String: the repository to reclassify, or None for all
+    returns: Integer - the number of commits whose classification changed
+    """
+    classifier = reloadClassifier()
+    table = Commit.__table__
+
+    readSession = Session()
+    writeConnection = engine.connect()
+
+    numRead = 0
+    numChanged = 0
+    lostFixes = set()       # repositories in which commits are no longer fixes
+    gainedFixes = set()     # repositories with commits that became fixes
+    startTime = time.time()
+
+    try:
+        commits = (readSession.query(Commit.commit_hash, Commit.repository_id,
+                                     Commit.commit_message, Commit.classification, Commit.fix)
+                    .filter(Commit.classification != "Merge"))   # merges are detected from their parents
+        if repo_id is not None:
+            commits = commits.filter(Commit.repository_id == repo_id)
+        commits = commits.execution_options(stream_results=True).yield_per(BATCH_SIZE)
+
+        batch = []
+        for commit_hash, commit_repo_id, message, classification, fix in commits:
+            numRead += 1
+            newClassification = classifier.categorize(message or "")
+            newFix = str(newClassification == "Corrective")
+
+            if newClassification != classification or newFix != fix:
+                batch.append({'commit_hash': commit_hash,
+                              'classification': newClassification,
+                              'fix': newFix})
+
+                if newFix != fix:
+                    if newFix == "True":
+                        gainedFixes.add(commit_repo_id)
+                    else:
+                        lostFixes.add(commit_repo_id)
+
+            if len(batch) == BATCH_SIZE:
+                numChanged += _writeBatch(writeConnection, table, batch)
+                batch = []
+
+            if numRead % (BATCH_SIZE * 10) == 0:
+                logging.info('Reclassified ' + str(numRead) + ' commits, ' +
+                             str(numChanged) + ' changed')
+
+        numChanged += _writeBatch(writeConnection, table, batch)
+
+    finally:
+        readSession.close()
+        writeConnection.close()
+
+    _recordPending(gainedFixes | lostFixes, lostFixes)
+    applyPendingReclassifications()
+
+    logging.info('Done reclassifying ' + str(numRead) + ' commits in ' +
+                 str(round(time.time() - startTime, 2)) + 's, ' +
+                 str(numChanged) + ' changed')
+    return numChanged
+
+def _writeBatch(connection, table, batch):
+    """
+    _writeBatch(connection, table, batch): Connection, Table, List -> Integer
+    description: Writes the new classifications of a batch in its own
+        transaction
+    returns: Integer - the number of commits updated
+    """
+    if len(batch) == 0:
+        return 0
+
+    transaction = connection.begin()
+    try:
+        updated = bulkUpdate(connection, table, 'commit_hash', batch)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+
+    return updated
+
+def _recordPending(repo_ids, relink_ids):
+    """
+    _recordPending(repo_ids, relink_ids): Set, Set -> NoneType
+    description: Records that the repositories whose fixes changed have to be
+        analyzed again, and which of them have to be relinked from scratch.
+        Every record is a file of its own, so records made while the manager
+        applies older ones are never lost.
+    """
+    os.makedirs(PENDING_DIRECTORY, exist_ok=True)
+
+    for repo_id in repo_ids:
+        kind = "relink" if repo_id in relink_ids else "requeue"
+        name = repo_id + "." + kind + "." + uuid.uuid4().hex
+        with open(PENDING_DIRECTORY + name + ".tmp", "w"):
+            pass
+        os.replace(PENDING_DIRECTORY + name + ".tmp", PENDING_DIRECTORY + name)
+
+def applyPendingReclassifications():
+    """
+    applyPendingReclassifications(): -> Integer
+    description: Queues the repositories recorded by reclassify to be
+        analyzed again, once they are idle. Commits that are no longer fixes
+        may have marked other commits as buggy, so the links of those
+        repositories are reset and all of their fixes are linked again;
+        otherwise only the new fixes, which are not linked yet, are.
+        Repositories that are being analyzed or modeled keep their record
+        until they are done, so their links are never reset under a running
+        analysis and their model is never built without them. Called by
+        reclassify and periodically by the CAS manager.
+    returns: Integer - the number of repositories queued
+    """
+    if not os.path.isdir(PENDING_DIRECTORY):
+        return 0
+
+    records = {}    # repo id -> names of its record files
+    relink = set()
+    for name in os.listdir(PENDING_DIRECTORY):
+        if name.endswith(".tmp"):
+            continue
+        repo_id, kind, _ = name.rsplit(".", 2)
+        records.setdefault(repo_id, []).append(name)
+        if kind == "relink":
+            relink.add(repo_id)
+
+    if len(records) == 0:
+        return 0
+
+    applied = []
+    session = Session()
+    try:
+        # the rows stay locked until the commit, so no worker can start on a
+        # repository between checking its status and resetting its links
+        repos = (session.query(Repository)
+                    .filter(Repository.id.in_(list(records)))
+                    .with_for_update()
+                    .all())
+        found = set(repo.id for repo in repos)
+
+        for repo in repos:
+            if repo.status not in IDLE_STATUSES:
+                continue
+
+            if repo.id in relink:
+                logging.info('Resetting the bug links of repo ' + repo.id)
+                (session.query(Commit)
+                    .filter(Commit.repository_id == repo.id)
+                    .update({Commit.linked: False, Commit.contains_bug: False, Commit.fixes: None},
+                            synchronize_session=False))
+
+            if repo.status == "Analyzed":
+                logging.info('Fixes of repo ' + repo.id + ' changed, queueing it to be analyzed')
+                repo.status = "Waiting to be Analyzed"
+            applied.append(repo.id)
+
+        session.commit()
+    finally:
+        session.close()
+
+    # repositories that were deleted never become idle
+    for repo_id in applied + [repo_id for repo_id in records if repo_id not in found]:
+        for name in records[repo_id]:
+            os.remove(PENDING_DIRECTORY + name)
+
+    return len(applied)
@@ -0,0 +1,568 @@
+"""
+file: treediff.py
+description: Computes the file changes of a commit (the equivalent of
+             `git log --numstat`) from the tree objects in an ObjectStore
+"""
+import os
+import stat
+from ingester.objectstore import *
+
+S_IFGITLINK = 0o160000              # submodule entries in a tree
+
+FIRST_FEW_BYTES = 8000              # git only looks this far for a NUL byte
+MAX_SCORE = 60000                   # rename similarity scores, as in diffcore.h
+MINIMUM_SCORE = 30000               # default rename threshold of 50%
+RENAME_LIMIT = 1000                 # default diff.renameLimit
+HASHBASE = 107927                   # span hash modulus, as in diffcore-delta.c
+
+def isDir(mode):
+    return stat.S_ISDIR(mode) and mode != S_IFGITLINK
+
+def isBinary(data):
+    """
+    isBinary(data): Bytes -> Boolean
+    description: git treats content with a NUL in its first 8000 bytes as binary
+    """
+    return b'\0' in data[:FIRST_FEW_BYTES]
+
+def splitLines(data):
+    """
+    splitLines(data): Bytes -> List
+    description: Splits content into lines the way xdiff records them: on
+        newlines only, keeping them, with a possibly incomplete last line
+    """
+    if not data:
+        return []
+    lines = data.split(b'\n')
+    last = lines.pop()
+    lines = [line + b'\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+# xdiff tuning constants, as in xdiff/xdiffi.h and xdiff/xprepare.c
+XDL_MAX_EQLIMIT = 1024
+XDL_SIMSCAN_WINDOW = 100
+XDL_KPDIS_RUN = 4
+XDL_MAX_COST_MIN = 256
+XDL_HEUR_MIN_COST = 256
+XDL_SNAKE_CNT = 20
+XDL_K_HEUR = 4
+XDL_LINE_MAX = 1 << 62
+
+def _bogosqrt(n):
+    i = 1
+    while n > 0:
+        i <<= 1
+        n >>= 2
+    return i
+
+def _cleanMatch(dis, i, start, end):
+    """
+    whether a line with many matches sits in a run of unmatched lines and
+    should be treated as changed (xdl_clean_mmatch)
+    """
+    if i - start > XDL_SIMSCAN_WINDOW:
+        start = i - XDL_SIMSCAN_WINDOW
+    if end - i > XDL_SIMSCAN_WINDOW:
+        end = i + XDL_SIMSCAN_WINDOW
+
+    r = 1
+    rdis0 = 0
+    rpdis0 = 1
+    while i - r >= start:
+        if dis[i - r] == 0:
+            rdis0 += 1
+        elif dis[i - r] == 2:
+            rpdis0 += 1
+        else:
+            break
+        r += 1
+    if rdis0 == 0:
+        return False
+
+    r = 1
+    rdis1 = 0
+    rpdis1 = 1
+    while i + r <= end:
+        if dis[i + r] == 0:
+            rdis1 += 1
+        elif dis[i + r] == 2:
+            rpdis1 += 1
+        else:
+            break
+        r += 1
+    if rdis1 == 0:
+        return False
+
+    rdis1 += rdis0
+    rpdis1 += rpdis0
+    return rpdis1 * XDL_KPDIS_RUN < rpdis1 + rdis1
+
+def _split(ha1, off1, lim1, ha2, off2, lim2, kvdf, kvdb, base, needMin, mxcost):
+    """
+    finds the middle snake of a box, or a good enough split once the edit
+    cost grows too large (xdl_split). Returns (i1, i2, minLow, minHigh).
+    """
+    dmin = off1 - lim2
+    dmax = lim1 - off2
+    fmid = off1 - off2
+    bmid = lim1 - lim2
+    odd = (fmid - bmid) & 1
+    fmin = fmax = fmid
+    bmin = bmax = bmid
+
+    kvdf[base + fmid] = off1
+    kvdb[base + bmid] = lim1
+
+    ec = 0
+    while True:
+        ec += 1
+        gotSnake = False
+
+        if fmin > dmin:
+            fmin -= 1
+            kvdf[base + fmin - 1] = -1
+        else:
+            fmin += 1
+        if fmax < dmax:
+            fmax += 1
+            kvdf[base + fmax + 1] = -1
+        else:
+            fmax -= 1
+
+        for d in range(fmax, fmin - 1, -2):
+            if kvdf[base + d - 1] >= kvdf[base + d + 1]:
+                i1 = kvdf[base + d - 1] + 1
+            else:
+                i1 = kvdf[base + d + 1]
+            prev1 = i1
+            i2 = i1 - d
+            while i1 < lim1 and i2 < lim2 and ha1[i1] == ha2[i2]:
+                i1 += 1
+                i2 += 1
+            if i1 - prev1 > XDL_SNAKE_CNT:
+                gotSnake = True
+            kvdf[base + d] = i1
+            if odd and bmin <= d <= bmax and kvdb[base + d] <= i1:
+                return i1, i2, True, True
+
+        if bmin > dmin:
+            bmin -= 1
+            kvdb[base + bmin - 1] = XDL_LINE_MAX
+        else:
+            bmin += 1
+        if bmax < dmax:
+            bmax += 1
+            kvdb[base + bmax + 1] = XDL_LINE_MAX
+        else:
+            bmax -= 1
+
+        for d in range(bmax, bmin - 1, -2):
+            if kvdb[base + d - 1] < kvdb[base + d + 1]:
+                i1 = kvdb[base + d - 1]
+            else:
+                i1 = kvdb[base + d + 1] - 1
+            prev1 = i1
+            i2 = i1 - d
+            while i1 > off1 and i2 > off2 and ha1[i1 - 1] == ha2[i2 - 1]:
+                i1 -= 1
+                i2 -= 1
+            if prev1 - i1 > XDL_SNAKE_CNT:
+                gotSnake = True
+            kvdb[base + d] = i1
+            if not odd and fmin <= d <= fmax and i1 <= kvdf[base + d]:
+                return i1, i2, True, True
+
+        if needMin:
+            continue
+
+        # past the heuristic trigger, take a diagonal that reached far with a long snake
+        if gotSnake and ec > XDL_HEUR_MIN_COST:
+            best = 0
+            for d in range(fmax, fmin - 1, -2):
+                dd = d - fmid if d > fmid else fmid - d
+                i1 = kvdf[base + d]
+                i2 = i1 - d
+                v = (i1 - off1) + (i2 - off2) - dd
+                if v > XDL_K_HEUR * ec and v > best and \
+                        off1 + XDL_SNAKE_CNT <= i1 < lim1 and off2 + XDL_SNAKE_CNT <= i2 < lim2:
+                    k = 1
+                    while ha1[i1 - k] == ha2[i2 - k]:
+                        if k == XDL_SNAKE_CNT:
+                            best = v
+                            split = (i1, i2)
+                            break
+                        k += 1
+            if best > 0:
+                return split[0], split[1], True, False
+
+            best = 0
+            for d in range(bmax, bmin - 1, -2):
+                dd = d - bmid if d > bmid else bmid - d
+                i1 = kvdb[base + d]
+                i2 = i1 - d
+                v = (lim1 - i1) + (lim2 - i2) - dd
+                if v > XDL_K_HEUR * ec and v > best and \
+                        off1 < i1 <= lim1 - XDL_SNAKE_CNT and off2 < i2 <= lim2 - XDL_SNAKE_CNT:
+                    k = 0
+                    while ha1[i1 + k] == ha2[i2 + k]:
+                        if k == XDL_SNAKE_CNT - 1:
+                            best = v
+                            split = (i1, i2)
+                            break
+                        k += 1
+            if best > 0:
+                return split[0], split[1], False, True
+
+        # enough is enough, take the furthest reaching path
+        if ec >= mxcost:
+            fbest = fbest1 = -1
+            for d in range(fmax, fmin - 1, -2):
+                i1 = min(kvdf[base + d], lim1)
+                i2 = i1 - d
+                if lim2 < i2:
+                    i1 = lim2 + d
+                    i2 = lim2
+                if fbest < i1 + i2:
+                    fbest = i1 + i2
+                    fbest1 = i1
+
+            bbest = bbest1 = XDL_LINE_MAX
+            for d in range(bmax, bmin - 1, -2):
+                i1 = max(off1, kvdb[base + d])
+                i2 = i1 - d
+                if i2 < off2:
+                    i1 = off2 + d
+                    i2 = off2
+                if i1 + i2 < bbest:
+                    bbest = i1 + i2
+                    bbest1 = i1
+
+            if (lim1 + lim2) - bbest < fbest - (off1 + off2):
+                return fbest1, fbest - fbest1, True, False
+            return bbest1, bbest - bbest1, False, True
+
+def countChanges(oldLines, newLines):
+    """
+    countChanges(oldLines, newLines): List, List -> (Integer, Integer)
+    description: Returns the (added, deleted) line counts --numstat shows.
+        This follows git's default (myers) xdiff exactly rather than computing
+        a minimal diff: lines that match too often are treated as changed when
+        they sit among unmatched lines, and expensive boxes are split early.
+    """
+    # classify equal lines
+    ids = {}
+    ha1 = [ids.setdefault(line, len(ids)) for line in oldLines]
+    ha2 = [ids.setdefault(line, len(ids)) for line in newLines]
+    nrec1 = len(ha1)
+    nrec2 = len(ha2)
+
+    count1 = [0] * len(ids)
+    count2 = [0] * len(ids)
+    for h in ha1:
+        count1[h] += 1
+    for h in ha2:
+        count2[h] += 1
+
+    # the common prefix and suffix never change (xdl_trim_ends)
+    start = 0
+    limit = min(nrec1, nrec2)
+    while start < limit and ha1[start] == ha2[start]:
+        start += 1
+    suffix = 0
+    limit -= start
+    while suffix < limit and ha1[nrec1 - 1 - suffix] == ha2[nrec2 - 1 - suffix]:
+        suffix += 1
+    end1 = nrec1 - suffix - 1
+    end2 = nrec2 - suffix - 1
+
+    # discard lines without a match, and lines with many matches among them (xdl_cleanup_records)
+    mlim = min(_bogosqrt(nrec1), XDL_MAX_EQLIMIT)
+    dis1 = [0] * (nrec1 + 1)
+    for i in range(start, end1 + 1):
+        nm = count2[ha1[i]]
+        dis1[i] = 0 if nm == 0 else (2 if nm >= mlim else 1)
+
+    mlim = min(_bogosqrt(nrec2), XDL_MAX_EQLIMIT)
+    dis2 = [0] * (nrec2 + 1)
+    for i in range(start, end2 + 1):
+        nm = count1[ha2[i]]
+        dis2[i] = 0 if nm == 0 else (2 if nm >= mlim else 1)
+
+    deleted = 0
+    ref1 = []
+    for i in range(start, end1 + 1):
+        if dis1[i] == 1 or (dis1[i] == 2 and not _cleanMatch(dis1, i, start, end1)):
+            ref1.append(ha1[i])
+        else:
+            deleted += 1
+
+    added = 0
+    ref2 = []
+    for i in range(start, end2 + 1):
+        if dis2[i] == 1 or (dis2[i] == 2 and not _cleanMatch(dis2, i, start, end2)):
+            ref2.append(ha2[i])
+        else:
+            added += 1
+
+    # divide and conquer on the remaining lines (xdl_recs_cmp), iteratively
+    nreff1 = len(ref1)
+    nreff2 = len(ref2)
+    ndiags = nreff1 + nreff2 + 3
+    kvdf = [0] * (ndiags + 1)
+    kvdb = [0] * (ndiags + 1)
+    base = nreff2 + 1
+    mxcost = max(_bogosqrt(ndiags), XDL_MAX_COST_MIN)
+
+    boxes = [(0, nreff1, 0, nreff2, False)]
+    while boxes:
+        off1, lim1, off2, lim2, needMin = boxes.pop()
+
+        while off1 < lim1 and off2 < lim2 and ref1[off1] == ref2[off2]:
+            off1 += 1
+            off2 += 1
+        while off1 < lim1 and off2 < lim2 and ref1[lim1 - 1] == ref2[lim2 - 1]:
+            lim1 -= 1
+            lim2 -= 1
+
+        if off1 == lim1:
+            added += lim2 - off2
+        elif off2 == lim2:
+            deleted += lim1 - off1
+        else:
+            i1, i2, minLow, minHigh = _split(ref1, off1, lim1, ref2, off2, lim2,
+                                             kvdf, kvdb, base, needMin, mxcost)
+            boxes.append((i1, lim1, i2, lim2, minHigh))
+            boxes.append((off1, i1, off2, i2, minLow))
+
+    return added, deleted
+
+def _spanHashes(data):
+    """
+    counts of bytes per span hash of the content, as in diffcore-delta.c
+    """
+    counts = {}
+    isText = not isBinary(data)
+    accum1 = 0
+    accum2 = 0
+    n = 0
+    size = len(data)
+    i = 0
+    while i < size:
+        c = data[i]
+        i += 1
+
+        # Ignore CR in CRLF sequence if text
+        if isText and c == 13 and i < size and data[i] == 10:
+            continue
+
+        old1 = accum1
+        accum1 = ((accum1 << 7) ^ (accum2 >> 25)) & 0xffffffff
+        accum2 = ((accum2 << 7) ^ (old1 >> 25)) & 0xffffffff
+        accum1 = (accum1 + c) & 0xffffffff
+        n += 1
+        if n < 64 and c != 10:
+            continue
+        hashValue = ((accum1 + accum2 * 0x61) & 0xffffffff) % HASHBASE
+        counts[hashValue] = counts.get(hashValue, 0) + n
+        n = 0
+        accum1 = 0
+        accum2 = 0
+
+    if n > 0:
+        hashValue = ((accum1 + accum2 * 0x61) & 0xffffffff) % HASHBASE
+        counts[hashValue] = counts.get(hashValue, 0) + n
+
+    return counts
+
+def similarity(srcData, dstData, srcHashes, dstHashes):
+    """
+    similarity(...): Bytes, Bytes, Dictionary, Dictionary -> Integer
+    description: Estimates how similar two blobs are, scaled to MAX_SCORE, the
+        way git's estimate_similarity does
+    """
+    maxSize = max(len(srcData), len(dstData))
+    baseSize = min(len(srcData), len(dstData))
+
+    # too different in size to ever reach the threshold
+    if baseSize * (MAX_SCORE - MINIMUM_SCORE) < (maxSize - baseSize) * MAX_SCORE:
+        return 0
+    if len(dstData) == 0:
+        return 0
+
+    copied = 0
+    for hashValue, count in srcHashes.items():
+        dstCount = dstHashes.get(hashValue, 0)
+        copied += count if count < dstCount else dstCount
+
+    return int(copied * MAX_SCORE / maxSize)
+
+class TreeDiff():
+    """
+    TreeDiff():
+    description: Diffs the trees of commits in an ObjectStore and produces the
+        same (lines added, lines deleted, file name) tuples as --numstat,
+        including git's default rename detection.
+    """
+
+    def __init__(self, store):
+        """
+        __init__(store): ObjectStore -> NoneType
+        """
+        self.store = store
+
+    def _entries(self, treeSha):
+        if treeSha is None:
+            return []
+        return parseTree(self.store.readType(treeSha, OBJ_TREE))
+
+    def changes(self, oldTree, newTree, prefix=b''):
+        """
+        changes(oldTree, newTree): Bytes, Bytes -> List
+        description: Returns (path, old mode, old sha, new mode, new sha) for
+            every file that differs between two trees, in git's path order.
+            A missing side has a mode of 0 and a sha of None.
+        """
+        result = []
+        if oldTree == newTree:
+            return result
+
+        # git orders entries as if directory names ended with a '/'
+        old = [(name + b'/' if isDir(mode) else name, mode, name, sha) for mode, name, sha in self._entries(oldTree)]
+        new = [(name + b'/' if isDir(mode) else name, mode, name, sha) for mode, name, sha in self._entries(newTree)]
+        oldIndex = 0
+        newIndex = 0
+
+        while oldIndex < len(old) or newIndex < len(new):
+            if newIndex >= len(new) or (oldIndex < len(old) and old[oldIndex][0] < new[newIndex][0]):
+                key, mode, name, sha = old[oldIndex]
+                oldIndex += 1
+                if isDir(mode):
+                    result.extend(self.changes(sha, None, prefix + name + b'/'))
+                else:
+                    result.append((prefix + name, mode, sha, 0, None))
+
+            elif oldIndex >= len(old) or new[newIndex][0] < old[oldIndex][0]:
+                key, mode, name, sha = new[newIndex]
+                newIndex += 1
+                if isDir(mode):
+                    result.extend(self.changes(None, sha, prefix + name + b'/'))
+                else:
+                    result.append((prefix + name, 0, None, mode, sha))
+
+            else:
+                key, oldMode, name, oldSha = old[oldIndex]
+                key, newMode, name, newSha = new[newIndex]
+                oldIndex += 1
+                newIndex += 1
+                if oldSha == newSha and oldMode == newMode:
+                    continue
+                if isDir(oldMode):
+                    result.extend(self.changes(oldSha, newSha, prefix + name + b'/'))
+                else:
+                    result.append((prefix + name, oldMode, oldSha, newMode, newSha))
+
+        return result
+
+    def _content(self, mode, sha):
+        if sha is None:
+            return b''
+        if mode == S_IFGITLINK:
+            return b'Subproject commit ' + sha.hex().encode() + b'\n'
+        return self.store.readType(sha, OBJ_BLOB)
+
+    def _detectRenames(self, changes):
+        """
+        pairs deleted files with added files: first identical blobs, then
+        blobs that are at least 50% similar. Returns dst index -> src index.
+        """
+        sources = [i for i, change in enumerate(changes) if change[4] is None]
+        dests = [i for i, change in enumerate(changes) if change[2] is None]
+        renames = {}
+        if not sources or not dests:
+            return renames
+
+        # exact renames, preferring a source with the same file name
+        bySha = {}
+        for i in sources:
+            bySha.setdefault(changes[i][2], []).append(i)
+        used = set()
+        for j in dests:
+            candidates = [i for i in bySha.get(changes[j][4], []) if i not in used]
+            if not candidates:
+                continue
+            sameName = [i for i in candidates if os.path.basename(changes[i][0]) == os.path.basename(changes[j][0])]
+            source = (sameName or candidates)[0]
+            used.add(source)
+            renames[j] = source
+
+        sources = [i for i in sources if i not in used and stat.S_ISREG(changes[i][1])]
+        dests = [j for j in dests if j not in renames and stat.S_ISREG(changes[j][3])]
+        if not sources or not dests or len(sources) * len(dests) > RENAME_LIMIT * RENAME_LIMIT:
+            return renames
+
+        contents = {}
+        hashes = {}
+        for i in sources:
+            contents[i] = self._content(changes[i][1], changes[i][2])
+        for j in dests:
+            contents[j] = self._content(changes[j][3], changes[j][4])
+
+        candidates = []
+        for j in dests:
+            for i in sources:
+                maxSize = max(len(contents[i]), len(contents[j]))
+                baseSize = min(len(contents[i]), len(contents[j]))
+                if baseSize * (MAX_SCORE - MINIMUM_SCORE) < (maxSize - baseSize) * MAX_SCORE:
+                    continue
+                if i not in hashes:
+                    hashes[i] = _spanHashes(contents[i])
+                if j not in hashes:
+                    hashes[j] = _spanHashes(contents[j])
+                score = similarity(contents[i], contents[j], hashes[i], hashes[j])
+                if score >= MINIMUM_SCORE:
+                    nameScore = os.path.basename(changes[i][0]) == os.path.basename(changes[j][0])
+                    candidates.append((-score, -nameScore, j, i))
+
+        # best scores first, each file takes part in at most one rename
+        for negScore, negNameScore, j, i in sorted(candidates):
+            if j in renames or i in used:
+                continue
+            used.add(i)
+            renames[j] = i
+
+        return renames
+
+    def numstat(self, oldTree, newTree):
+        """
+        numstat(oldTree, newTree): Bytes, Bytes -> List
+        description: Returns the (lines added, lines deleted, file name)
+            tuples --numstat would show for a commit. Binary files have "-"
+            for both counts, and renamed files are listed under their new name.
+        """
+        changes = self.changes(oldTree, newTree)
+        renames = self._detectRenames(changes)
+        renamedSources = set(renames.values())
+        stats = []
+
+        for index, (path, oldMode, oldSha, newMode, newSha) in enumerate(changes):
+            if index in renamedSources:
+                continue
+            if index in renames:
+                source = changes[renames[index]]
+                oldMode, oldSha = source[1], source[2]
+
+            oldData = self._content(oldMode, oldSha)
+            newData = self._content(newMode, newSha)
+            fileName = path.decode('utf-8', 'replace')
+
+            if isBinary(oldData) or isBinary(newData):
+                stats.append(('-', '-', fileName))
+            elif oldSha == newSha:
+                stats.append(('0', '0', fileName))
+            else:
+                added, deleted = countChanges(splitLines(oldData), splitLines(newData))
+                stats.append((str(added), str(deleted), fileName))
+
+        return stats
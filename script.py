@@ -9,6 +9,7 @@ from analyzer.analyzer import *
 from orm.feedback import * # so that we create the table - used by web
 from orm.user import * # so that we create the table - used by web
 from orm.glmcoefficients import * # so that we create the table - used by web
+from ingester.reclassifier import *
 
 if len(sys.argv) > 1:
 	arg = sys.argv[1]
@@ -21,6 +22,13 @@ if arg == "initDb":
     Base.metadata.create_all(engine)
     logging.info('Done')
 
+elif arg == "reclassify":
+	# Re-classify stored commits, e.g. after editing classifier/Categories
+	if len(sys.argv) > 2:
+		reclassify(sys.argv[2])
+	else:
+		reclassify()
+
 else:
 	logging.info("Starting CAS Manager")
 	cas_manager = CAS_Manager()
@@ -0,0 +1,76 @@
+"""
+Tests reading the streamed `git log -z --numstat` output with Git.readLog, on a
+fixed log as written by git for the LOG_FORMAT.
+"""
+import io
+from ingester.git import *
+from caslogging import logging
+
+ROOT = '5b30c51309ad52ba138e78f24ac0a730e89ebdda'
+SECOND = '2d381ad2d410e37554266b2a5fa0434544e42269'
+SIDE = 'be493c56e2ae88fc50c6380d97aacef2f1dd05dd'
+MERGE = 'eb3a9b3eb4cceac058f3464b49f8b81c864b36ff'
+
+def record(parents, commit_hash, message, date, timestamp):
+    return ('\x1eCAS_READER_COMMIT\0' + parents + '\0' + commit_hash + '\0A U Thor\0author@example.com\0' +
+            date + '\0' + timestamp + '\0' + message + '\0').encode('utf-8')
+
+# a root commit, a commit with a multi line message, a binary file, a non-ASCII path and a
+# path with spaces, a commit without files, a rename and a merge. numstat entries start on a
+# new line after the format and end with an empty record; a rename has an empty path followed
+# by the old and the new path.
+LOG = (record('', ROOT, 'one', 'Tue May 13 16:53:20 2014 +0000', '1400000000') +
+       b'\n5\t0\tf.py\0\0' +
+       record(ROOT, SECOND, 'two\nwith a body\n', 'Tue May 13 17:53:20 2014 +0000', '1400003600') +
+       b'\n-\t-\tb.bin\x002\t0\tgone.py\x001\t0\tn\xc3\xa9.py\x0010\t0\told.py\x001\t0\tspaced name.py\0\0' +
+       record(SECOND, SIDE, 'empty', 'Tue May 13 18:53:20 2014 +0000', '1400007200') + b'\0' +
+       record(SECOND, SIDE[::-1], 'renames', 'Tue May 13 19:53:20 2014 +0000', '1400010800') +
+       b'\n1\t1\t\0old.py\0new.py\x000\t2\tgone.py\0\0' +
+       record(SIDE + ' ' + SIDE[::-1], MERGE, 'merge', 'Tue May 13 20:53:20 2014 +0000', '1400014400'))
+
+EXPECTED = [
+    ({'parent_hashes': '', 'commit_hash': ROOT, 'author_name': 'A U Thor', 'author_email': 'author@example.com',
+      'author_date': 'Tue May 13 16:53:20 2014 +0000', 'author_date_unix_timestamp': '1400000000',
+      'commit_message': 'one'},
+     [('5', '0', 'f.py')]),
+    ({'parent_hashes': ROOT, 'commit_hash': SECOND, 'author_name': 'A U Thor', 'author_email': 'author@example.com',
+      'author_date': 'Tue May 13 17:53:20 2014 +0000', 'author_date_unix_timestamp': '1400003600',
+      'commit_message': 'two\nwith a body\n'},
+     [('-', '-', 'b.bin'), ('2', '0', 'gone.py'), ('1', '0', 'né.py'), ('10', '0', 'old.py'),
+      ('1', '0', 'spaced name.py')]),
+    ({'parent_hashes': SECOND, 'commit_hash': SIDE, 'author_name': 'A U Thor', 'author_email': 'author@example.com',
+      'author_date': 'Tue May 13 18:53:20 2014 +0000', 'author_date_unix_timestamp': '1400007200',
+      'commit_message': 'empty'},
+     []),
+    ({'parent_hashes': SECOND, 'commit_hash': SIDE[::-1], 'author_name': 'A U Thor',
+      'author_email': 'author@example.com', 'author_date': 'Tue May 13 19:53:20 2014 +0000',
+      'author_date_unix_timestamp': '1400010800', 'commit_message': 'renames'},
+     [('1', '1', 'new.py'), ('0', '2', 'gone.py')]),
+    ({'parent_hashes': SIDE + ' ' + SIDE[::-1], 'commit_hash': MERGE, 'author_name': 'A U Thor',
+      'author_email': 'author@example.com', 'author_date': 'Tue May 13 20:53:20 2014 +0000',
+      'author_date_unix_timestamp': '1400014400', 'commit_message': 'merge'},
+     []),
+]
+
+def testReadLog():
+    assert(list(Git.readLog(io.BytesIO(LOG))) == EXPECTED)
+
+def testReadLogInSmallChunks():
+    # records, including multi-byte characters, split over many reads
+    readSize = Git.LOG_READ_SIZE
+    try:
+        for size in (1, 2, 3, 7, 64):
+            Git.LOG_READ_SIZE = size
+            assert(list(Git.readLog(io.BytesIO(LOG))) == EXPECTED), size
+    finally:
+        Git.LOG_READ_SIZE = readSize
+
+def testReadEmptyLog():
+    assert(list(Git.readLog(io.BytesIO(b''))) == [])
+
+if __name__ == '__main__':
+    logging.info('Test reading git logs... ')
+    testReadLog()
+    testReadLogInSmallChunks()
+    testReadEmptyLog()
+    logging.info("Passed tests")
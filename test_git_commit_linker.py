@@ -0,0 +1,228 @@
+"""
+Tests the parsers of the git commit linker on fixed git output: the diff of a
+corrective commit (git diff-tree -p --unified=0) and the blame of its lines
+(git blame --porcelain with several -L ranges), and links the commits of a
+fixture repository.
+"""
+import os
+import subprocess
+from analyzer.git_commit_linker import *
+from test_gitobjects import FixtureRepository
+from caslogging import logging
+
+TEST_REPO_ID = 'test-git-commit-linker'
+
+ONE = '5b30c51309ad52ba138e78f24ac0a730e89ebdda'
+TWO = '2d381ad2d410e37554266b2a5fa0434544e42269'
+
+# an added file, a binary file, a mode change with a line changed at the end of a file without
+# a newline, a deleted file, a rename with an edit, a quoted non-ASCII path, a path with a space
+# (its header ends with a tab) and a mode change only, of a path with a space
+DIFF = b"""diff --git a/added.py b/added.py
+new file mode 100644
+index 0000000..3e75765
+--- /dev/null
++++ b/added.py
+@@ -0,0 +1 @@
++new
+diff --git a/b.bin b/b.bin
+index badc806..29a070e 100644
+Binary files a/b.bin and b/b.bin differ
+diff --git a/f.py b/f.py
+old mode 100644
+new mode 100755
+index 2590c0b..57ab95c
+--- a/f.py
++++ b/f.py
+@@ -5 +5 @@ D
+-e
++e
+\\ No newline at end of file
+diff --git a/gone.py b/gone.py
+deleted file mode 100644
+index b77b4eb..0000000
+--- a/gone.py
++++ /dev/null
+@@ -1,2 +0,0 @@
+-x
+-y
+diff --git a/old.py b/new.py
+similarity index 79%
+rename from old.py
+rename to new.py
+index f00c965..af6af34 100644
+--- a/old.py
++++ b/new.py
+@@ -3,2 +2,0 @@
+-3
+-4
+@@ -9 +7 @@
+-9
++nine
+diff --git "a/n\\303\\251.py" "b/n\\303\\251.py"
+index 8ba3a16..d52e798 100644
+--- "a/n\\303\\251.py"
++++ "b/n\\303\\251.py"
+@@ -1 +1 @@
+-n
++N
+diff --git a/spaced name.py b/spaced name.py
+index 2fa992c..fe5841d 100644
+--- a/spaced name.py\t
++++ b/spaced name.py\t
+@@ -1,0 +2 @@ keep
++more
+diff --git a/run me.sh b/run me.sh
+old mode 100644
+new mode 100755
+"""
+
+DIFF_REGIONS = [('added.py', []), ('b.bin', []), ('f.py', [5]), ('gone.py', [1, 2]), ('old.py', [3, 4, 9]),
+                ('né.py', [1]), ('spaced name.py', []), ('run me.sh', [])]
+
+# git blame --porcelain -L1,2 -L4,5 of a file whose lines 1 and 5 come from the root commit
+BLAME = ("""%(one)s 1 1 1
+author A
+author-mail <a@x>
+author-time 1400000000
+author-tz +0000
+committer A
+committer-mail <a@x>
+committer-time 1400000000
+committer-tz +0000
+summary one
+boundary
+filename f.py
+\ta
+%(two)s 2 2 1
+author A
+author-mail <a@x>
+author-time 1400003600
+author-tz +0000
+committer A
+committer-mail <a@x>
+committer-time 1400003600
+committer-tz +0000
+summary two
+previous %(one)s f.py
+filename f.py
+\tB
+%(two)s 4 4 1
+\tD
+%(one)s 5 5 1
+\te
+""" % {'one': ONE, 'two': TWO}).encode()
+
+def makeLinker(repo_path=None):
+    linker = GitCommitLinker(TEST_REPO_ID)
+    if repo_path is not None:
+        linker.repo_path = repo_path
+        linker.path_filter = PathFilter(repo_path)
+    return linker
+
+def removeLinker(linker):
+    linker.blame_cache.close()
+    cache = os.path.join(os.path.dirname(os.path.abspath(__file__)), BlameCache.CACHE_DIR, TEST_REPO_ID + '.sqlite')
+    for path in (cache, cache + '-wal', cache + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def testParseDiff():
+    linker = makeLinker()
+    try:
+        assert(list(linker._parseDiff(DIFF.splitlines(True))) == DIFF_REGIONS)
+        assert(list(linker._parseDiff([])) == [])
+    finally:
+        removeLinker(linker)
+
+def testPaths():
+    linker = makeLinker()
+    try:
+        assert(linker._headerPath(b'a/run me.sh b/run me.sh') == 'run me.sh')
+        assert(linker._headerPath(b'a/a b/c b/a b/c') == 'a b/c')
+        assert(linker._headerPath(b'"a/tab\\there" "b/tab\\there"') == 'tab\there')
+        assert(linker._unquotePath(b'plain.py') == 'plain.py')
+        assert(linker._unquotePath(b'"a/n\\303\\251.c"') == 'a/né.c')
+        assert(linker._unquotePath(b'"a/\\"quoted\\" \\\\ name"') == 'a/"quoted" \\ name')
+    finally:
+        removeLinker(linker)
+
+def testCommitLine():
+    match = GitCommitLinker.COMMIT_LINE.match((TWO + ' ' + ONE + '\n').encode())
+    assert(match.group(1).decode() == TWO and match.group(2).split() == [ONE.encode()])
+
+    match = GitCommitLinker.COMMIT_LINE.match((ONE + '\n').encode())
+    assert(match.group(1).decode() == ONE and match.group(2) == b'')
+
+    match = GitCommitLinker.COMMIT_LINE.match((TWO + ' ' + ONE + ' ' + ONE + '\n').encode())
+    assert(len(match.group(2).split()) == 2)
+
+    # diff lines that happen to hold a hash don't start a commit
+    assert(GitCommitLinker.COMMIT_LINE.match(('+' + ONE + '\n').encode()) is None)
+    assert(GitCommitLinker.COMMIT_LINE.match(('index ' + ONE + '\n').encode()) is None)
+
+def testLineRanges():
+    linker = makeLinker()
+    try:
+        assert(linker._lineRanges([1, 2, 3, 7, 9, 10]) == [(1, 3), (7, 7), (9, 10)])
+        assert(linker._lineRanges([4]) == [(4, 4)])
+    finally:
+        removeLinker(linker)
+
+def testBlameRanges():
+    linker = makeLinker()
+    commands = []
+
+    def checkOutput(command, **kwargs):
+        commands.append(command)
+        return BLAME
+
+    check_output = subprocess.check_output
+    subprocess.check_output = checkOutput
+    try:
+        origins = linker._blameRanges(TWO, 'f.py', [(1, 2), (4, 5)])
+    finally:
+        subprocess.check_output = check_output
+        removeLinker(linker)
+
+    assert(commands == [['git', 'blame', '--porcelain', '-L1,2', '-L4,5', TWO, '--', 'f.py']])
+    assert(origins == {(1, 2): ['^' + ONE[:39], TWO], (4, 5): [TWO, '^' + ONE[:39]]})
+
+class CorrectiveCommit:
+    def __init__(self, commit_hash):
+        self.commit_hash = commit_hash
+        self.fileschanged = None
+
+def testLinkFixture():
+    repo = FixtureRepository()
+    linker = makeLinker(repo.path)
+    try:
+        repo.write('f.py', 'a\nb\nc\nd\ne\n')
+        repo.write('README.md', 'docs\n')
+        repo.commit('add f')
+        repo.write('f.py', 'a\nB\nc\nD\ne\n')
+        repo.commit('change b and d')
+        repo.write('f.py', 'a\nB\nc\nd\ne\nf\n')
+        repo.write('README.md', 'more docs\n')
+        repo.commit('fix d')
+        repo.write('f.py', 'A\nb\nc\nd\ne\nf\n')
+        repo.commit('fix a and b')
+
+        hashes = repo.git('log', '--reverse', '--format=%H').decode().split()
+        links = linker.linkCorrectiveCommits([CorrectiveCommit(hashes[2]), CorrectiveCommit(hashes[3])])
+
+        # line d comes from the second commit; lines a and B from the first and second
+        assert(links == {hashes[1]: [hashes[2], hashes[3]], '^' + hashes[0][:39]: [hashes[3]]})
+    finally:
+        removeLinker(linker)
+        repo.remove()
+
+if __name__ == '__main__':
+    logging.info('Test linking corrective commits... ')
+    testParseDiff()
+    testPaths()
+    testCommitLine()
+    testLineRanges()
+    testBlameRanges()
+    testLinkFixture()
+    logging.info("Passed tests")
@@ -0,0 +1,256 @@
+"""
+Tests the in-process git adapter (GitObjects, reading the object database with
+ObjectStore and diffing trees with TreeDiff) against `git log --numstat` on a
+fixture repository built with the git binary. Part of the history is packed,
+with deltas, and the rest is left as loose objects.
+"""
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+from ingester.gitobjects import *
+from ingester.ingeststate import *
+from caslogging import logging
+
+FIXTURE_DATE = 1400000000   # author and committer date of the first commit
+
+# numstat of the fixture commits, as printed by git log --numstat, by subject
+EXPECTED_NUMSTAT = {
+    'initial': [('5', '0', 'a.txt'), ('-', '-', 'b.bin'), ('2', '0', 'dir/c.py'), ('0', '0', 'empty.txt'),
+                ('1', '0', 'spaced name.txt'), ('1', '0', 'ünïcode.txt')],
+    'edit': [('3', '2', 'a.txt'), ('3', '1', 'dir/c.py')],
+    'rename': [('1', '1', 'dir/renamed.py'), ('0', '0', 'empty.txt')],
+    'churn 0': [('37', '0', 'churn.txt')],
+    'churn 1': [('5', '6', 'churn.txt')],
+    'churn 2': [('7', '6', 'churn.txt')],
+    'churn 3': [('7', '10', 'churn.txt')],
+    'churn 4': [('0', '1', 'churn.txt')],
+    'churn 5': [('5', '8', 'churn.txt')],
+    'binary edit': [('-', '-', 'b.bin')],
+    'mode change': [('0', '0', 'a.txt')],
+    'crlf base': [('1', '0', 'crlf.txt')],
+    'crlf': [('2', '0', 'crlf.txt')],
+    'side': [('1', '0', 'a.txt')],
+    'churn 6': [('4', '1', 'churn.txt')],
+    'churn 7': [('6', '2', 'churn.txt')],
+    'churn 8': [('5', '5', 'churn.txt')],
+    'merge side': [],
+}
+
+class FixtureRepository:
+    """
+    A throwaway repository in a temporary directory, committed to with a fixed
+    identity, fixed dates and no user or system git configuration
+    """
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='cas-gitobjects-')
+        self.date = FIXTURE_DATE
+        self.env = dict(os.environ, HOME=self.path, GIT_CONFIG_NOSYSTEM='1',
+                        GIT_AUTHOR_NAME='Fixture Author', GIT_AUTHOR_EMAIL='author@example.com',
+                        GIT_COMMITTER_NAME='Fixture Committer', GIT_COMMITTER_EMAIL='committer@example.com')
+        self.git('init', '-q')
+        self.git('symbolic-ref', 'HEAD', 'refs/heads/master')
+
+    def git(self, *args):
+        return subprocess.check_output(('git',) + args, cwd=self.path, env=self.env)
+
+    def write(self, name, data):
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+    def tick(self):
+        # an hour later, so that the commits are ordered by date
+        self.date += 3600
+        self.env['GIT_AUTHOR_DATE'] = self.env['GIT_COMMITTER_DATE'] = str(self.date) + ' +0200'
+
+    def commit(self, subject):
+        self.tick()
+        self.git('add', '-A')
+        self.git('commit', '-q', '--allow-empty', '-m', subject)
+
+    def merge(self, subject, branch):
+        self.tick()
+        self.git('merge', '-q', '--no-ff', '-m', subject, branch)
+
+    def remove(self):
+        shutil.rmtree(self.path)
+
+def churn(rand, lines):
+    """
+    returns lines with a few lines changed, inserted and removed at random. Lines
+    are drawn from a small vocabulary so that many of them repeat.
+    """
+    lines = list(lines)
+    for edit in range(rand.randint(1, 6)):
+        position = rand.randint(0, len(lines))
+        kind = rand.random()
+        if kind < 0.4 or len(lines) < 5:
+            lines[position:position] = [rand.choice(['{', '}', 'return x', 'x += 1', '']) for line in range(rand.randint(1, 4))]
+        elif kind < 0.7:
+            del lines[position:position + rand.randint(1, 4)]
+        else:
+            lines[position:position + 1] = ['x = ' + str(rand.randint(0, 9))]
+    return lines
+
+def buildFixture():
+    repo = FixtureRepository()
+    rand = random.Random(6)
+
+    repo.write('a.txt', 'one\ntwo\nthree\nfour\nfive\n')
+    repo.write('b.bin', b'\x00\x01\x02binary\n')
+    repo.write('empty.txt', '')
+    repo.write('dir/c.py', 'def c():\n    return 1')      # no newline at the end
+    repo.write('spaced name.txt', 'spaces\n')
+    repo.write('ünïcode.txt', 'unicode\n')
+    repo.commit('initial')
+
+    repo.write('a.txt', 'one\nTWO\nthree\nFOUR\nfive\nsix\n')
+    repo.write('dir/c.py', 'def c():\n    return 1\n\nc()\n')
+    repo.commit('edit')
+
+    os.remove(os.path.join(repo.path, 'dir/c.py'))
+    os.remove(os.path.join(repo.path, 'empty.txt'))
+    repo.write('dir/renamed.py', 'def c():\n    return 2\n\nc()\n')
+    repo.commit('rename')
+
+    lines = ['line ' + str(index) for index in range(40)]
+    for index in range(6):
+        lines = churn(rand, lines)
+        repo.write('churn.txt', '\n'.join(lines) + '\n')
+        repo.commit('churn ' + str(index))
+
+    # pack everything so far, with deltas; later objects stay loose
+    repo.git('repack', '-adq')
+
+    repo.write('b.bin', b'\x00\x01\x02binary, edited\n')
+    repo.commit('binary edit')
+
+    os.chmod(os.path.join(repo.path, 'a.txt'), 0o755)
+    repo.commit('mode change')
+
+    repo.write('crlf.txt', 'windows\r\n')
+    repo.commit('crlf base')
+    repo.write('crlf.txt', 'windows\r\nline endings\r\nkept\r\n')
+    repo.commit('crlf')
+
+    repo.git('checkout', '-q', '-b', 'side')
+    repo.write('a.txt', 'zero\none\nTWO\nthree\nFOUR\nfive\nsix\n')
+    repo.commit('side')
+    repo.git('checkout', '-q', 'master')
+    for index in range(6, 9):
+        lines = churn(rand, lines)
+        repo.write('churn.txt', '\n'.join(lines) + '\n')
+        repo.commit('churn ' + str(index))
+    repo.merge('merge side', 'side')
+
+    return repo
+
+def gitLog(repo):
+    """
+    returns the (commit properties, stats) of every commit, as read by Git.log from git log
+    """
+    process = subprocess.Popen('git log ' + Git.LOG_FORMAT, shell=True, cwd=repo.path,
+                               env=repo.env, stdout=subprocess.PIPE)
+    try:
+        return list(Git.readLog(process.stdout))
+    finally:
+        process.stdout.close()
+        process.wait()
+
+def objectsLog(repo):
+    """
+    returns the (commit properties, stats) of every commit, as read by GitObjects.log
+    """
+    store = ObjectStore(repo.path)
+    try:
+        shas = GitObjects.walk(store, store.resolveRef('HEAD'), None)
+        shas.reverse()
+        return list(GitObjects.readObjects(store, shas))
+    finally:
+        store.close()
+
+def testFixtureNumstat():
+    repo = buildFixture()
+    try:
+        log = gitLog(repo)
+        assert([commit['commit_message'] for commit, stats in log] == list(EXPECTED_NUMSTAT))
+        for commit, stats in log:
+            assert(stats == EXPECTED_NUMSTAT[commit['commit_message']]), commit['commit_message']
+    finally:
+        repo.remove()
+
+def testObjectsMatchGitLog():
+    repo = buildFixture()
+    try:
+        expected = gitLog(repo)
+        actual = objectsLog(repo)
+
+        assert(len(actual) == len(expected) == len(EXPECTED_NUMSTAT))
+        for (expectedCommit, expectedStats), (actualCommit, actualStats) in zip(expected, actual):
+            assert(actualCommit == expectedCommit), expectedCommit['commit_message']
+            assert(actualStats == expectedStats), expectedCommit['commit_message']
+    finally:
+        repo.remove()
+
+def testCountChangesMatchesGitDiff():
+    # line counts of random edits, against git diff --numstat of the same files
+    repo = FixtureRepository()
+    rand = random.Random(14)
+    try:
+        for index in range(30):
+            old = churn(rand, ['line ' + str(rand.randint(0, 20)) for line in range(rand.randint(0, 60))])
+            new = churn(rand, old)
+            repo.write('old.txt', '\n'.join(old) + '\n')
+            repo.write('new.txt', '\n'.join(new) + '\n')
+
+            # git diff --no-index exits with 1 when the files differ
+            numstat = subprocess.run(['git', 'diff', '--no-index', '--numstat', 'old.txt', 'new.txt'],
+                                     cwd=repo.path, env=repo.env, stdout=subprocess.PIPE).stdout or b'0\t0\t'
+            added, deleted = numstat.split(b'\t')[:2]
+            oldLines = splitLines(('\n'.join(old) + '\n').encode())
+            newLines = splitLines(('\n'.join(new) + '\n').encode())
+            assert(countChanges(oldLines, newLines) == (int(added), int(deleted)))
+    finally:
+        repo.remove()
+
+class Repository:
+    def __init__(self, repo_id):
+        self.id = repo_id
+
+    def __str__(self):
+        return self.id
+
+def adapterLog(adapter, repo):
+    return [dict(commit) for commit in adapter.log(adapter, repo, True, IngestState(repo.id))]
+
+def testPartialClone():
+    # a mirror cloned with blob_filter blob:none has none of the blobs to diff yet
+    repo = buildFixture()
+    mirror = Repository('test-gitobjects-partial')
+    mirrorPath = Git.repoDirectory(mirror.id)
+    try:
+        repo.git('config', 'uploadpack.allowFilter', 'true')
+        repo.git('config', 'uploadpack.allowAnySHA1InWant', 'true')
+        repo.git('clone', '-q', '--mirror', '--filter=blob:none', 'file://' + repo.path, mirrorPath)
+        missing = repo.git('-C', mirrorPath, 'rev-list', '--objects', '--missing=print', 'HEAD')
+        assert(b'\n?' in b'\n' + missing)
+
+        actual = adapterLog(GitObjects, mirror)
+        expected = adapterLog(Git, mirror)
+        assert(len(actual) == len(EXPECTED_NUMSTAT))
+        assert(actual == expected)
+    finally:
+        repo.remove()
+        shutil.rmtree(mirrorPath, ignore_errors=True)
+
+if __name__ == '__main__':
+    logging.info('Test reading git objects... ')
+    testFixtureNumstat()
+    testObjectsMatchGitLog()
+    testCountChangesMatchesGitDiff()
+    testPartialClone()
+    logging.info("Passed tests")
@@ -0,0 +1,100 @@
+"""
+Tests the NumPy GLM backend against the output of R's summary(glm(...,
+family = binomial)) on the mtcars data set that ships with R.
+"""
+import numpy
+from analyzer.glm import *
+from caslogging import logging
+
+# mpg, hp, wt, vs, am of the 32 cars of R's mtcars
+MTCARS = [
+    (21.0, 110, 2.620, 0, 1), (21.0, 110, 2.875, 0, 1), (22.8, 93, 2.320, 1, 1), (21.4, 110, 3.215, 1, 0),
+    (18.7, 175, 3.440, 0, 0), (18.1, 105, 3.460, 1, 0), (14.3, 245, 3.570, 0, 0), (24.4, 62, 3.190, 1, 0),
+    (22.8, 95, 3.150, 1, 0), (19.2, 123, 3.440, 1, 0), (17.8, 123, 3.440, 1, 0), (16.4, 180, 4.070, 0, 0),
+    (17.3, 180, 3.730, 0, 0), (15.2, 180, 3.780, 0, 0), (10.4, 205, 5.250, 0, 0), (10.4, 215, 5.424, 0, 0),
+    (14.7, 230, 5.345, 0, 0), (32.4, 66, 2.200, 1, 1), (30.4, 52, 1.615, 1, 1), (33.9, 65, 1.835, 1, 1),
+    (21.5, 97, 2.465, 1, 0), (15.5, 150, 3.520, 0, 0), (15.2, 150, 3.435, 0, 0), (13.3, 245, 3.840, 0, 0),
+    (19.2, 175, 3.845, 0, 0), (27.3, 66, 1.935, 1, 1), (26.0, 91, 2.140, 0, 1), (30.4, 113, 1.513, 1, 1),
+    (15.8, 264, 3.170, 0, 1), (19.7, 175, 2.770, 0, 1), (15.0, 335, 3.570, 0, 1), (21.4, 109, 2.780, 1, 1),
+]
+
+# summary(glm(am ~ hp + wt, family = binomial, data = mtcars))$coefficients, as printed by R
+AM_HP_WT = [
+    ("(Intercept)", "18.86630", "7.44356", "2.535", "0.01126"),
+    ("hp", "0.03626", "0.01773", "2.044", "0.04091"),
+    ("wt", "-8.08348", "3.06868", "-2.634", "0.00843"),
+]
+
+# summary(glm(vs ~ mpg, family = binomial, data = mtcars))$coefficients, as printed by R
+VS_MPG = [
+    ("(Intercept)", "-8.8331", "3.1623", "-2.793", "0.00522"),
+    ("mpg", "0.4304", "0.1584", "2.717", "0.00659"),
+]
+
+def columns():
+    data = numpy.array(MTCARS, dtype=float)
+    return dict((name, data[:, index]) for index, name in enumerate(["mpg", "hp", "wt", "vs", "am"]))
+
+def assertPrinted(value, printed):
+    # equal to the digits R printed
+    decimals = len(printed.split(".")[1])
+    assert(abs(value - float(printed)) <= 0.5 * 10 ** -decimals), (value, printed)
+
+def assertSummary(fit, expected):
+    assert([row[0] for row in fit.summary] == [row[0] for row in expected])
+    for row, expected_row in zip(fit.summary, expected):
+        for value, printed in zip(row[1:], expected_row[1:]):
+            assertPrinted(value, printed)
+
+def testFitMatchesR():
+    data = columns()
+    assertSummary(NumpyGlmBackend(data, data["am"]).fit(["hp", "wt"]), AM_HP_WT)
+    assertSummary(NumpyGlmBackend(data, data["vs"]).fit(["mpg"]), VS_MPG)
+
+def testMissingValuesAreOmitted():
+    # like na.omit, rows missing a value of the formula are left out
+    data = columns()
+    data = dict((name, numpy.append(values, [numpy.nan, 120.0])) for name, values in data.items())
+    data["hp"][-1] = numpy.nan
+    data["am"][-2:] = [1, 0]
+
+    fit = NumpyGlmBackend(data, data["am"]).fit(["hp", "wt"])
+    assertSummary(fit, AM_HP_WT)
+
+def testAliasedTerms():
+    # like R, a term that is a linear combination of the terms before it has an NA coefficient
+    data = columns()
+    data["wt2"] = 2 * data["wt"]
+
+    fit = NumpyGlmBackend(data, data["am"]).fit(["hp", "wt", "wt2"])
+    assertSummary(fit, AM_HP_WT)
+    assert(numpy.isnan(fit.coefficients["wt2"]))
+    try:
+        fit.pValue(3)
+        assert(False)
+    except IndexError:
+        pass
+
+def testModelCache():
+    data = columns()
+    cache = ModelCache(NumpyGlmBackend(data, data["am"]))
+
+    fit = cache.fit(["hp", "wt"])
+    assert(cache.fit(["hp", "wt"]) is fit)
+    cache.fit(["hp"])
+    assert(cache.num_fits == 2 and cache.num_reused == 1)
+
+def testBackends():
+    assert(getBackendClass("numpy") is NumpyGlmBackend)
+    assert(getBackendClass("r") is RGlmBackend)
+    assert(getBackendClass("unknown") is RGlmBackend)
+    assert(NumpyGlmBackend.concurrent and not RGlmBackend.concurrent)
+
+if __name__ == '__main__':
+    logging.info('Test fitting GLMs... ')
+    testFitMatchesR()
+    testMissingValuesAreOmitted()
+    testAliasedTerms()
+    testModelCache()
+    testBackends()
+    logging.info("Passed tests")
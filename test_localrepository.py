@@ -0,0 +1,65 @@
+"""
+Tests writing ingested commits to the commits table. Needs the database
+configured in config.json, initialized with `python script.py initDb`.
+"""
+from ingester.localrepository import *
+from sqlalchemy.dialects import postgresql
+from caslogging import logging
+
+TEST_REPO_ID = 'test-localrepository'
+
+class TestRepository:
+    id = TEST_REPO_ID
+
+def commitDicts(count, la):
+    return [{'commit_hash': '%040x' % index, 'repository_id': TEST_REPO_ID,
+             'la': la, 'commit_message': 'commit ' + str(index)} for index in range(count)]
+
+def deleteTestCommits():
+    session = Session()
+    session.query(Commit).filter(Commit.repository_id == TEST_REPO_ID).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+
+def testUpsertStaysBelowBindParameterLimit():
+    # PostgreSQL accepts at most 65535 bind parameters in one statement
+    localRepository = LocalRepository(TestRepository())
+    statement, rows = localRepository.upsertStatement(commitDicts(localRepository.BULK_INSERT_SIZE, 1))
+
+    compiled = statement.compile(dialect=postgresql.dialect(), column_keys=list(rows[0]))
+    assert(len(rows) == localRepository.BULK_INSERT_SIZE)
+    assert(len(compiled.params) <= len(Commit.__table__.columns))
+
+def testWriteMaximumBatch():
+    localRepository = LocalRepository(TestRepository())
+    deleteTestCommits()
+
+    try:
+        localRepository.writeCommits(commitDicts(localRepository.BULK_INSERT_SIZE, 1))
+
+        session = Session()
+        commits = session.query(Commit).filter(Commit.repository_id == TEST_REPO_ID)
+        assert(commits.count() == localRepository.BULK_INSERT_SIZE)
+
+        # re-ingesting updates the commits but keeps the columns set by the analyzer
+        commits.update({Commit.linked: True}, synchronize_session=False)
+        session.commit()
+        session.close()
+
+        localRepository.writeCommits(commitDicts(localRepository.BULK_INSERT_SIZE, 2))
+
+        session = Session()
+        commits = session.query(Commit).filter(Commit.repository_id == TEST_REPO_ID)
+        assert(commits.count() == localRepository.BULK_INSERT_SIZE)
+        assert(commits.filter(Commit.la == 2).count() == localRepository.BULK_INSERT_SIZE)
+        assert(commits.filter(Commit.linked == True).count() == localRepository.BULK_INSERT_SIZE)
+        session.close()
+
+    finally:
+        deleteTestCommits()
+
+if __name__ == '__main__':
+    logging.info('Test writing commits... ')
+    testUpsertStaysBelowBindParameterLimit()
+    testWriteMaximumBatch()
+    logging.info("Passed tests")
@@ -0,0 +1,91 @@
+"""
+Tests the median model: the Wilcoxon rank sum test against the p-values of R's
+wilcox.test, and the medians stored for a repository. Storing them needs the
+database configured in config.json, initialized with `python script.py initDb`.
+"""
+import math
+import numpy
+from analyzer.medianmodel import *
+from test_glm import MTCARS
+from caslogging import logging
+
+TEST_REPO_ID = 'test-medianmodel'
+
+def assertPrinted(value, printed):
+    # equal to the significant digits R printed
+    digits = len(printed.lstrip("0.").replace(".", ""))
+    assert(abs(value - float(printed)) <= 0.5 * 10 ** (math.floor(math.log10(float(printed))) - digits + 1)), (value, printed)
+
+def testWilcoxonMatchesR():
+    # example(wilcox.test): exact, W = 35, p-value = 0.2544
+    x = numpy.array([0.80, 0.83, 1.89, 1.04, 1.45, 1.38, 1.91, 1.64, 0.73, 1.46])
+    y = numpy.array([1.15, 0.88, 0.90, 0.74, 1.21])
+    assertPrinted(wilcoxonTest(x, y), "0.2544")
+    assertPrinted(wilcoxonTest(y, x), "0.2544")
+
+    # wilcox.test(mpg ~ am, data = mtcars): with ties, W = 42, p-value = 0.001871
+    mpg = numpy.array([car[0] for car in MTCARS])
+    am = numpy.array([car[4] for car in MTCARS])
+    assertPrinted(wilcoxonTest(mpg[am == 0], mpg[am == 1]), "0.001871")
+
+    # wilcox.test(1, 2): p-value = 1; wilcox.test(rep(1, 5), rep(1, 5)): p-value = NA
+    assert(wilcoxonTest(numpy.array([1.0]), numpy.array([2.0])) == 1.0)
+    assert(math.isnan(wilcoxonTest(numpy.ones(5), numpy.ones(5))))
+
+def testEmptySample():
+    try:
+        wilcoxonTest(numpy.array([]), numpy.array([1.0]))
+        assert(False)
+    except ValueError:
+        pass
+
+def testWilcoxonTestsByColumn():
+    # each column is tested on its own, leaving out its NaNs
+    random = numpy.random.RandomState(25)
+    x = random.randint(0, 6, size=(60, 4)).astype(float)
+    y = random.randint(0, 8, size=(45, 4)).astype(float)
+    x[:, 1] = random.normal(size=60)
+    y[:, 1] = random.normal(size=45)
+    x[random.rand(60, 4) < 0.5] = numpy.nan
+    y[:, 3] = numpy.nan
+
+    p_values = wilcoxonTests(x, y)
+    for column in range(3):
+        expected = wilcoxonTest(x[:, column][~numpy.isnan(x[:, column])], y[:, column][~numpy.isnan(y[:, column])])
+        assert(p_values[column] == expected), column
+    assert(numpy.isnan(p_values[3]))
+
+def deleteTestMetrics():
+    session = Session()
+    session.query(Metrics).filter(Metrics.repo == TEST_REPO_ID).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+
+def testCalculateMedians():
+    # la holds the mpg of cars with a manual (buggy) or automatic transmission; ns is constant
+    # and the other metrics have no values
+    nan = float("nan")
+    rows = [(1.0, nan, nan, nan, car[0]) + (nan,) * 8 + (car[4] == 1,) for car in MTCARS]
+    metrics = RepositoryMetrics()
+    metrics.addRows(rows)
+
+    deleteTestMetrics()
+    try:
+        MedianModel(metrics, TEST_REPO_ID).buildModel()
+
+        session = Session()
+        stored = session.query(Metrics).filter(Metrics.repo == TEST_REPO_ID).one()
+        assert(stored.labuggy == 22.8 and stored.lanonbuggy == 17.3 and stored.la_sig == 1)
+        assert(stored.nsbuggy == 1 and stored.nsnonbuggy == 1 and stored.ns_sig == 0)
+        assert(stored.nd_sig is None and stored.sexp_sig is None)
+        session.close()
+    finally:
+        deleteTestMetrics()
+
+if __name__ == '__main__':
+    logging.info('Test the median model... ')
+    testWilcoxonMatchesR()
+    testEmptySample()
+    testWilcoxonTestsByColumn()
+    testCalculateMedians()
+    logging.info("Passed tests")
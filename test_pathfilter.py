@@ -0,0 +1,97 @@
+"""
+Tests which changed files the linker links: the gitignore style globs of
+link_ignore and the linguist attributes of a repository's .gitattributes.
+"""
+import re
+from analyzer.pathfilter import *
+from test_gitobjects import FixtureRepository
+from caslogging import logging
+
+def matches(pattern, path):
+    return re.match(globToRegex(pattern), path) is not None
+
+def testGlobToRegex():
+    # a pattern without a slash matches the file name at any depth
+    assert(matches('*.min.js', 'app.min.js'))
+    assert(matches('*.min.js', 'static/js/app.min.js'))
+    assert(not matches('*.min.js', 'app.js'))
+
+    # others are relative to the root
+    assert(matches('docs/*.py', 'docs/conf.py'))
+    assert(not matches('docs/*.py', 'src/docs/conf.py'))
+    assert(not matches('docs/*.py', 'docs/api/conf.py'))
+    assert(matches('/setup.py', 'setup.py'))
+    assert(not matches('/setup.py', 'src/setup.py'))
+
+    # '**' crosses directories, '*' and '?' don't
+    assert(matches('vendor/**', 'vendor/a/b/c.py'))
+    assert(matches('**/generated/*.java', 'generated/A.java'))
+    assert(matches('**/generated/*.java', 'src/main/generated/A.java'))
+    assert(matches('src/?.c', 'src/a.c'))
+    assert(not matches('src/?.c', 'src/ab.c'))
+    assert(not matches('src/*.c', 'src/a/b.c'))
+
+    # character classes and special characters
+    assert(matches('test_[ab].py', 'test_a.py'))
+    assert(not matches('test_[!ab].py', 'test_a.py'))
+    assert(matches('test_[!ab].py', 'test_c.py'))
+    assert(matches('a+b.py', 'a+b.py'))
+    assert(not matches('a.py', 'a.pyc'))
+
+def testAccepts():
+    link_ignore = config['system'].get('link_ignore')
+    config['system']['link_ignore'] = ['docs/', '*.min.js']
+
+    repo = FixtureRepository()
+    try:
+        repo.write('.gitattributes', '# linguist overrides\n'
+                                     'generated/*.java linguist-generated\n'
+                                     'third_party/** linguist-vendored=true\n'
+                                     'third_party/ours/** -linguist-vendored\n'
+                                     'lib/*.c linguist-vendored=false\n'
+                                     'build/ linguist-generated\n')
+        repo.commit('attributes')
+        pathFilter = PathFilter(repo.path)
+
+        assert(pathFilter.accepts('src/main.c'))
+        assert(pathFilter.accepts('src/Main.JAVA'))
+        assert(not pathFilter.accepts('README.md'))
+        assert(not pathFilter.accepts('Makefile'))
+
+        # link_ignore
+        assert(not pathFilter.accepts('docs/conf.py'))
+        assert(not pathFilter.accepts('docs/api/conf.py'))
+        assert(not pathFilter.accepts('static/app.min.js'))
+        assert(pathFilter.accepts('static/app.js'))
+
+        # .gitattributes; the last line setting an attribute wins
+        assert(not pathFilter.accepts('generated/Parser.java'))
+        assert(not pathFilter.accepts('third_party/zlib/inflate.c'))
+        assert(pathFilter.accepts('third_party/ours/patch.c'))
+        assert(pathFilter.accepts('lib/util.c'))
+        assert(pathFilter.accepts('build/gen.c'))   # directory patterns don't apply to files
+
+        assert(pathFilter.acceptsAny('README.md,CAS_DELIMITER,src/main.c'))
+        assert(pathFilter.acceptsAny('src/main.c,CAS_DELIMITER'))
+        assert(not pathFilter.acceptsAny('README.md,CAS_DELIMITER,docs/conf.py'))
+        assert(pathFilter.acceptsAny('NULL'))
+        assert(pathFilter.acceptsAny(None))
+    finally:
+        repo.remove()
+        if link_ignore is None:
+            del config['system']['link_ignore']
+        else:
+            config['system']['link_ignore'] = link_ignore
+
+def testAcceptsWithoutRepository():
+    # no clone (or no .gitattributes) only filters by file ending
+    pathFilter = PathFilter('/nonexistent')
+    assert(pathFilter.accepts('src/main.py'))
+    assert(not pathFilter.accepts('src/main.txt'))
+
+if __name__ == '__main__':
+    logging.info('Test filtering linked files... ')
+    testGlobToRegex()
+    testAccepts()
+    testAcceptsWithoutRepository()
+    logging.info("Passed tests")